@@ -0,0 +1,123 @@
+"""
+.animation文件的读写。
+
+.animation文件使用JSON Lines格式：每行是一个关键帧，形如{"frame": 12.0, "hand_infos": {...}}，按帧号排序。
+写入时边生成边写，每攒够一批再写入磁盘，整首曲子的动画数据不需要同时放在内存里（批量计算时手型也是分批计算的，见Animator.prossess_hand_data_batch）。
+读取在Blender插件里（make_animation.py的iter_animation_entries），也兼容旧版本导出的、整个文件是一个json数组的.animation文件。
+
+另外还支持按通道存储的二进制格式（.animation.npz），见AnimationChannelWriter，
+Blender中可以直接用keyframe_points.foreach_set导入，不需要解析json。
+这个格式唯一的读取方是make_animation.py的make_animation_from_npz，它还没有在Blender里实际运行过，
+所以插件的make_animation暂时不导入.npz，需要手动调用make_animation_from_npz。
+"""
+
+import json
+import numpy as np
+from typing import Iterable
+
+
+def write_animation_entries(file_path: str, animation_entries: Iterable[dict], chunk_size: int = 4096) -> int:
+    """
+    把关键帧逐行写入.animation文件
+
+    Args:
+        file_path: 输出文件路径
+        animation_entries: 按帧号排序的关键帧，可以是生成器
+        chunk_size: 每攒够多少行写入一次
+
+    Returns:
+        int: 写入的关键帧数量
+    """
+    amount = 0
+    lines: list[str] = []
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for animation_entry in animation_entries:
+            lines.append(json.dumps(animation_entry, separators=(',', ':')))
+            lines.append('\n')
+            amount += 1
+            if len(lines) >= 2 * chunk_size:
+                f.write(''.join(lines))
+                lines.clear()
+        f.write(''.join(lines))
+    return amount
+
+
+def channel_data_path(obj_name: str, value_length: int) -> str:
+    """
+    物体名对应的动画属性，和make_animation.py的规则一致：名字里带rotation的是旋转（4个值为四元数），其余是位置
+    """
+    if "rotation" in obj_name.lower():
+        return "rotation_quaternion" if value_length == 4 else "rotation_euler"
+    return "location"
+
+
+class AnimationChannelWriter:
+    """
+    把按帧号排序的关键帧整理成按通道（物体名 + data_path）存储的列式数据：
+    每个通道一个frames数组(K,)和一个float32的values数组(K, 分量数)，保存为.npz。
+
+    整理的规则和make_animation.py逐帧插入关键帧的结果相同：
+    - 帧号取整，负数帧丢掉；
+    - 同一通道同一帧有多个关键帧时，只保留最后一个；
+    - 四元数和上一个关键帧的点积为负时取反，保证插值走最短路径。
+    """
+
+    def __init__(self):
+        self._channels: dict[tuple[str, str], tuple[list[float], list[list[float]]]] = {}
+        self._previous_quaternions: dict[str, list[float]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(frames) for frames, _ in self._channels.values())
+
+    def add(self, animation_entry: dict):
+        frame = int(animation_entry.get("frame", 0))
+        if frame < 0:
+            return
+
+        for obj_name, value in animation_entry.get("hand_infos", {}).items():
+            data_path = channel_data_path(obj_name, len(value))
+            if data_path == "rotation_quaternion":
+                previous_quaternion = self._previous_quaternions.get(obj_name)
+                if previous_quaternion is not None and sum(a * b for a, b in zip(previous_quaternion, value)) < 0:
+                    value = [-x for x in value]
+                self._previous_quaternions[obj_name] = value
+
+            channel = self._channels.get((obj_name, data_path))
+            if channel is None:
+                channel = ([], [])
+                self._channels[(obj_name, data_path)] = channel
+            frames, values = channel
+            if frames and frames[-1] == frame:
+                values[-1] = value
+            else:
+                frames.append(frame)
+                values.append(value)
+
+    def save_npz(self, file_path: str):
+        """
+        保存为.npz：object_names和data_paths给出每个通道，第i个通道的数据是frames_i和values_i
+        """
+        arrays: dict[str, np.ndarray] = {
+            'object_names': np.array([obj_name for obj_name, _ in self._channels], dtype=str),
+            'data_paths': np.array([data_path for _, data_path in self._channels], dtype=str)
+        }
+        for channel_index, (frames, values) in enumerate(self._channels.values()):
+            arrays[f'frames_{channel_index}'] = np.array(
+                frames, dtype=np.float32)
+            arrays[f'values_{channel_index}'] = np.array(
+                values, dtype=np.float32)
+        np.savez_compressed(file_path, **arrays)
+
+
+def write_animation_npz(file_path: str, animation_entries: Iterable[dict]) -> int:
+    """
+    把按帧号排序的关键帧保存为按通道存储的.animation.npz
+
+    Returns:
+        int: 整理后所有通道的关键帧数量之和
+    """
+    writer = AnimationChannelWriter()
+    for animation_entry in animation_entries:
+        writer.add(animation_entry)
+    writer.save_npz(file_path)
+    return len(writer)
@@ -1,10 +1,16 @@
 import json
-from src.utils import lerp_with_key_type_and_position, get_key_location, get_touch_point, get_actual_press_depth
+import heapq
+from src.utils import lerp_with_key_type_and_position, get_touch_point, get_actual_press_depth
 from src.piano.piano import Piano
+from src.recorder.handFile import HandTimeline
+from src.animation.avatarRig import AvatarRig, BLACK_KEY, WHITE_KEY, LOW_LEVEL, MIDDLE_LEVEL, HIGH_LEVEL
+from src.animation.handInfoCache import HandInfoCache
+from src.animation.batchSolver import SolvedHandStates, solve_hand_states, calculate_white_key_values, to_nested_lists
+from src.animation.animationFile import write_animation_entries, write_animation_npz
+from src.animation.keyframeReduction import KeyframeReductionReport, reduce_animation_entries, reduce_piano_key_animation
 import numpy as np
-from mathutils import Vector, Quaternion
-from typing import Any
 from enum import Enum
+from typing import Iterator, Optional
 
 
 class ActionPhase(Enum):
@@ -15,7 +21,7 @@ class ActionPhase(Enum):
 
 
 class Animator:
-    def __init__(self, hand_recorder_path: str, avatar_info_path: str, piano: Piano, FPS: int = 60):
+    def __init__(self, hand_recorder_path: str, avatar_info_path: str, piano: Piano, FPS: int = 60, validate_rig: bool = False):
         self.fps = FPS
         # 定义时间参数（以帧为单位）
         self.press_duration = self.fps / 24          # 按下耗时
@@ -26,193 +32,279 @@ class Animator:
         self.avatar_name = avatar_info_path.split('/')[-1].split('.')[0]
         self.midi_name = hand_recorder_path.split('/')[-1].split('.')[0]
         try:
-            with open(hand_recorder_path, 'r') as f:
-                self.hand_recorder = json.load(f)
-            with open(avatar_info_path, 'r') as f:
-                self.avatar_info = json.load(f)
-                self.config = self.avatar_info.get("config", {})
+            # 手型数据统一转换成列式的时间线，.npz文件可以直接读取各列
+            self.hand_timeline = HandTimeline.load(hand_recorder_path)
+            # 角色标定数据只解析一次，之后都从AvatarRig的数组中读取
+            # validate_rig为True时检查插值表和逐个插值的结果是否一致
+            self.rig = AvatarRig.load(
+                avatar_info_path, piano, validate_rig)
+            # 逐个状态计算时，相同的手型只算一次
+            self.hand_info_cache = HandInfoCache()
 
             print(f'已加载{hand_recorder_path} 和 {avatar_info_path}')
         except Exception as e:
             print(e)
 
-    def determine_hand_white_key_value(self, hand_fingers: list, is_left: bool = True) -> int:
+    def determine_hand_white_key_value(self, hand_timeline: HandTimeline, index: int, is_left: bool = True) -> int:
         """
         确定手部的white_key_value，用于动画计算
 
         Args:
-            hand_fingers: 手部手指列表
+            hand_timeline: 手型时间线
+            index: 手型状态在时间线中的下标
             is_left: 是否为左手，默认为True
 
         Returns:
             int: white_key_value (0或1)
         """
-        thumb_finger_index = 4 if is_left else 5
-        white_key_value = 1
-
-        for finger in hand_fingers:
-            if finger.get("pressed"):
-                # 检查是否为拇指且按的是黑键
-                if (finger["key_note"]["is_black"] and
-                        finger.get("finger_index") == thumb_finger_index):
-                    white_key_value = 0
-                    break
-
-        return white_key_value
-
-    def prossess_hand_data(self, recorders: list[Any]):
-        animation_data = []
-
-        for i in range(len(recorders)):
-            recorder = recorders[i]
-            next_recorder = recorders[i +
-                                      1] if i + 1 < len(recorders) else None
-            current_frame = recorder.get("frame")
-
-            current_is_left = recorder.get(
-                "left_hand", None) is not None
-            hand_item = recorder.get(
-                "left_hand") if current_is_left else recorder.get("right_hand")
+        thumb_slot = hand_timeline.thumb_slot(is_left)
+        thumb_note = int(hand_timeline.note[index, thumb_slot])
+
+        # 拇指按的是黑键时为0
+        if hand_timeline.pressed[index, thumb_slot] and (thumb_note % 12) in self.piano.black_keys:
+            return 0
+
+        return 1
+
+    def prossess_hand_data(self, hand_timeline: HandTimeline) -> Iterator[dict]:
+        """
+        逐个生成一只手的关键帧，按帧号排序
+
+        Args:
+            hand_timeline: 同一只手的手型时间线，按frame排序
+        """
+        state_amount = len(hand_timeline)
+
+        for i in range(state_amount):
+            has_next = i + 1 < state_amount
+
+            current_is_left = bool(hand_timeline.is_left[i])
             hand_white_key_value = self.determine_hand_white_key_value(
-                hand_item.get("fingers"), current_is_left)
+                hand_timeline, i, current_is_left)
 
             final_hand_white_key_value = hand_white_key_value
-            next_rest_info = None
             next_ready_info = None
-            next_frame = None
 
-            if next_recorder is not None:
-                next_frame = next_recorder.get("frame")
-                next_hand_item = next_recorder.get(
-                    "left_hand") if current_is_left else next_recorder.get("right_hand")
+            if has_next:
                 next_hand_white_key_value = self.determine_hand_white_key_value(
-                    next_hand_item.get("fingers"), current_is_left)
+                    hand_timeline, i + 1, current_is_left)
                 final_hand_white_key_value = hand_white_key_value * \
                     next_hand_white_key_value
-                next_hand_info = self.cacluate_hand_info(
-                    next_hand_item, current_is_left, next_hand_white_key_value)
+                next_hand_info = self._get_hand_info(
+                    hand_timeline, i + 1, current_is_left, next_hand_white_key_value)
                 next_ready_info = next_hand_info[ActionPhase.READY]
 
             # 预备或抬起动作
-            current_hand_info = self.cacluate_hand_info(
-                hand_item, current_is_left, final_hand_white_key_value)
-            ready_info = current_hand_info[ActionPhase.READY]
-
-            # 按下动作
-            attack_info = current_hand_info[ActionPhase.ATTACK]
-
-            # 保持按下动作
-            hold_info = current_hand_info[ActionPhase.HOLD]
-
-            # 休息动作
-            rest_info = current_hand_info[ActionPhase.REST]
-
-            #  如果是第一个手型，需要添加一个预备动作
-            if i == 0:
-                # 预备动作 - 提前press_duration秒到达预备位置（如果时间允许）
-                rest_frame = current_frame - self.press_duration
-                animation_data.append({
-                    "frame": rest_frame,
-                    "hand_infos": ready_info
-                })
-
-            # 按下动作 - 在当前帧按下（必须有）
-            animation_data.append({
-                "frame": current_frame,
-                "hand_infos": attack_info
-            })
+            current_hand_info = self._get_hand_info(
+                hand_timeline, i, current_is_left, final_hand_white_key_value)
 
-            if next_frame is None:  # 如果没有下一个手型，就跳过
-                continue
+            for frame, phase, use_next_ready in self._sorted_state_keyframes(hand_timeline.frame, i):
+                yield {
+                    "frame": frame,
+                    "hand_infos": next_ready_info if use_next_ready else current_hand_info[phase]
+                }
 
-            # 如果两个手型之间的时间小于等于移动+按下，也就是press_duration，那就干脆不要有中间动作
-            if next_frame-current_frame <= self.press_duration:
-                continue
+    def _get_hand_info(self, hand_timeline: HandTimeline, index: int, is_left: bool, hand_white_key_value: int) -> dict:
+        """
+        带缓存的cacluate_hand_info，返回的字典是共用的
+        """
+        return self.hand_info_cache.get_hand_info(
+            hand_timeline, index, hand_white_key_value,
+            lambda: self.cacluate_hand_info(hand_timeline, index, is_left, hand_white_key_value))
 
-            # 能运行到这里就是有足够的时间移动+按下，那么就在下一个指法之前插入一个预备帧，时间为next_frame - press_duration
-            next_ready_frame = next_frame - self.press_duration
-            # 如果没有 enough time to insert prepare frame, skip it
-            if next_ready_frame is not None and next_ready_info is not None:
-                animation_data.append({
-                    "frame": next_ready_frame,
-                    "hand_infos": next_ready_info
-                })
-
-            # 如果时间不够插入当前手型的休息帧，那么到这里就结束
-            if next_frame-current_frame <= self.press_duration+self.hand_move_duration:
-                continue
+    def _sorted_state_keyframes(self, frames: np.ndarray, i: int) -> list[tuple[float, ActionPhase, bool]]:
+        """
+        按帧号排序的_iterate_state_keyframes。
 
-            # 时间足够的话添加一个当前状态的休息帧，等于此时手指已经抬起来准备移动了
-            rest_frame = next_frame - \
-                self.press_duration - self.hand_move_duration
+        第i个手型的关键帧都落在[frames[i], frames[i+1])之间（第一个手型多一个提前的预备帧），
+        所以每个手型内部排好序后，整只手的关键帧就是有序的，不需要再整体排序
+        """
+        return sorted(self._iterate_state_keyframes(frames, i), key=lambda keyframe: keyframe[0])
 
-            if rest_frame is not None:
-                animation_data.append({
-                    "frame": rest_frame,
-                    "hand_infos": rest_info
-                })
+    def _iterate_state_keyframes(self, frames: np.ndarray, i: int) -> Iterator[tuple[float, ActionPhase, bool]]:
+        """
+        第i个手型状态产生的关键帧，按添加顺序给出(frame, 使用的阶段, 是否使用下一个手型的预备动作)
+        """
+        current_frame = float(frames[i])
 
-            # 如果时间不够再多插入保持按下状态的帧，那么到这里也结束
-            if next_frame-current_frame <= self.hand_move_duration + self.press_duration + self.up_duration:
-                continue
+        #  如果是第一个手型，需要添加一个预备动作
+        if i == 0:
+            # 预备动作 - 提前press_duration秒到达预备位置（如果时间允许）
+            yield current_frame - self.press_duration, ActionPhase.READY, False
 
-            # 时间仍然充足，添加一个hold状态的帧
+        # 按下动作 - 在当前帧按下（必须有）
+        yield current_frame, ActionPhase.ATTACK, False
 
-            hold_end_frame = next_frame - self.press_duration - \
-                self.hand_move_duration - self.up_duration
-            animation_data.append({
-                "frame": hold_end_frame,
-                "hand_infos": hold_info
-            })
+        if i + 1 >= len(frames):  # 如果没有下一个手型，就跳过
+            return
+        next_frame = float(frames[i + 1])
 
-            # 时间再够的话，再添加一个hold开始的帧
-            if next_frame-current_frame <= self.hand_move_duration + self.press_duration + 2 * self.up_duration:
-                continue
+        # 如果两个手型之间的时间小于等于移动+按下，也就是press_duration，那就干脆不要有中间动作
+        if next_frame-current_frame <= self.press_duration:
+            return
 
-            hold_start_frame = current_frame + self.up_duration
-            animation_data.append({
-                "frame": hold_start_frame,
-                "hand_infos": hold_info
-            })
+        # 能运行到这里就是有足够的时间移动+按下，那么就在下一个指法之前插入一个预备帧，时间为next_frame - press_duration
+        yield next_frame - self.press_duration, ActionPhase.READY, True
+
+        # 如果时间不够插入当前手型的休息帧，那么到这里就结束
+        if next_frame-current_frame <= self.press_duration+self.hand_move_duration:
+            return
 
-        return animation_data
+        # 时间足够的话添加一个当前状态的休息帧，等于此时手指已经抬起来准备移动了
+        yield next_frame - self.press_duration - self.hand_move_duration, ActionPhase.REST, False
 
-    def generate_animation_info(self):
+        # 如果时间不够再多插入保持按下状态的帧，那么到这里也结束
+        if next_frame-current_frame <= self.hand_move_duration + self.press_duration + self.up_duration:
+            return
 
-        left_hand_recorders = []
-        right_hand_recorders = []
+        # 时间仍然充足，添加一个hold状态的帧
+        yield next_frame - self.press_duration - self.hand_move_duration - self.up_duration, ActionPhase.HOLD, False
 
-        # 先分成左右手两个列表
-        for item in self.hand_recorder:
-            left_hand_item = item.get("left_hand", None)
-            right_hand_item = item.get("right_hand", None)
-            if left_hand_item is not None:
-                left_hand_recorders.append(item)
-            elif right_hand_item is not None:
-                right_hand_recorders.append(item)
-            else:
-                print("Error: hand_item is None")
+        # 时间再够的话，再添加一个hold开始的帧
+        if next_frame-current_frame <= self.hand_move_duration + self.press_duration + 2 * self.up_duration:
+            return
+
+        yield current_frame + self.up_duration, ActionPhase.HOLD, False
+
+    def prossess_hand_data_batch(self, hand_timeline: HandTimeline, chunk_size: int = 1024) -> Iterator[dict]:
+        """
+        prossess_hand_data的批量版本，结果相同：手型数据用batchSolver批量计算，再按相同的规则生成关键帧
 
-        left_hand_animation_data = self.prossess_hand_data(
-            left_hand_recorders)
+        每次只计算chunk_size个手型，这一批的关键帧都输出以后再算下一批，所以同时存在的中间结果不会随曲子长度增长
 
-        right_hand_animation_data = self.prossess_hand_data(
-            right_hand_recorders)
+        Args:
+            hand_timeline: 同一只手的手型时间线，按frame排序
+            chunk_size: 每批计算的手型数量
+        """
+        state_amount = len(hand_timeline)
+        if state_amount == 0:
+            return
+
+        white_key_values = calculate_white_key_values(
+            hand_timeline, self.piano)
+        # 有下一个手型时，当前手型的white_key_value要和下一个手型的相乘
+        final_white_key_values = white_key_values.copy()
+        final_white_key_values[:-1] *= white_key_values[1:]
+
+        for start in range(0, state_amount, chunk_size):
+            end = min(start + chunk_size, state_amount)
+            current_hand_infos = self._export_solved_hand_infos(solve_hand_states(
+                self.rig, hand_timeline, np.arange(start, end), final_white_key_values[start:end]), hand_timeline.is_left[start:end], hand_timeline.finger_number)
+            # 下一个手型的预备动作使用它自己的white_key_value，next_hand_infos[i - start]对应第i+1个手型
+            next_end = min(end + 1, state_amount)
+            next_hand_infos = self._export_solved_hand_infos(solve_hand_states(
+                self.rig, hand_timeline, np.arange(start + 1, next_end), white_key_values[start + 1:next_end]), hand_timeline.is_left[start + 1:next_end], hand_timeline.finger_number)
+
+            for i in range(start, end):
+                for frame, phase, use_next_ready in self._sorted_state_keyframes(hand_timeline.frame, i):
+                    yield {
+                        "frame": frame,
+                        "hand_infos": next_hand_infos[i - start](ActionPhase.READY) if use_next_ready else current_hand_infos[i - start](phase)
+                    }
+
+    def _export_solved_hand_infos(self, solved: SolvedHandStates, is_left: np.ndarray, finger_number: int) -> list:
+        """
+        把批量计算的结果转换成和cacluate_hand_info相同格式的字典，每个状态返回一个按阶段生成字典的函数，
+        只有真正用到的阶段才会生成
+        """
+        hand_positions, pivot_positions, hand_rotations, finger_positions = to_nested_lists(
+            solved.hand_positions, solved.pivot_positions, solved.hand_rotations, solved.finger_positions)
+        phase_indexes = {phase: phase_index for phase_index,
+                         phase in enumerate(ActionPhase)}
+
+        def make_hand_info_getter(row: int, is_left: bool):
+            suffix = "L" if is_left else "R"
+            finger_offset = 0 if is_left else finger_number
+
+            def get_hand_info(phase: ActionPhase) -> dict:
+                phase_index = phase_indexes[phase]
+                hand_info = {
+                    f"H_{suffix}": hand_positions[row][phase_index],
+                    f"HP_{suffix}": pivot_positions[row],
+                    f"H_rotation_{suffix}": hand_rotations[row]
+                }
+                for slot, finger_position in enumerate(finger_positions[row][phase_index]):
+                    hand_info[f"{slot + finger_offset}_{suffix}"] = finger_position
+                return hand_info
 
-        animation_data = left_hand_animation_data + right_hand_animation_data
-        # 按帧号排序
-        animation_data.sort(key=lambda x: x["frame"])
+            return get_hand_info
+
+        return [make_hand_info_getter(row, bool(row_is_left))
+                for row, row_is_left in enumerate(is_left)]
+
+    def generate_animation_info(self, use_batch: bool = True, columnar: bool = False, keyframe_tolerance: Optional[float] = 1e-4, linear_keyframe_reduction: bool = False):
+        """
+        Args:
+            use_batch: 是否使用批量计算
+            columnar: 为True时保存为按通道存储的.animation.npz（见AnimationChannelWriter），
+                插件目前不会自动导入（make_animation_from_npz还没有在Blender里运行过，需要手动调用），否则保存为JSON Lines格式的.animation
+            keyframe_tolerance: 关键帧精简允许的误差，见keyframeReduction，为None时不精简
+            linear_keyframe_reduction: 为False时只合并连续相同的值，在Blender默认的贝塞尔插值下结果不变；
+                为True时还会去掉线性插值能还原的关键帧，只适用于导入时使用LINEAR插值的情况
+        """
+
+        # 先分成左右手两条时间线
+        left_hand_timeline = self.hand_timeline.select(
+            self.hand_timeline.is_left)
+        right_hand_timeline = self.hand_timeline.select(
+            ~self.hand_timeline.is_left)
+
+        # 默认使用批量计算，prossess_hand_data逐个状态计算，结果相同
+        prossess_hand_data = self.prossess_hand_data_batch if use_batch else self.prossess_hand_data
+        left_hand_animation_data = prossess_hand_data(left_hand_timeline)
+
+        right_hand_animation_data = prossess_hand_data(right_hand_timeline)
+
+        # 两只手的关键帧各自已经按帧号排好，归并后边生成边写入，帧号相同时左手在前
+        animation_data = heapq.merge(
+            left_hand_animation_data, right_hand_animation_data, key=lambda x: x["frame"])
+        if keyframe_tolerance is not None:
+            reduction_report = KeyframeReductionReport('动画')
+            animation_data = reduce_animation_entries(
+                animation_data, reduction_report, keyframe_tolerance, linear=linear_keyframe_reduction)
 
         file_path = f"output/animation_recorders/{self.midi_name}_{self.avatar_name}.animation"
-        with open(file_path, "w") as f:
-            json.dump(animation_data, f)
+        if columnar:
+            file_path += ".npz"
+            write_animation_npz(file_path, animation_data)
+        else:
+            write_animation_entries(file_path, animation_data)
+        if not use_batch:
+            self.hand_info_cache.print_stats()
 
         print(f"动画数据已保存到{file_path}")
+        if keyframe_tolerance is not None:
+            reduction_report.print_report(max_lines=0)
 
         # 保存钢琴键动画数据
-        self.save_piano_key_animation_data()
+        self.save_piano_key_animation_data(
+            keyframe_tolerance=keyframe_tolerance, linear_keyframe_reduction=linear_keyframe_reduction)
 
-    def cacluate_hand_info(self, hand_item: Any, is_left: bool = True, hand_white_key_value: int = 1) -> dict:
+    def _lerp_base_state(self, base_states: np.ndarray, hand: int, hand_white_key_value: int, hand_note: float) -> np.ndarray:
+        """
+        在某只手的低、中、高三个基准状态之间按hand_note插值
+
+        Args:
+            base_states: AvatarRig中形状为(手, 键类型, 位置, ...)的数组
+        """
+        low_position, middle_position, high_position = self.rig.level_positions[hand]
+        values = base_states[hand]
+        # lerp在权重超出[0, 1]时直接返回基准状态本身，这里复制一份，避免后续修改到AvatarRig里的数组
+        return np.array(lerp_with_key_type_and_position(
+            hand_white_key_value,
+            hand_note,
+            high_position,
+            middle_position,
+            low_position,
+            values[WHITE_KEY, HIGH_LEVEL],
+            values[BLACK_KEY, HIGH_LEVEL],
+            values[WHITE_KEY, MIDDLE_LEVEL],
+            values[BLACK_KEY, MIDDLE_LEVEL],
+            values[WHITE_KEY, LOW_LEVEL],
+            values[BLACK_KEY, LOW_LEVEL]
+        ))
+
+    def cacluate_hand_info(self, hand_timeline: HandTimeline, index: int, is_left: bool = True, hand_white_key_value: int = 1) -> dict:
         # 先初始化数据
         result = {}
         result[ActionPhase.REST] = {}
@@ -220,65 +312,20 @@ class Animator:
         result[ActionPhase.ATTACK] = {}
         result[ActionPhase.HOLD] = {}
 
-        hand_note = hand_item.get("hand_note")
-        hand_span = max(8, hand_item.get("hand_span"))
-
-        span_offset = np.array(self.avatar_info["key_board_positions"]["wide_expand_hand_position"].get(
-            'location')) - np.array(self.avatar_info["key_board_positions"]["normal_hand_expand_position"].get('location'))
-        span_offset[0] = 0.0  # 去掉手掌扩张时在x轴方向上的位移
-
-        lowset_key_location = np.array(self.avatar_info["key_board_positions"][
-            "lowest_white_key_position"].get('location'))
-        highest_key_location = np.array(self.avatar_info["key_board_positions"][
-            "highest_white_key_position"].get('location'))
-        black_key_location = np.array(self.avatar_info["key_board_positions"][
-            "black_key_position"].get('location'))
-        press_distance = (black_key_location-highest_key_location)[2]
-
-        leftest_position: int = self.avatar_info['config']['leftest_position']
-        left_position: int = self.avatar_info['config']['left_position']
-        middle_left_position: int = self.avatar_info['config']['middle_left_position']
-        middle_right_position: int = self.avatar_info['config']['middle_right_position']
-        right_position: int = self.avatar_info['config']['right_position']
-        rightest_position: int = self.avatar_info['config']['rightest_position']
-
-        high_position = right_position if is_left else rightest_position
-        middle_position = middle_left_position if is_left else middle_right_position
-        low_position = leftest_position if is_left else left_position
+        rig = self.rig
+        hand = AvatarRig.hand_index(is_left)
+        hand_note = float(hand_timeline.hand_note[index])
+        hand_span = max(8, int(hand_timeline.hand_span[index]))
+        press_distance = rig.press_distance
 
         suffix = "L" if is_left else "R"
         # 手掌位置
-        hand_recorder = self.avatar_info['hand_recorders'][
-            'left_hand_recorders'] if is_left else self.avatar_info['hand_recorders']['right_hand_recorders']
-
-        high_white = np.array(
-            hand_recorder[f'high_white_H_{suffix}'].get('location'))
-        high_black = np.array(
-            hand_recorder[f'high_black_H_{suffix}'].get('location'))
-        middle_white = np.array(
-            hand_recorder[f'middle_white_H_{suffix}'].get('location'))
-        middle_black = np.array(
-            hand_recorder[f'middle_black_H_{suffix}'].get('location'))
-        low_white = np.array(
-            hand_recorder[f'low_white_H_{suffix}'].get('location'))
-        low_black = np.array(
-            hand_recorder[f'low_black_H_{suffix}'].get('location'))
-        hand_position = lerp_with_key_type_and_position(
-            hand_white_key_value,
-            hand_note,
-            high_position,
-            middle_position,
-            low_position,
-            high_white,
-            high_black,
-            middle_white,
-            middle_black,
-            low_white, low_black
-        )
+        hand_position = self._lerp_base_state(
+            rig.hand_positions, hand, hand_white_key_value, hand_note)
 
         # 根据当前左手跨度，判断是否要调整位置
         hand_span_weight = (hand_span - 8) / (12 - 8)
-        hand_position += hand_span_weight * span_offset
+        hand_position += hand_span_weight * rig.span_offset
         ready_hand_position = hand_position.copy()
         ready_hand_position[2] -= 0.25 * press_distance
         attack_hand_position = hand_position.copy()
@@ -293,62 +340,16 @@ class Animator:
         result[ActionPhase.HOLD][f"H_{suffix}"] = hold_hand_position.tolist()
 
         # 左手pivot位置
-        HP_high_white = np.array(
-            hand_recorder[f'high_white_HP_{suffix}'].get('location'))
-        HP_high_black = np.array(
-            hand_recorder[f'high_black_HP_{suffix}'].get('location'))
-        HP_middle_white = np.array(
-            hand_recorder[f'middle_white_HP_{suffix}'].get('location'))
-        HP_middle_black = np.array(
-            hand_recorder[f'middle_black_HP_{suffix}'].get('location'))
-        HP_low_white = np.array(
-            hand_recorder[f'low_white_HP_{suffix}'].get('location'))
-        HP_low_black = np.array(
-            hand_recorder[f'low_black_HP_{suffix}'].get('location'))
-        HP = lerp_with_key_type_and_position(
-            hand_white_key_value,
-            hand_note,
-            high_position,
-            middle_position,
-            low_position,
-            HP_high_white,
-            HP_high_black,
-            HP_middle_white,
-            HP_middle_black,
-            HP_low_white,
-            HP_low_black
-        )
+        HP = self._lerp_base_state(
+            rig.pivot_positions, hand, hand_white_key_value, hand_note)
         result[ActionPhase.REST][f"HP_{suffix}"] = HP.tolist()
         result[ActionPhase.READY][f"HP_{suffix}"] = HP.tolist()
         result[ActionPhase.ATTACK][f"HP_{suffix}"] = HP.tolist()
         result[ActionPhase.HOLD][f"HP_{suffix}"] = HP.tolist()
 
         # 左手旋转值
-        H_rotation_high_white = np.array(
-            hand_recorder[f'high_white_H_rotation_{suffix}'].get('rotation_quaternion'))
-        H_rotation_high_black = np.array(
-            hand_recorder[f'high_black_H_rotation_{suffix}'].get('rotation_quaternion'))
-        H_rotation_middle_white = np.array(
-            hand_recorder[f'middle_white_H_rotation_{suffix}'].get('rotation_quaternion'))
-        H_rotation_middle_black = np.array(
-            hand_recorder[f'middle_black_H_rotation_{suffix}'].get('rotation_quaternion'))
-        H_rotation_low_white = np.array(
-            hand_recorder[f'low_white_H_rotation_{suffix}'].get('rotation_quaternion'))
-        H_rotation_low_black = np.array(
-            hand_recorder[f'low_black_H_rotation_{suffix}'].get('rotation_quaternion'))
-        H_rotation = lerp_with_key_type_and_position(
-            hand_white_key_value,
-            hand_note,
-            high_position,
-            middle_position,
-            low_position,
-            H_rotation_high_white,
-            H_rotation_high_black,
-            H_rotation_middle_white,
-            H_rotation_middle_black,
-            H_rotation_low_white,
-            H_rotation_low_black
-        )
+        H_rotation = self._lerp_base_state(
+            rig.hand_rotations, hand, hand_white_key_value, hand_note)
 
         result[ActionPhase.REST][f"H_rotation_{suffix}"] = H_rotation.tolist()
         result[ActionPhase.READY][f"H_rotation_{suffix}"] = H_rotation.tolist()
@@ -356,56 +357,25 @@ class Animator:
         )
         result[ActionPhase.HOLD][f"H_rotation_{suffix}"] = H_rotation.tolist()
 
-        finger_recorders = self.avatar_info['finger_recorders'][
-            'left_finger_recorders'] if is_left else self.avatar_info['finger_recorders']['right_finger_recorders']
-
-        fingers = hand_item.get("fingers", [])
-
-        for finger in fingers:
-            finger_index = finger.get("finger_index")
-            finger_high_white_key = f'high_white_{finger_index}_{suffix}'
-            finger_high_white = np.array(
-                finger_recorders[finger_high_white_key].get('location'))
-            finger_high_black_key = f'high_black_{finger_index}_{suffix}'
-            finger_high_black = np.array(
-                finger_recorders[finger_high_black_key].get('location'))
-            finger_middle_white_key = f'middle_white_{finger_index}_{suffix}'
-            finger_middle_white = np.array(
-                finger_recorders[finger_middle_white_key].get('location'))
-            finger_middle_black_key = f'middle_black_{finger_index}_{suffix}'
-            finger_middle_black = np.array(
-                finger_recorders[finger_middle_black_key].get('location'))
-            finger_low_white_key = f'low_white_{finger_index}_{suffix}'
-            finger_low_white = np.array(
-                finger_recorders[finger_low_white_key].get('location'))
-            finger_low_black_key = f'low_black_{finger_index}_{suffix}'
-            finger_low_black = np.array(
-                finger_recorders[finger_low_black_key].get('location'))
-            finger_position = lerp_with_key_type_and_position(
-                hand_white_key_value, hand_note, high_position, middle_position, low_position, finger_high_white, finger_high_black, finger_middle_white, finger_middle_black, finger_low_white, finger_low_black)
+        finger_offset = 0 if is_left else hand_timeline.finger_number
+        press_key_direction = rig.press_key_direction
+
+        for slot in range(hand_timeline.finger_number):
+            finger_index = slot + finger_offset
+            finger_position = self._lerp_base_state(
+                rig.finger_positions[:, :, :, slot], hand, hand_white_key_value, hand_note)
 
             # 这一步是计算实际按键的手指位置
-            note = finger["key_note"]["note"]
-            is_black = finger["key_note"]["is_black"]
-            is_pressed = finger["pressed"]
+            note = int(hand_timeline.note[index, slot])
+            is_pressed = bool(hand_timeline.pressed[index, slot])
 
-            key_location = get_key_location(
-                note, finger_index, is_pressed, is_black, self.piano, lowset_key_location, highest_key_location, black_key_location)
+            key_location = rig.key_location(note, finger_index, is_pressed)
             touch_point = get_touch_point(
                 finger_position, key_location)
 
-            base_vector = Vector((0, 0, 1))
-            press_key_direction_q = self.avatar_info['guidelines']['press_key_direction'].get(
-                'rotation_quaternion')
-            press_key_direction = Quaternion(
-                press_key_direction_q) @ base_vector
-            # 确保方向向量单位化
-            press_key_direction = press_key_direction / \
-                np.linalg.norm(press_key_direction)
-
-            is_keep_pressed = finger["is_keep_pressed"]
+            is_keep_pressed = bool(hand_timeline.keep_pressed[index, slot])
             actual_press_depth = get_actual_press_depth(
-                lowset_key_location, finger_position)
+                rig.lowest_key_location, finger_position)
             finger_key = f"{finger_index}_{suffix}"
 
             ready_touch_point = touch_point - 0.75 * \
@@ -413,7 +383,7 @@ class Animator:
             attack_touch_point = touch_point + actual_press_depth * press_key_direction
             # 休息时手指高度要高于黑键
             rest_touch_point = np.array(
-                (touch_point[0], touch_point[1], black_key_location[2]))
+                (touch_point[0], touch_point[1], rig.black_key_location[2]))
             # 虽然有些手指不参与演奏，但整个手掌的准备阶段难免也会有移动
             ready_rest_point = rest_touch_point - 0.75 * \
                 actual_press_depth * press_key_direction
@@ -438,41 +408,52 @@ class Animator:
 
     def generate_piano_key_animation_data(self):
         """
-        根据hand_recorder数据生成钢琴键动画数据
+        根据手型时间线生成钢琴键动画数据，每个键一条轨道
+
+        同一个键的所有关键帧放在同一个条目里，按帧号排序；同一帧有多个关键帧时只保留最后生成的那个，
+        和Blender里对同一帧重复插入关键帧的结果相同。这样Blender中每个键的物体和形态键只需要查找一次
 
         Returns:
-            list: 钢琴键动画数据列表
+            list: 钢琴键动画数据列表，按音符排序
         """
 
         frames: list[int] = []
         all_notes: list[list[int]] = []
+        all_note_sets: list[set[int]] = []
         all_is_keep_pressed_list: list[list[bool]] = []
+        hand_timeline = self.hand_timeline
 
         # 收集所有数据
-        for frame_data in self.hand_recorder:
-            frame = int(frame_data.get("frame", 0))
+        for index in range(len(hand_timeline)):
+            frame = int(hand_timeline.frame[index])
             if frame < 0:
                 continue
             frames.append(frame)
-            notes: list[int] = []
-            is_keep_pressed_list: list[bool] = []
-
-            # 处理左手和右手
-            for hand in [frame_data.get("left_hand", {}), frame_data.get("right_hand", {})]:
-                fingers = hand.get("fingers", [])
 
-                # 遍历所有手指
-                for finger in fingers:
-                    if finger.get("pressed", False):  # 只处理按下的手指
-                        note = finger["key_note"]["note"]
-                        notes.append(note)
-                        is_keep_pressed_list.append(
-                            finger.get("is_keep_pressed", False))
+            # 只处理按下的手指
+            pressed = hand_timeline.pressed[index]
+            notes: list[int] = hand_timeline.note[index][pressed].tolist()
+            is_keep_pressed_list: list[bool] = hand_timeline.keep_pressed[index][pressed].tolist(
+            )
 
             all_notes.append(notes)
+            # 判断音符是否在前后和弦中时用集合
+            all_note_sets.append(set(notes))
             all_is_keep_pressed_list.append(is_keep_pressed_list)
 
-        piano_key_animation_data = []
+        # 音符 -> {帧号: 关键帧}，后生成的关键帧覆盖同一帧上的旧关键帧
+        tracks: dict[int, dict[float, dict]] = {}
+
+        def add_keyframe(note: int, frame: float, value: float):
+            track = tracks.get(note)
+            if track is None:
+                track = {}
+                tracks[note] = track
+            track[frame] = {
+                "frame": frame,
+                "shape_key_value": value,
+                "is_pressed_value": value
+            }
 
         for i in range(len(frames)):
             current_frame = frames[i]
@@ -490,8 +471,8 @@ class Animator:
 
             current_notes = all_notes[i]
             current_is_keep_pressed_list = all_is_keep_pressed_list[i]
-            next_notes = all_notes[i+1] if i < len(frames)-1 else None
-            prev_notes = all_notes[i-1] if i > 0 else None
+            next_notes = all_note_sets[i+1] if i < len(frames)-1 else None
+            prev_notes = all_note_sets[i-1] if i > 0 else None
 
             # 为每个音符生成动画数据
             for j in range(len(current_notes)):
@@ -499,37 +480,19 @@ class Animator:
                 is_keep_pressed = current_is_keep_pressed_list[j]
                 note_is_repeated = next_notes is not None and note in next_notes
 
-                key_name = f"key_{note}"
-                shape_key_name = f"{key_name}_pressed"
-
                 # 如果是keep_pressed，就不需要有清零这个动作
                 zero_shape_key_value = 1.0 if is_keep_pressed else 0.0
                 # 如果下一次动作该音符也被演奏，就不需要抬起
                 up_shape_key_value = 1.0 if is_keep_pressed and note_is_repeated else 0.0
 
-                keyframe_data = {
-                    "key_name": key_name,
-                    "shape_key_name": shape_key_name,
-                    "keyframes": []
-                }
-
                 # 归零动作：提前press_duration秒归零（如果时间允许,或者这是该键第一次被演奏）
                 if prev_time_enough_for_ready or (prev_notes and note not in prev_notes) or not prev_notes:
                     zero_frame = max(0, current_frame - self.press_duration)
                     # 只有当不是第一个按键或者距离上一个按键有足够时间时才添加归零动作
-
-                    keyframe_data["keyframes"].append({
-                        "frame": zero_frame,
-                        "shape_key_value": zero_shape_key_value,
-                        "is_pressed_value": zero_shape_key_value
-                    })
+                    add_keyframe(note, zero_frame, zero_shape_key_value)
 
                 # 按下动作：在当前帧按下（必须有）
-                keyframe_data["keyframes"].append({
-                    "frame": current_frame,
-                    "shape_key_value": 1.0,
-                    "is_pressed_value": 1.0
-                })
+                add_keyframe(note, current_frame, 1.0)
 
                 # 如果有下一个按键，调整抬起时间以确保手有足够时间移动
                 if next_frame and time_enough_for_hold:
@@ -538,66 +501,57 @@ class Animator:
 
                     # 琴键可以保持到抬起前，中间留一个用于抬指的时间
                     hold_frame = release_frame - self.up_duration
-                    keyframe_data["keyframes"].append({
-                        "frame": hold_frame,
-                        "shape_key_value": 1.0,
-                        "is_pressed_value": 1.0
-                    })
+                    add_keyframe(note, hold_frame, 1.0)
 
                     # 添加抬起动作
-                    keyframe_data["keyframes"].append({
-                        "frame": release_frame,
-                        "shape_key_value": up_shape_key_value,
-                        "is_pressed_value": up_shape_key_value
-                    })
+                    add_keyframe(note, release_frame, up_shape_key_value)
                 elif next_frame and time_enough_for_up:
                     # 只够常规抬指的时间，就省略掉手掌移动的时间，同时也去掉了保持按键的可能性
                     release_frame = current_frame + self.up_duration
-                    keyframe_data["keyframes"].append({
-                        "frame": release_frame,
-                        "shape_key_value": up_shape_key_value,
-                        "is_pressed_value": up_shape_key_value
-                    })
+                    add_keyframe(note, release_frame, up_shape_key_value)
                 elif next_notes and note not in next_notes:
                     # 这里是两个手掌状态时间间隔非常短的情况，这种情况下，如果这个键被连续使用，那么就要修改按下和抬起的时间；如果没有被连续使用，那么就按常规按下和抬起来处理
                     release_frame = current_frame + self.up_duration
-                    keyframe_data["keyframes"].append({
-                        "frame": release_frame,
-                        "shape_key_value": up_shape_key_value,
-                        "is_pressed_value": up_shape_key_value
-                    })
+                    add_keyframe(note, release_frame, up_shape_key_value)
                 elif next_notes and next_frame:
                     # 这里是两个手掌状态时间间隔非常短，而且这个音符还被连续按下，这种情况下必须改变动画的时间，否则会与前后动画相冲突
                     release_frame = int((next_frame - current_frame)/2)
-                    keyframe_data["keyframes"].append({
-                        "frame": release_frame,
-                        "shape_key_value": 0.0,
-                        "is_pressed_value": 0.0
-                    })
+                    add_keyframe(note, release_frame, 0.0)
                 else:
                     # 最后面这种情况应该是运行到最后一个音符了，为它添加一个抬起动作
                     release_frame = current_frame + self.up_duration
-                    keyframe_data["keyframes"].append({
-                        "frame": release_frame,
-                        "shape_key_value": 0.0,
-                        "is_pressed_value": 0.0
-                    })
+                    add_keyframe(note, release_frame, 0.0)
 
-                piano_key_animation_data.append(keyframe_data)
+        piano_key_animation_data = []
+        for note in sorted(tracks):
+            key_name = f"key_{note}"
+            track = tracks[note]
+            piano_key_animation_data.append({
+                "key_name": key_name,
+                "shape_key_name": f"{key_name}_pressed",
+                "keyframes": [track[frame] for frame in sorted(track)]
+            })
 
         return piano_key_animation_data
 
-    def save_piano_key_animation_data(self, output_path: str = ""):
+    def save_piano_key_animation_data(self, output_path: str = "", keyframe_tolerance: Optional[float] = 1e-4, linear_keyframe_reduction: bool = False):
         """
         保存钢琴键动画数据到文件
 
         参数:
         output_path: 输出文件路径
+        keyframe_tolerance: 关键帧精简允许的误差，为None时不精简
+        linear_keyframe_reduction: 是否按线性插值去掉关键帧，见generate_animation_info
         """
         if output_path == "":
             output_path = f"output/piano_key_animations/{self.midi_name}_{self.avatar_name}.piano_key_animation"
 
         piano_key_animation_data = self.generate_piano_key_animation_data()
+        if keyframe_tolerance is not None:
+            reduction_report = KeyframeReductionReport('钢琴键动画')
+            piano_key_animation_data = reduce_piano_key_animation(
+                piano_key_animation_data, reduction_report, keyframe_tolerance, linear=linear_keyframe_reduction)
+            reduction_report.print_report(max_lines=0)
 
         with open(output_path, "w") as f:
             json.dump(piano_key_animation_data, f)
@@ -0,0 +1,283 @@
+import json
+import numpy as np
+from typing import Optional
+from mathutils import Vector, Quaternion
+from src.piano.piano import Piano
+from src.utils import lerp_batch, lerp_with_key_type_and_position
+
+# 数组第一维：左右手
+LEFT_HAND = 0
+RIGHT_HAND = 1
+# 数组第二维：手型按的是黑键还是白键，下标正好等于white_key_value
+BLACK_KEY = 0
+WHITE_KEY = 1
+# 数组第三维：基准状态所在的位置
+LOW_LEVEL = 0
+MIDDLE_LEVEL = 1
+HIGH_LEVEL = 2
+
+# 插值表的精度：hand_note是两个音符的中点，只可能是半音的整数倍
+INTERPOLATION_STEPS_PER_NOTE = 2
+INTERPOLATION_TABLE_SIZE = 128 * INTERPOLATION_STEPS_PER_NOTE
+# 需要插值的基准状态
+INTERPOLATED_BASE_STATES = ('hand_positions', 'pivot_positions',
+                            'hand_rotations', 'finger_positions')
+
+# 不参与演奏的手指按到的键会左右偏移一点，偏移量（以白键宽度为单位）的三种取值
+KEY_OFFSETS = (-0.25, 0.0, 0.25)
+
+_KEY_TYPE_NAMES = ('black', 'white')
+_LEVEL_NAMES = ('low', 'middle', 'high')
+
+
+class AvatarRig:
+    """
+    解析好的角色标定数据。
+
+    .avatar文件里的基准状态是按名字存放的嵌套字典（例如hand_recorders.left_hand_recorders.high_white_H_L），
+    每次计算手型都要重新查字典再转成数组。这里在加载时一次性转换成连续的数组：
+
+    - hand_positions / pivot_positions: (手, 键类型, 位置, xyz)，对应H和HP
+    - hand_rotations: (手, 键类型, 位置, wxyz)，对应H_rotation
+    - finger_positions: (手, 键类型, 位置, 手指, xyz)
+    - level_positions: (手, 位置)，三个基准位置对应的音符，来自config
+    - 键盘上的几个参考位置，以及按键方向press_key_direction
+    - key_locations: (音符, 是否按下, 偏移类型, xyz)，每个键的位置，取代逐个手指调用get_key_location
+    - 插值表：上面四种基准状态在每个半音位置上的插值结果，形状为(手, 键类型, hand_note×2, ...)，
+      运行时的插值变成查表，见lookup_base_states
+    """
+
+    def __init__(self, avatar_info: dict, piano: Optional[Piano] = None):
+        config = avatar_info['config']
+        self.finger_number: int = config.get('one_hand_finger_number', 5)
+
+        self.level_positions = np.array([
+            [config['leftest_position'], config['middle_left_position'],
+                config['right_position']],
+            [config['left_position'], config['middle_right_position'],
+                config['rightest_position']]
+        ], dtype=np.float64)
+
+        hand_recorders = avatar_info['hand_recorders']
+        finger_recorders = avatar_info['finger_recorders']
+        self.hand_positions = np.zeros((2, 2, 3, 3))
+        self.pivot_positions = np.zeros((2, 2, 3, 3))
+        self.hand_rotations = np.zeros((2, 2, 3, 4))
+        self.finger_positions = np.zeros((2, 2, 3, self.finger_number, 3))
+
+        for hand, (suffix, recorder_name, finger_recorder_name) in enumerate((
+                ('L', 'left_hand_recorders', 'left_finger_recorders'),
+                ('R', 'right_hand_recorders', 'right_finger_recorders'))):
+            hand_recorder = hand_recorders[recorder_name]
+            finger_recorder = finger_recorders[finger_recorder_name]
+            finger_offset = 0 if hand == LEFT_HAND else self.finger_number
+            for key_type, key_type_name in enumerate(_KEY_TYPE_NAMES):
+                for level, level_name in enumerate(_LEVEL_NAMES):
+                    prefix = f'{level_name}_{key_type_name}'
+                    self.hand_positions[hand, key_type, level] = hand_recorder[
+                        f'{prefix}_H_{suffix}']['location']
+                    self.pivot_positions[hand, key_type, level] = hand_recorder[
+                        f'{prefix}_HP_{suffix}']['location']
+                    self.hand_rotations[hand, key_type, level] = hand_recorder[
+                        f'{prefix}_H_rotation_{suffix}']['rotation_quaternion']
+                    for slot in range(self.finger_number):
+                        self.finger_positions[hand, key_type, level, slot] = finger_recorder[
+                            f'{prefix}_{slot + finger_offset}_{suffix}']['location']
+
+        key_board_positions = avatar_info['key_board_positions']
+        self.lowest_key_location = np.array(
+            key_board_positions['lowest_white_key_position']['location'], dtype=np.float64)
+        self.highest_key_location = np.array(
+            key_board_positions['highest_white_key_position']['location'], dtype=np.float64)
+        self.black_key_location = np.array(
+            key_board_positions['black_key_position']['location'], dtype=np.float64)
+        self.press_distance = float(
+            (self.black_key_location - self.highest_key_location)[2])
+
+        # 手掌张开到最大时的位移，不考虑x轴方向
+        self.span_offset = np.array(key_board_positions['wide_expand_hand_position']['location'], dtype=np.float64) - \
+            np.array(
+                key_board_positions['normal_hand_expand_position']['location'], dtype=np.float64)
+        self.span_offset[0] = 0.0
+
+        # 按键方向：把z轴按press_key_direction旋转，并且单位化
+        press_key_direction = Quaternion(
+            avatar_info['guidelines']['press_key_direction']['rotation_quaternion']) @ Vector((0, 0, 1))
+        press_key_direction = np.array(press_key_direction, dtype=np.float64)
+        self.press_key_direction = press_key_direction / \
+            np.linalg.norm(press_key_direction)
+
+        self.finger_offset_classes, self.key_locations = self._build_key_location_table(
+            piano if piano is not None else Piano())
+
+        self.interpolation_tables: dict[str, np.ndarray] = {
+            name: self._build_interpolation_table(getattr(self, name)) for name in INTERPOLATED_BASE_STATES}
+
+    def interpolate_base_states(self, base_states: np.ndarray, hands: np.ndarray, white_key_values: np.ndarray, hand_notes: np.ndarray) -> np.ndarray:
+        """
+        lerp_with_key_type_and_position的数组版本：在低、中、高三个基准状态之间按hand_note插值，
+        位置做线性插值，四元数做球面插值
+
+        Args:
+            base_states: 形状为(手, 键类型, 位置, ...)的数组，例如hand_positions、finger_positions
+            hands / white_key_values / hand_notes: (M,)
+
+        Returns:
+            np.ndarray: (M, ...)
+        """
+        if base_states.ndim == 5:
+            # 手指的基准状态多一维，逐个手指插值
+            return np.stack([self.interpolate_base_states(base_states[:, :, :, slot], hands, white_key_values, hand_notes)
+                             for slot in range(base_states.shape[3])], axis=1)
+
+        level_positions = self.level_positions[hands]
+        low_position = level_positions[:, LOW_LEVEL]
+        middle_position = level_positions[:, MIDDLE_LEVEL]
+        high_position = level_positions[:, HIGH_LEVEL]
+        values = base_states[hands, white_key_values]
+
+        is_low_half = hand_notes < middle_position
+        t = np.where(is_low_half,
+                     (hand_notes - low_position) /
+                     (middle_position - low_position),
+                     (hand_notes - middle_position) / (high_position - middle_position))
+        start = np.where(is_low_half[:, None],
+                         values[:, LOW_LEVEL], values[:, MIDDLE_LEVEL])
+        end = np.where(is_low_half[:, None],
+                       values[:, MIDDLE_LEVEL], values[:, HIGH_LEVEL])
+        return lerp_batch(start, end, t)
+
+    def _build_interpolation_table(self, base_states: np.ndarray) -> np.ndarray:
+        hands, white_key_values, steps = np.meshgrid(
+            np.arange(2), np.arange(2), np.arange(INTERPOLATION_TABLE_SIZE), indexing='ij')
+        values = self.interpolate_base_states(
+            base_states, hands.ravel(), white_key_values.ravel(), steps.ravel() / INTERPOLATION_STEPS_PER_NOTE)
+        return values.reshape((2, 2, INTERPOLATION_TABLE_SIZE) + values.shape[1:])
+
+    def lookup_base_states(self, name: str, hands: np.ndarray, white_key_values: np.ndarray, hand_notes: np.ndarray) -> np.ndarray:
+        """
+        查表得到插值结果，hand_note不在半音网格上（或超出表的范围）的状态直接插值
+
+        Args:
+            name: INTERPOLATED_BASE_STATES中的一个
+        """
+        table = self.interpolation_tables[name]
+        scaled_notes = hand_notes * INTERPOLATION_STEPS_PER_NOTE
+        steps = np.rint(scaled_notes).astype(np.int64)
+        on_grid = (steps == scaled_notes) & (steps >= 0) & (
+            steps < INTERPOLATION_TABLE_SIZE)
+        values = table[hands, white_key_values,
+                       np.clip(steps, 0, INTERPOLATION_TABLE_SIZE - 1)]
+        if not on_grid.all():
+            off_grid = ~on_grid
+            values[off_grid] = self.interpolate_base_states(getattr(self, name), hands[off_grid],
+                                                            white_key_values[off_grid], hand_notes[off_grid])
+        return values
+
+    def validate_interpolation_tables(self, tolerance: float = 1e-9) -> dict[str, float]:
+        """
+        检查插值表和lerp_with_key_type_and_position逐个计算的结果是否一致，超出tolerance时抛出ValueError
+
+        两个四元数相同时标量版本可能得到nan（见tan_weight_transform_batch），这样的位置不参与比较
+
+        Returns:
+            dict: 每种基准状态的最大误差
+        """
+        max_errors: dict[str, float] = {}
+        for name in INTERPOLATED_BASE_STATES:
+            base_states = getattr(self, name)
+            table = self.interpolation_tables[name]
+            max_error = 0.0
+            for hand in range(2):
+                low_position, middle_position, high_position = self.level_positions[hand]
+                for white_key_value in range(2):
+                    for step in range(INTERPOLATION_TABLE_SIZE):
+                        hand_note = step / INTERPOLATION_STEPS_PER_NOTE
+                        slots = range(base_states.shape[3]) if base_states.ndim == 5 else [None]
+                        for slot in slots:
+                            values = base_states[hand] if slot is None else base_states[hand, :, :, slot]
+                            expected = lerp_with_key_type_and_position(
+                                white_key_value, hand_note, high_position, middle_position, low_position,
+                                values[WHITE_KEY, HIGH_LEVEL], values[BLACK_KEY, HIGH_LEVEL],
+                                values[WHITE_KEY, MIDDLE_LEVEL], values[BLACK_KEY, MIDDLE_LEVEL],
+                                values[WHITE_KEY, LOW_LEVEL], values[BLACK_KEY, LOW_LEVEL])
+                            actual = table[hand, white_key_value, step] if slot is None else table[hand, white_key_value, step, slot]
+                            if np.isnan(expected).any():
+                                continue
+                            max_error = max(max_error, float(
+                                np.abs(actual - expected).max()))
+            max_errors[name] = max_error
+
+        print('插值表最大误差：' + '，'.join(f'{name}={error:.3g}' for name,
+              error in max_errors.items()))
+        if any(error > tolerance for error in max_errors.values()):
+            raise ValueError(f'插值表和逐个插值的结果不一致，允许的误差为{tolerance}')
+        return max_errors
+
+    def _build_key_location_table(self, piano: Piano) -> tuple[np.ndarray, np.ndarray]:
+        """
+        预先计算所有音符的键位置，规则和get_key_location相同：
+        白键的x坐标按白键下标等距排列，黑键在前一个白键和后一个白键中间，y和z坐标分别取白键和黑键的参考位置；
+        不参与演奏的手指按手指编号向左或向右偏移，超出钢琴范围的音符按白键间距外推。
+
+        Returns:
+            tuple: (每个全局手指编号对应的偏移类型, 形状为(128, 2, 偏移类型, xyz)的键位置表)
+        """
+        white_keys = piano.white_keys
+        white_key_distance = (self.highest_key_location[0] -
+                              self.lowest_key_location[0]) / (piano.numberOfWhiteKeys - 1)
+
+        finger_offset_classes = np.empty(2 * self.finger_number, dtype=np.int64)
+        for finger_index in range(2 * self.finger_number):
+            offset = 0.25 if (finger_index < 5 and finger_index >
+                              1) or finger_index > 6 else -0.25
+            if finger_index == 2 or finger_index == 7:
+                offset = 0
+            finger_offset_classes[finger_index] = KEY_OFFSETS.index(offset)
+
+        all_notes = np.arange(128)
+        white_key_index = np.where(all_notes < piano.min_key, all_notes - piano.min_key,
+                                   all_notes - piano.max_key + len(white_keys) - 1).astype(np.float64)
+        white_key_index[white_keys] = np.arange(len(white_keys))
+
+        is_black = np.isin(all_notes % 12, list(piano.black_keys))
+        # 黑键的前一个白键，音符0不是黑键，这里只是避免下标越界
+        previous_white_key_index = np.concatenate(
+            ([0.0], white_key_index[:-1]))
+        key_position_x = np.where(is_black,
+                                  self.lowest_key_location[0] + white_key_distance *
+                                  (previous_white_key_index + 0.5),
+                                  self.lowest_key_location[0] + white_key_distance * white_key_index)
+
+        key_locations = np.empty((128, 2, len(KEY_OFFSETS), 3))
+        for offset_class, offset in enumerate(KEY_OFFSETS):
+            key_locations[:, 0, offset_class, 0] = key_position_x + \
+                offset * white_key_distance
+            key_locations[:, 1, offset_class, 0] = key_position_x
+        key_locations[..., 1] = np.where(is_black, self.black_key_location[1], self.highest_key_location[1])[
+            :, None, None]
+        key_locations[..., 2] = np.where(is_black, self.black_key_location[2], self.highest_key_location[2])[
+            :, None, None]
+        return finger_offset_classes, key_locations
+
+    def key_location(self, note: int, finger_index: int, is_pressed: bool) -> np.ndarray:
+        """
+        查表得到键的位置，等价于get_key_location，返回的数组不要原地修改
+        """
+        return self.key_locations[note, int(is_pressed), self.finger_offset_classes[finger_index]]
+
+    @classmethod
+    def load(cls, avatar_info_path: str, piano: Optional[Piano] = None, validate: bool = False) -> 'AvatarRig':
+        """
+        Args:
+            validate: 是否在加载后调用validate_interpolation_tables检查插值表，换了新的角色标定数据时建议打开
+        """
+        with open(avatar_info_path, 'r') as f:
+            rig = cls(json.load(f), piano)
+        if validate:
+            rig.validate_interpolation_tables()
+        return rig
+
+    @staticmethod
+    def hand_index(is_left: bool) -> int:
+        return LEFT_HAND if is_left else RIGHT_HAND
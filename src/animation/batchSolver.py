@@ -0,0 +1,153 @@
+"""
+一次性计算一条手型时间线上所有状态的动画数据。
+
+Animator.cacluate_hand_info一次只算一个手型状态，每个状态要做20多次标量插值和逐个手指的按键位置计算。
+这里把整条时间线当成数组处理：手掌、手指的插值和按键位置都从AvatarRig的表中批量读取，其余计算都是几次NumPy运算，
+结果和cacluate_hand_info相同，只是按阶段（REST、READY、ATTACK、HOLD）堆成数组。
+"""
+
+import gc
+import math
+import numpy as np
+from src.piano.piano import Piano
+from src.recorder.handFile import HandTimeline
+from src.animation.avatarRig import AvatarRig
+
+# 和ActionPhase的定义顺序一致
+PHASE_REST = 0
+PHASE_READY = 1
+PHASE_ATTACK = 2
+PHASE_HOLD = 3
+PHASE_NUMBER = 4
+
+
+class SolvedHandStates:
+    """
+    一批手型状态的计算结果，第一维是状态
+
+    - hand_positions: (M, 阶段, xyz)，H
+    - pivot_positions: (M, xyz)，HP，四个阶段相同
+    - hand_rotations: (M, wxyz)，H_rotation，四个阶段相同
+    - finger_positions: (M, 阶段, 手指, xyz)
+    """
+
+    def __init__(self, hand_positions: np.ndarray, pivot_positions: np.ndarray, hand_rotations: np.ndarray, finger_positions: np.ndarray):
+        self.hand_positions = hand_positions
+        self.pivot_positions = pivot_positions
+        self.hand_rotations = hand_rotations
+        self.finger_positions = finger_positions
+
+    def __len__(self) -> int:
+        return len(self.pivot_positions)
+
+
+def to_nested_lists(*arrays: np.ndarray) -> list[list]:
+    """
+    把数组转换成嵌套列表，用于输出json。
+
+    一首曲子的结果会生成上百万个小列表，分配时会反复触发循环垃圾回收，而这些列表里只有数字，不可能有循环引用，
+    所以转换期间暂停垃圾回收，速度能快一个数量级。
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return [array.tolist() for array in arrays]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def calculate_white_key_values(hand_timeline: HandTimeline, piano: Piano) -> np.ndarray:
+    """
+    所有状态的white_key_value：拇指按下的是黑键时为0，否则为1，和Animator.determine_hand_white_key_value相同
+    """
+    state_amount = len(hand_timeline)
+    thumb_slots = np.where(hand_timeline.is_left,
+                           hand_timeline.finger_number - 1, 0)
+    rows = np.arange(state_amount)
+    thumb_notes = hand_timeline.note[rows, thumb_slots]
+    thumb_pressed = hand_timeline.pressed[rows, thumb_slots]
+    thumb_black = np.isin(thumb_notes % 12, list(piano.black_keys))
+    return np.where(thumb_pressed & thumb_black, 0, 1)
+
+
+def solve_hand_states(rig: AvatarRig, hand_timeline: HandTimeline, indices: np.ndarray, white_key_values: np.ndarray) -> SolvedHandStates:
+    """
+    计算hand_timeline中indices对应的状态在给定white_key_value下的动画数据，等价于对每个状态调用cacluate_hand_info
+
+    Args:
+        indices: (M,) 状态下标，可以重复
+        white_key_values: (M,) 每个状态使用的white_key_value
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    white_key_values = np.asarray(white_key_values, dtype=np.int64)
+    state_amount = len(indices)
+    finger_number = hand_timeline.finger_number
+
+    is_left = hand_timeline.is_left[indices]
+    hands = np.where(is_left, 0, 1)
+    hand_notes = hand_timeline.hand_note[indices].astype(np.float64)
+    hand_spans = np.maximum(
+        8, hand_timeline.hand_span[indices].astype(np.int64))
+    press_distance = rig.press_distance
+
+    # 手掌位置，根据手掌跨度调整
+    hand_position = rig.lookup_base_states(
+        'hand_positions', hands, white_key_values, hand_notes)
+    hand_span_weight = (hand_spans - 8) / (12 - 8)
+    hand_position = hand_position + \
+        hand_span_weight[:, None] * rig.span_offset
+    hand_positions = np.repeat(hand_position[:, None, :], PHASE_NUMBER, axis=1)
+    hand_positions[:, PHASE_READY, 2] -= 0.25 * press_distance
+    hand_positions[:, PHASE_ATTACK, 2] += 0.5 * press_distance
+    hand_positions[:, PHASE_HOLD, 2] += 0.25 * press_distance
+
+    pivot_positions = rig.lookup_base_states(
+        'pivot_positions', hands, white_key_values, hand_notes)
+    hand_rotations = rig.lookup_base_states(
+        'hand_rotations', hands, white_key_values, hand_notes)
+
+    # 所有手指的基准位置，(M, 手指, xyz)
+    finger_base_positions = rig.lookup_base_states(
+        'finger_positions', hands, white_key_values, hand_notes)
+
+    notes = hand_timeline.note[indices]
+    pressed = hand_timeline.pressed[indices]
+    keep_pressed = hand_timeline.keep_pressed[indices]
+    finger_indexes = np.arange(finger_number)[None, :] + \
+        np.where(is_left, 0, finger_number)[:, None]
+
+    key_locations = rig.key_locations[notes.astype(np.int64), pressed.astype(
+        np.int64), rig.finger_offset_classes[finger_indexes]]
+    touch_points = key_locations.copy()
+    touch_points[..., 1] = np.minimum(
+        finger_base_positions[..., 1], key_locations[..., 1])
+
+    actual_press_depth = np.abs(
+        finger_base_positions[..., 1] - rig.lowest_key_location[1]) * math.sin(math.radians(15))
+    press_offset = actual_press_depth[..., None] * rig.press_key_direction
+
+    ready_touch_points = touch_points - 0.75 * press_offset
+    attack_touch_points = touch_points + press_offset
+    # 休息时手指高度要高于黑键
+    rest_touch_points = touch_points.copy()
+    rest_touch_points[..., 2] = rig.black_key_location[2]
+    ready_rest_points = rest_touch_points - 0.75 * press_offset
+
+    is_normal_press = (pressed & ~keep_pressed)[..., None]
+    is_keep_pressed = keep_pressed[..., None]
+
+    def choose(normal_press: np.ndarray, keep_press: np.ndarray, no_press: np.ndarray) -> np.ndarray:
+        return np.where(is_keep_pressed, keep_press, np.where(is_normal_press, normal_press, no_press))
+
+    finger_positions = np.empty((state_amount, PHASE_NUMBER, finger_number, 3))
+    finger_positions[:, PHASE_REST] = choose(
+        touch_points, attack_touch_points, rest_touch_points)
+    finger_positions[:, PHASE_READY] = choose(
+        ready_touch_points, attack_touch_points, ready_rest_points)
+    finger_positions[:, PHASE_ATTACK] = choose(
+        attack_touch_points, attack_touch_points, rest_touch_points)
+    finger_positions[:, PHASE_HOLD] = choose(
+        attack_touch_points, attack_touch_points, rest_touch_points)
+
+    return SolvedHandStates(hand_positions, pivot_positions, hand_rotations, finger_positions)
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from typing import Callable
+from src.recorder.handFile import HandTimeline
+
+
+class HandInfoCache:
+    """
+    Animator.cacluate_hand_info的LRU缓存。
+
+    逐个状态生成动画时，每个手型状态会先作为下一个手型算一次预备动作，再作为当前手型算一次，
+    两次的white_key_value往往相同；曲子里重复出现的手型也会得到完全相同的结果。
+    所以用(状态签名, white_key_value)做键，每种组合只计算一次。
+
+    返回的字典会被多个关键帧共用，调用方不要修改。
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._cache: OrderedDict[tuple, dict] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_hand_info(self, hand_timeline: HandTimeline, index: int, hand_white_key_value: int, calculate: Callable[[], dict]) -> dict:
+        """
+        Args:
+            calculate: 未命中时调用，返回cacluate_hand_info的结果
+        """
+        key = (hand_timeline.state_signature(index), hand_white_key_value)
+        cache = self._cache
+
+        hand_info = cache.get(key)
+        if hand_info is not None:
+            self.hits += 1
+            cache.move_to_end(key)
+            return hand_info
+
+        self.misses += 1
+        hand_info = calculate()
+        cache[key] = hand_info
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+            self.evictions += 1
+
+        return hand_info
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def export_stats(self) -> dict:
+        return {
+            'size': len(self._cache),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate
+        }
+
+    def print_stats(self):
+        print(f'手型动画缓存：命中{self.hits}次，未命中{self.misses}次，'
+              f'命中率{self.hit_rate:.2%}，当前缓存{len(self._cache)}/{self.max_size}条')
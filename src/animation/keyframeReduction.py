@@ -0,0 +1,246 @@
+"""
+关键帧精简。
+
+Animator输出的很多关键帧是多余的：HP和H_rotation在一个手型的四个阶段里完全相同，长时间保持的手型会产生一串相同的值，
+钢琴键按住不放时也是一样。这里逐个通道检查：
+
+- 默认只合并连续相同的值（每个分量误差不超过tolerance），一段相同的值只保留首尾两个。
+  Blender导入时用的是默认的贝塞尔插值（自动钳制手柄），值相同的相邻关键帧之间本来就是水平的，去掉中间的关键帧曲线不变；
+- linear=True时，还会去掉前后两个保留的关键帧线性插值就能还原的关键帧。这只在线性插值下是准确的，
+  用贝塞尔插值时几段短的缓动会变成一段长的缓动，手和手指的节奏会变，所以需要导入时把插值方式设成LINEAR才能使用。
+
+同一帧有多个关键帧时Blender只保留最后插入的那个，其余的也直接去掉。关键帧越少，文件越小，Blender导入和播放也越快。
+"""
+
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+
+class KeyframeReductionReport:
+    """
+    精简的结果：每个通道原来有多少关键帧，去掉了多少
+    """
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        # 通道名 -> [原来的关键帧数量, 去掉的数量]
+        self.channels: dict[str, list[int]] = {}
+
+    def count(self, channel: str, keep: bool):
+        counts = self.channels.get(channel)
+        if counts is None:
+            counts = [0, 0]
+            self.channels[channel] = counts
+        counts[0] += 1
+        if not keep:
+            counts[1] += 1
+
+    @property
+    def total_keys(self) -> int:
+        return sum(total for total, _ in self.channels.values())
+
+    @property
+    def removed_keys(self) -> int:
+        return sum(removed for _, removed in self.channels.values())
+
+    def export_report(self) -> dict:
+        return {
+            'total_keys': self.total_keys,
+            'removed_keys': self.removed_keys,
+            'channels': {channel: {'total_keys': total, 'removed_keys': removed}
+                         for channel, (total, removed) in self.channels.items()}
+        }
+
+    def print_report(self, max_lines: int = 20):
+        total_keys = self.total_keys
+        removed_keys = self.removed_keys
+        ratio = removed_keys / total_keys if total_keys > 0 else 0.0
+        print(f'{self.name}关键帧精简：{len(self.channels)}个通道共{total_keys}个关键帧，'
+              f'去掉{removed_keys}个（{ratio:.2%}）')
+        channels = sorted(self.channels.items(),
+                          key=lambda item: item[1][1], reverse=True)
+        for channel, (total, removed) in channels[:max_lines]:
+            print(f'  {channel}：{total} -> {total - removed}')
+        if 0 < max_lines < len(channels):
+            print(f'  ……还有{len(channels) - max_lines}个通道')
+
+
+class _ChannelReducer:
+    """
+    单个通道的贪心精简：从上一个保留的关键帧（锚点）开始，尽量延长线段，
+    直到新的关键帧让中间某个关键帧的误差超过tolerance，这时保留线段的终点，中间的都去掉。
+    linear为False时线段只能是水平的（所有关键帧都和锚点相同），否则按线性插值比较。
+
+    每次push返回已经确定的(关键帧编号, 是否保留)
+    """
+
+    def __init__(self, tolerance: float, max_span: int, linear: bool = False):
+        self.tolerance = tolerance
+        self.linear = linear
+        # 限制一条线段最多跨过的关键帧数量，检查的代价和缓存的关键帧数量都不会无限增长
+        self.max_span = max_span
+        self.anchor: Optional[tuple[float, list[float]]] = None
+        self.pending: list[tuple[float, list[float], int]] = []
+
+    def push(self, frame: float, value: list[float], key_id: int) -> list[tuple[int, bool]]:
+        if self.anchor is None:
+            self.anchor = (frame, value)
+            return [(key_id, True)]
+
+        pending = self.pending
+        decisions = []
+        if pending and pending[-1][0] == frame:
+            # 同一帧后插入的关键帧会覆盖前一个，被覆盖的关键帧没有作用，直接去掉
+            decisions.append((pending.pop()[2], False))
+        elif not pending and self.anchor[0] == frame:
+            # 锚点已经保留了，新的关键帧会覆盖它，所以改用新的关键帧作为锚点
+            self.anchor = (frame, value)
+            return [(key_id, True)]
+
+        if pending and (len(pending) >= self.max_span or not self._reproduces(frame, value)):
+            decisions += self._commit()
+            self.pending = [(frame, value, key_id)]
+            return decisions
+
+        pending.append((frame, value, key_id))
+        return decisions
+
+    def finish(self) -> list[tuple[int, bool]]:
+        if not self.pending:
+            return []
+        decisions = self._commit()
+        self.pending = []
+        return decisions
+
+    def _commit(self) -> list[tuple[int, bool]]:
+        # 线段的终点保留下来作为新的锚点，中间的关键帧在它加入时已经检查过，可以去掉
+        pending = self.pending
+        decisions = [(key_id, False) for _, _, key_id in pending[:-1]]
+        end_frame, end_value, end_id = pending[-1]
+        decisions.append((end_id, True))
+        self.anchor = (end_frame, end_value)
+        return decisions
+
+    def _reproduces(self, end_frame: float, end_value: list[float]) -> bool:
+        """
+        锚点到(end_frame, end_value)的线段能否还原所有待定的关键帧
+        """
+        anchor_frame, anchor_value = self.anchor
+        tolerance = self.tolerance
+        if not self.linear:
+            return all(abs(actual - start) <= tolerance
+                       for value in [end_value] + [value for _, value, _ in self.pending]
+                       for start, actual in zip(anchor_value, value))
+
+        span = end_frame - anchor_frame
+        for frame, value, _ in self.pending:
+            t = (frame - anchor_frame) / span if span > 0 else 0.0
+            for start, end, actual in zip(anchor_value, end_value, value):
+                if abs(start + t * (end - start) - actual) > tolerance:
+                    return False
+        return True
+
+
+def reduce_animation_entries(animation_entries: Iterable[dict], report: KeyframeReductionReport, tolerance: float = 1e-4, max_span: int = 64, linear: bool = False) -> Iterator[dict]:
+    """
+    精简按帧号排序的.animation关键帧，边读边输出，保持原来的顺序
+
+    每个物体（hand_infos里的键）是一个通道，去掉的关键帧从对应的hand_infos中删掉，hand_infos为空的关键帧整个去掉。
+    输入的hand_infos可能被多个关键帧共用，所以不会修改它，而是生成新的字典
+
+    Args:
+        report: 统计结果写入这里
+        tolerance: 每个分量允许的最大误差
+        linear: 是否按线性插值去掉关键帧，只适用于导入时使用LINEAR插值的情况
+    """
+    reducers: dict[str, _ChannelReducer] = {}
+    # 还没输出的关键帧：[关键帧, 去掉的物体名, 还没确定的通道数量]
+    buffer: deque[list] = deque()
+    first_index = 0
+
+    def apply(obj_name: str, decisions: list[tuple[int, bool]]):
+        for entry_index, keep in decisions:
+            record = buffer[entry_index - first_index]
+            record[2] -= 1
+            if not keep:
+                record[1].add(obj_name)
+            report.count(obj_name, keep)
+
+    def flush() -> Iterator[dict]:
+        nonlocal first_index
+        while buffer and buffer[0][2] == 0:
+            animation_entry, dropped, _ = buffer.popleft()
+            first_index += 1
+            if not dropped:
+                yield animation_entry
+                continue
+            hand_infos = {obj_name: value for obj_name, value in animation_entry["hand_infos"].items()
+                          if obj_name not in dropped}
+            if hand_infos:
+                yield {"frame": animation_entry["frame"], "hand_infos": hand_infos}
+
+    for animation_entry in animation_entries:
+        entry_index = first_index + len(buffer)
+        hand_infos = animation_entry["hand_infos"]
+        buffer.append([animation_entry, set(), len(hand_infos)])
+        frame = animation_entry["frame"]
+        for obj_name, value in hand_infos.items():
+            reducer = reducers.get(obj_name)
+            if reducer is None:
+                reducer = _ChannelReducer(tolerance, max_span, linear)
+                reducers[obj_name] = reducer
+            apply(obj_name, reducer.push(frame, value, entry_index))
+        yield from flush()
+
+    for obj_name, reducer in reducers.items():
+        apply(obj_name, reducer.finish())
+    yield from flush()
+
+
+def reduce_piano_key_animation(piano_key_animation_data: list[dict], report: KeyframeReductionReport, tolerance: float = 1e-4, max_span: int = 64, linear: bool = False) -> list[dict]:
+    """
+    精简钢琴键动画数据
+
+    同一个键的所有条目在Blender里写进同一条曲线，所以按键把关键帧合在一起、按帧号排序后再精简。
+    结果保持原来的条目结构，只删掉去掉的关键帧，没有关键帧的条目整个去掉
+
+    Args:
+        report: 统计结果写入这里
+        tolerance: shape_key_value和is_pressed_value允许的最大误差
+        linear: 是否按线性插值去掉关键帧，只适用于导入时使用LINEAR插值的情况
+    """
+    # 键名 -> [(frame, 值, (条目下标, 关键帧下标))]，按插入顺序
+    tracks: dict[str, list[tuple[float, list[float], tuple[int, int]]]] = {}
+    for entry_index, key_data in enumerate(piano_key_animation_data):
+        track = tracks.setdefault(key_data["key_name"], [])
+        for keyframe_index, keyframe in enumerate(key_data["keyframes"]):
+            track.append((keyframe["frame"],
+                          [keyframe["shape_key_value"],
+                              keyframe["is_pressed_value"]],
+                          (entry_index, keyframe_index)))
+
+    dropped: set[tuple[int, int]] = set()
+    for key_name, track in tracks.items():
+        # 稳定排序，同一帧的关键帧保持插入顺序，后插入的会覆盖前面的
+        track.sort(key=lambda key: key[0])
+        reducer = _ChannelReducer(tolerance, max_span, linear)
+        decisions = []
+        for key_id, (frame, value, _) in enumerate(track):
+            decisions += reducer.push(frame, value, key_id)
+        decisions += reducer.finish()
+        for key_id, keep in decisions:
+            if not keep:
+                dropped.add(track[key_id][2])
+            report.count(key_name, keep)
+
+    reduced_data = []
+    for entry_index, key_data in enumerate(piano_key_animation_data):
+        keyframes = [keyframe for keyframe_index, keyframe in enumerate(key_data["keyframes"])
+                     if (entry_index, keyframe_index) not in dropped]
+        if keyframes:
+            reduced_data.append({
+                "key_name": key_data["key_name"],
+                "shape_key_name": key_data["shape_key_name"],
+                "keyframes": keyframes
+            })
+    return reduced_data
@@ -0,0 +1,75 @@
+"""
+批量动画计算的回归检查
+
+用法（在项目根目录下运行，逐个状态计算的路径需要mathutils，Blender之外可以pip install mathutils）：
+    python -m src.benchmark.animationCheck output/hand_recorders/xxx.hand asset/avatar/xxx.avatar
+
+对左右手分别用Animator.prossess_hand_data（逐个状态计算）和prossess_hand_data_batch（批量计算，按不同的chunk_size分批）生成关键帧，
+两边的帧号和物体名必须完全相同，数值误差不超过tolerance，否则打印出第一个不一致的关键帧并以非0状态退出。
+"""
+
+import argparse
+import sys
+from typing import Optional
+import numpy as np
+from src.animation.animator import Animator
+from src.piano.piano import Piano
+
+
+def compare_animation_entries(expected: list[dict], actual: list[dict], tolerance: float) -> Optional[str]:
+    """
+    Returns:
+        Optional[str]: 一致时返回None，否则返回第一处不一致的描述
+    """
+    if len(expected) != len(actual):
+        return f'关键帧数量不同：{len(expected)}和{len(actual)}'
+    for index, (expected_entry, actual_entry) in enumerate(zip(expected, actual)):
+        if expected_entry['frame'] != actual_entry['frame']:
+            return f"第{index}个关键帧的帧号不同：{expected_entry['frame']}和{actual_entry['frame']}"
+        expected_infos = expected_entry['hand_infos']
+        actual_infos = actual_entry['hand_infos']
+        if expected_infos.keys() != actual_infos.keys():
+            return f"frame为{expected_entry['frame']}的关键帧物体不同：{sorted(expected_infos)}和{sorted(actual_infos)}"
+        for obj_name, expected_value in expected_infos.items():
+            error = float(np.abs(np.array(expected_value) -
+                          np.array(actual_infos[obj_name])).max())
+            if error > tolerance:
+                return f"frame为{expected_entry['frame']}的{obj_name}误差为{error}"
+    return None
+
+
+def check_animation(animator: Animator, chunk_sizes: list[int], tolerance: float = 1e-6) -> Optional[str]:
+    hand_timeline = animator.hand_timeline
+    for is_left in (True, False):
+        hand_name = '左手' if is_left else '右手'
+        timeline = hand_timeline.select(
+            hand_timeline.is_left if is_left else ~hand_timeline.is_left)
+        expected = list(animator.prossess_hand_data(timeline))
+        for chunk_size in chunk_sizes:
+            mismatch = compare_animation_entries(expected, list(
+                animator.prossess_hand_data_batch(timeline, chunk_size)), tolerance)
+            if mismatch is not None:
+                return f'{hand_name}（chunk_size为{chunk_size}）：{mismatch}'
+        print(f'{hand_name}：{len(timeline)}个手型，{len(expected)}个关键帧一致')
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量动画计算的回归检查')
+    parser.add_argument('hand_file_path', type=str)
+    parser.add_argument('avatar_file_path', type=str)
+    parser.add_argument('--chunk-sizes', type=int, nargs='+',
+                        default=[1, 7, 1024])
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    args = parser.parse_args()
+
+    animator = Animator(args.hand_file_path, args.avatar_file_path, Piano())
+    mismatch = check_animation(animator, args.chunk_sizes, args.tolerance)
+    if mismatch is not None:
+        print(f'不一致：{mismatch}')
+        sys.exit(1)
+    print('批量计算和逐个状态计算的结果一致')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+指法搜索（RecorderPool）的基准测试
+
+用法（在项目根目录下运行）：
+    python -m src.benchmark.benchmark --pool-sizes 10 50 100
+
+会生成几首不同规模的合成midi，再加上asset/midi下自带的World is Mine，
+分别在不同pool_size下测量每秒处理的和弦数、峰值内存和最终熵值，结果保存为json，方便跨版本对比。
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Optional
+from src.benchmark.syntheticMidi import generate_synthetic_midi
+from src.midi.midiToNotes import MidiProcessor, NotesMap
+from src.piano.piano import Piano
+from src.hand.hand import Hand
+from src.hand.finger import Finger
+from src.recorder.recorder import Recorder
+from src.recorder.recorderPool import RecorderPool
+from src.utils import generate_finger_distribution
+
+BUNDLED_MIDI_PATH = 'asset/midi/World is Mine - Hatsune Miku.mid'
+
+# 合成midi的参数组合，覆盖长度、复音数、速度变化和音域宽度
+SYNTHETIC_CASES = [
+    {'name': 'synthetic_short_mono', 'chord_amount': 200, 'polyphony': 1,
+     'tempo_change_amount': 0, 'register_spread': 12},
+    {'name': 'synthetic_medium_poly', 'chord_amount': 500, 'polyphony': 4,
+     'tempo_change_amount': 4, 'register_spread': 24},
+    {'name': 'synthetic_long_dense', 'chord_amount': 1000, 'polyphony': 6,
+     'tempo_change_amount': 10, 'register_spread': 36},
+]
+
+
+def create_initial_recorder(piano: Piano) -> Recorder:
+    """
+    和key_ripple.ipynb里一样，左手放在C3，右手放在C5
+    """
+    left_hand = Hand([Finger(i, piano.note_to_key(note))
+                      for i, note in enumerate([48, 50, 52, 53, 55])], piano, True)
+    right_hand = Hand([Finger(i + 5, piano.note_to_key(note), False)
+                       for i, note in enumerate([72, 74, 76, 77, 79])], piano, False)
+    return Recorder(piano, [left_hand], [right_hand], 0.0, 0.0, [0.0], [0.0])
+
+
+def load_notes_maps(midi_file_path: str, FPS: int = 60) -> list[NotesMap]:
+    midi_name = os.path.splitext(os.path.basename(midi_file_path))[0]
+    midi_processor = MidiProcessor(
+        midi_name, FPS=FPS, midi_file_path=midi_file_path)
+    return midi_processor.calculate_notes_maps()
+
+
+def get_default_finger_range(finger_number: int = 5) -> float:
+    finger_distribution = generate_finger_distribution(finger_number)
+    return 12 / (max(finger_distribution) - min(finger_distribution))
+
+
+def run_recorder_pool(notes_maps: list[NotesMap], pool_size: int, hand_range: int = 12, finger_number: int = 5, piano: Optional[Piano] = None, finger_range: Optional[float] = None) -> RecorderPool:
+    piano = piano if piano is not None else Piano()
+    finger_distribution = generate_finger_distribution(finger_number)
+    if finger_range is None:
+        finger_range = get_default_finger_range(finger_number)
+
+    recorder_pool = RecorderPool(
+        [create_initial_recorder(piano)], pool_size, 0)
+    recorder_pool.process_notes_maps(
+        notes_maps, hand_range, finger_range, finger_distribution)
+
+    return recorder_pool
+
+
+def measure_recorder_pool(notes_maps: list[NotesMap], pool_size: int, hand_range: int = 12, measure_memory: bool = True, finger_range: Optional[float] = None) -> dict:
+    """
+    测量一次完整的指法搜索
+
+    tracemalloc本身会拖慢搜索，所以计时和测内存分两遍跑：第一遍只计时，第二遍只统计峰值内存。
+
+    Returns:
+        dict: 包含耗时、每秒和弦数、峰值内存（字节）和最终最优熵值
+    """
+    if finger_range is None:
+        finger_range = get_default_finger_range()
+
+    start_time = time.perf_counter()
+    recorder_pool = run_recorder_pool(
+        notes_maps, pool_size, hand_range, finger_range=finger_range)
+    seconds = time.perf_counter() - start_time
+
+    best_entropy = min(
+        recorder.current_entropy for recorder in recorder_pool.recorder_list)
+
+    peak_memory = None
+    if measure_memory:
+        del recorder_pool
+        tracemalloc.start()
+        run_recorder_pool(notes_maps, pool_size,
+                          hand_range, finger_range=finger_range)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'pool_size': pool_size,
+        'hand_range': hand_range,
+        'finger_range': finger_range,
+        'chords': len(notes_maps),
+        'seconds': seconds,
+        'chords_per_second': len(notes_maps) / seconds if seconds > 0 else 0.0,
+        'peak_memory': peak_memory,
+        'best_entropy': best_entropy
+    }
+
+
+def get_git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def run_benchmark(pool_sizes: list[int], output_path: str, work_dir: str = 'output/benchmarks', include_bundled: bool = True, measure_memory: bool = True, seed: int = 0) -> dict:
+    os.makedirs(work_dir, exist_ok=True)
+
+    cases: list[tuple[str, dict, str]] = []
+    for case in SYNTHETIC_CASES:
+        params = {key: value for key, value in case.items() if key != 'name'}
+        midi_file_path = os.path.join(work_dir, f"{case['name']}.mid")
+        generate_synthetic_midi(midi_file_path, seed=seed, **params)
+        cases.append((case['name'], params, midi_file_path))
+
+    if include_bundled and os.path.exists(BUNDLED_MIDI_PATH):
+        cases.append(('world_is_mine', {}, BUNDLED_MIDI_PATH))
+
+    results = []
+    for case_name, params, midi_file_path in cases:
+        notes_maps = load_notes_maps(midi_file_path)
+        for pool_size in pool_sizes:
+            print(f'正在测试{case_name}，pool_size={pool_size}……')
+            measurement = measure_recorder_pool(
+                notes_maps, pool_size, measure_memory=measure_memory)
+            measurement['case'] = case_name
+            measurement['params'] = params
+            results.append(measurement)
+            print(f"  {measurement['chords_per_second']:.1f} 和弦/秒，"
+                  f"峰值内存 {measurement['peak_memory']}，最终熵值 {measurement['best_entropy']}")
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': get_git_revision(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': results
+    }
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f'基准测试结果已保存至{output_path}')
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RecorderPool指法搜索基准测试')
+    parser.add_argument('--pool-sizes', type=int, nargs='+',
+                        default=[10, 50, 100])
+    parser.add_argument('--output', type=str, default='')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='不统计峰值内存，只跑一遍计时')
+    parser.add_argument('--no-bundled', action='store_true',
+                        help='不测试asset/midi下自带的midi')
+    args = parser.parse_args()
+
+    output_path = args.output if args.output else \
+        f"output/benchmarks/benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    run_benchmark(args.pool_sizes, output_path, include_bundled=not args.no_bundled,
+                  measure_memory=not args.no_memory, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
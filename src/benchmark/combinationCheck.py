@@ -0,0 +1,76 @@
+"""
+手指组合生成器的回归检查
+
+用法（在项目根目录下运行）：
+    python -m src.benchmark.combinationCheck --trials 500 --seed 0
+
+随机生成和弦，用itertools.combinations(range(10), len(notes))列出所有组合，再用_create_new_recorder逐个过滤，
+这个暴力结果和Recorder.finger_combinations_generator的输出必须完全相同（包括顺序），否则打印出第一个不一致的和弦并以非0状态退出。
+"""
+
+import argparse
+import itertools
+import random
+import sys
+from typing import Optional
+from src.benchmark.benchmark import create_initial_recorder, get_default_finger_range
+from src.piano.piano import Piano
+from src.recorder.recorder import Recorder
+from src.utils import generate_finger_distribution
+
+
+def brute_force_combinations(recorder: Recorder, notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int]) -> list[tuple[int, ...]]:
+    """
+    生成器加入之前的做法：列出所有组合，能生成新记录器的就是合法的
+    """
+    return [finger_combination
+            for finger_combination in itertools.combinations(range(2 * len(finger_distribution)), len(notes))
+            if recorder._create_new_recorder(dict(zip(notes, finger_combination)), hand_range, finger_range, finger_distribution, 0.0) is not None]
+
+
+def check_combinations(trials: int, seed: int = 0, max_notes: int = 8, hand_ranges: tuple[int, ...] = (11, 12, 13), finger_range: Optional[float] = None) -> Optional[dict]:
+    """
+    Returns:
+        Optional[dict]: 全部一致时返回None，否则返回第一个不一致的和弦和两边的结果
+    """
+    rng = random.Random(seed)
+    finger_distribution = generate_finger_distribution(5)
+    if finger_range is None:
+        finger_range = get_default_finger_range()
+    recorder = create_initial_recorder(Piano())
+
+    for _ in range(trials):
+        notes = sorted(rng.sample(range(36, 96), rng.randint(1, max_notes)))
+        hand_range = rng.choice(hand_ranges)
+        expected = brute_force_combinations(
+            recorder, notes, hand_range, finger_range, finger_distribution)
+        actual = list(Recorder.finger_combinations_generator(
+            notes, hand_range, finger_range, finger_distribution))
+        if actual != expected:
+            return {
+                'notes': notes,
+                'hand_range': hand_range,
+                'expected': expected,
+                'actual': actual
+            }
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='手指组合生成器的回归检查')
+    parser.add_argument('--trials', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-notes', type=int, default=8)
+    args = parser.parse_args()
+
+    mismatch = check_combinations(args.trials, args.seed, args.max_notes)
+    if mismatch is not None:
+        print(f"不一致：音符{mismatch['notes']}，hand_range为{mismatch['hand_range']}")
+        print(f"暴力过滤：{mismatch['expected']}")
+        print(f"生成器：{mismatch['actual']}")
+        sys.exit(1)
+    print(f'{args.trials}个随机和弦的手指组合全部一致')
+
+
+if __name__ == '__main__':
+    main()
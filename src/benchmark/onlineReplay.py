@@ -0,0 +1,80 @@
+"""
+实时指法的回放测试
+
+用法（在项目根目录下运行）：
+    python -m src.benchmark.onlineReplay "asset/midi/World is Mine - Hatsune Miku.mid" --lookahead 2 --budget 5
+
+按原速度把midi的和弦一个个送进OnlineFingering，模拟实时输入，最后输出每个和弦延迟的百分位数。
+加上--fast时不等待，尽快送入所有和弦。
+指定--output时还会检查交给预览的手型状态和导出的.hand文件是否一致，不一致时以非0状态退出。
+"""
+
+import argparse
+import sys
+from typing import Optional
+from src.benchmark.benchmark import load_notes_maps, create_initial_recorder, get_default_finger_range
+from src.piano.piano import Piano
+from src.recorder.handFile import iter_hand_states
+from src.recorder.onlineFingering import OnlineFingering, replay_notes_maps
+from src.utils import generate_finger_distribution
+
+
+def compare_with_exported(committed_states: list[dict], file_path: str) -> Optional[str]:
+    """
+    检查交给预览的手型状态和导出的.hand文件是否一致。
+
+    导出时会插入处理左右手冲突的手型（所有手指都不按键），除此之外每只手的状态和顺序都要完全相同。
+
+    Returns:
+        Optional[str]: 一致时返回None，否则返回第一处不一致的描述
+    """
+    for hand_key in ('left_hand', 'right_hand'):
+        streamed = [hand_state for hand_state in committed_states
+                    if hand_key in hand_state]
+        exported = [hand_state for hand_state in iter_hand_states(file_path)
+                    if hand_key in hand_state]
+        position = 0
+        for hand_state in exported:
+            if position < len(streamed) and streamed[position] == hand_state:
+                position += 1
+            elif any(finger['pressed'] for finger in hand_state[hand_key]['fingers']):
+                return f"{hand_key}：导出的frame为{hand_state['frame']}的手型没有交给预览"
+        if position != len(streamed):
+            return f"{hand_key}：交给预览的frame为{streamed[position]['frame']}的手型和导出的不同"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='实时指法的回放测试')
+    parser.add_argument('midi_file_path', type=str)
+    parser.add_argument('--lookahead', type=int, default=2,
+                        help='确定一个和弦的指法之前等待的后续和弦数量')
+    parser.add_argument('--budget', type=float, default=5.0,
+                        help='每个和弦的延迟预算，单位为毫秒')
+    parser.add_argument('--hand-range', type=int, default=12)
+    parser.add_argument('--max-pool-size', type=int, default=50)
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--fast', action='store_true')
+    parser.add_argument('--output', type=str, default='',
+                        help='可选，把最终指法导出为.hand文件')
+    args = parser.parse_args()
+
+    FPS = 60
+    notes_maps = load_notes_maps(args.midi_file_path, FPS)
+    online_fingering = OnlineFingering(create_initial_recorder(Piano()), args.hand_range, get_default_finger_range(),
+                                       generate_finger_distribution(5), lookahead=args.lookahead,
+                                       latency_budget=args.budget / 1000, max_pool_size=args.max_pool_size)
+    committed_states = replay_notes_maps(online_fingering, notes_maps, FPS,
+                                         args.speed, not args.fast, file_path=args.output or None)
+    online_fingering.print_stats()
+
+    if args.output:
+        mismatch = compare_with_exported(committed_states, args.output)
+        if mismatch is not None:
+            print(f'不一致：{mismatch}')
+            sys.exit(1)
+        print(f'交给预览的{len(committed_states)}个手型状态和导出的.hand文件一致')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+指法搜索参数的并行扫描
+
+用法（在项目根目录下运行）：
+    python -m src.benchmark.parameterSweep "asset/midi/World is Mine - Hatsune Miku.mid" --pool-sizes 10 50 100 --hand-ranges 11 12 13
+
+对pool_size、hand_range、finger_range的每一种组合跑一遍完整的指法搜索，记录耗时、峰值内存和最终熵值，
+结果保存为csv和json，方便挑出达到可接受质量的最便宜的配置。
+
+midi只在主进程里解析一次，解析好的notes_maps在每个工作进程启动时传过去一次，之后每个配置只传参数。
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Optional
+from src.benchmark.benchmark import load_notes_maps, measure_recorder_pool, get_default_finger_range, get_git_revision
+from src.midi.midiToNotes import NotesMap
+
+# 工作进程里共享的notes_maps，由_init_worker设置
+_worker_notes_maps: list[NotesMap] = []
+
+SWEEP_FIELDS = ['pool_size', 'hand_range', 'finger_range', 'chords',
+                'seconds', 'chords_per_second', 'peak_memory', 'best_entropy', 'error']
+
+
+def _init_worker(notes_maps: list[NotesMap]):
+    global _worker_notes_maps
+    _worker_notes_maps = notes_maps
+
+
+def _run_configuration(pool_size: int, hand_range: int, finger_range: float, measure_memory: bool) -> dict:
+    try:
+        result = measure_recorder_pool(_worker_notes_maps, pool_size, hand_range,
+                                       measure_memory=measure_memory, finger_range=finger_range)
+        result['error'] = None
+        return result
+    except Exception as e:
+        # 有些参数组合会生成不合法的手型（例如finger_range过大），记下错误，不影响其它配置
+        return {
+            'pool_size': pool_size,
+            'hand_range': hand_range,
+            'finger_range': finger_range,
+            'chords': len(_worker_notes_maps),
+            'seconds': None,
+            'chords_per_second': None,
+            'peak_memory': None,
+            'best_entropy': None,
+            'error': str(e)
+        }
+
+
+def run_parameter_sweep(notes_maps: list[NotesMap], pool_sizes: list[int], hand_ranges: list[int], finger_ranges: Optional[list[float]] = None, max_workers: Optional[int] = None, measure_memory: bool = True) -> list[dict]:
+    """
+    在进程池里扫描所有参数组合
+
+    Args:
+        notes_maps: 已经解析好的和弦序列
+        pool_sizes / hand_ranges / finger_ranges: 各参数的候选值，finger_ranges为空时使用默认的finger_range
+        max_workers: 进程数，为None时使用CPU核数
+        measure_memory: 是否统计峰值内存（会让每个配置多跑一遍）
+
+    Returns:
+        list[dict]: 每个配置一条结果，按pool_size、hand_range、finger_range排序
+    """
+    if not finger_ranges:
+        finger_ranges = [get_default_finger_range()]
+    configurations = list(itertools.product(
+        pool_sizes, hand_ranges, finger_ranges))
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(notes_maps,)) as executor:
+        futures = [executor.submit(_run_configuration, pool_size, hand_range, finger_range, measure_memory)
+                   for pool_size, hand_range, finger_range in configurations]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['error'] is not None:
+                print(f"失败 pool_size={result['pool_size']}，hand_range={result['hand_range']}，"
+                      f"finger_range={result['finger_range']:.3f}：{result['error']}")
+                continue
+            print(f"完成 pool_size={result['pool_size']}，hand_range={result['hand_range']}，"
+                  f"finger_range={result['finger_range']:.3f}：耗时{result['seconds']:.2f}秒，熵值{result['best_entropy']}")
+
+    results.sort(key=lambda result: (
+        result['pool_size'], result['hand_range'], result['finger_range']))
+    return results
+
+
+def pick_cheapest_configuration(results: list[dict], entropy_tolerance: float = 0.05) -> Optional[dict]:
+    """
+    在熵值不超过最优熵值(1 + entropy_tolerance)倍的配置中，挑出耗时最短的一个，失败的配置不参与挑选
+    """
+    results = [result for result in results if result['error'] is None]
+    if not results:
+        return None
+    best_entropy = min(result['best_entropy'] for result in results)
+    acceptable = [result for result in results
+                  if result['best_entropy'] <= best_entropy * (1 + entropy_tolerance)]
+    return min(acceptable, key=lambda result: result['seconds'])
+
+
+def export_sweep_csv(results: list[dict], file_path: str):
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SWEEP_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({field: result.get(field)
+                            for field in SWEEP_FIELDS})
+
+
+def print_sweep_table(results: list[dict]):
+    print(f"{'pool_size':>9} {'hand_range':>10} {'finger_range':>12} {'秒':>9} {'峰值内存(MB)':>12} {'熵值':>12}")
+    for result in results:
+        if result['error'] is not None:
+            print(f"{result['pool_size']:>9} {result['hand_range']:>10} {result['finger_range']:>12.3f} 失败：{result['error']}")
+            continue
+        peak_memory = result['peak_memory']
+        peak_memory_text = f'{peak_memory / 1024 / 1024:.1f}' if peak_memory is not None else '-'
+        print(f"{result['pool_size']:>9} {result['hand_range']:>10} {result['finger_range']:>12.3f} "
+              f"{result['seconds']:>9.2f} {peak_memory_text:>12} {result['best_entropy']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='指法搜索参数的并行扫描')
+    parser.add_argument('midi_file_path', type=str)
+    parser.add_argument('--pool-sizes', type=int, nargs='+',
+                        default=[10, 50, 100])
+    parser.add_argument('--hand-ranges', type=int, nargs='+', default=[12])
+    parser.add_argument('--finger-ranges', type=float, nargs='+', default=[],
+                        help='不指定时使用默认的finger_range')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='不统计峰值内存，每个配置只跑一遍')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='挑选配置时允许的熵值相对误差')
+    parser.add_argument('--output', type=str, default='',
+                        help='输出文件路径（不含扩展名），会同时生成.csv和.json')
+    args = parser.parse_args()
+
+    notes_maps = load_notes_maps(args.midi_file_path)
+    results = run_parameter_sweep(notes_maps, args.pool_sizes, args.hand_ranges, args.finger_ranges,
+                                  args.workers, not args.no_memory)
+    print_sweep_table(results)
+
+    cheapest = pick_cheapest_configuration(results, args.tolerance)
+    if cheapest is not None:
+        print(f"熵值在最优的{args.tolerance:.0%}以内、耗时最短的配置：pool_size={cheapest['pool_size']}，"
+              f"hand_range={cheapest['hand_range']}，finger_range={cheapest['finger_range']:.3f}")
+
+    output_path = args.output if args.output else \
+        f"output/benchmarks/sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    export_sweep_csv(results, f'{output_path}.csv')
+    with open(f'{output_path}.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': get_git_revision(),
+            'midi_file_path': args.midi_file_path,
+            'cheapest': cheapest,
+            'results': results
+        }, f, ensure_ascii=False, indent=4)
+    print(f'扫描结果已保存至{output_path}.csv和{output_path}.json')
+
+
+if __name__ == '__main__':
+    main()
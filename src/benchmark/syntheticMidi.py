@@ -0,0 +1,93 @@
+import random
+from mido import MidiFile, MidiTrack, Message, MetaMessage, bpm2tempo
+
+
+def generate_synthetic_midi(file_path: str, chord_amount: int = 500, polyphony: int = 4, tempo_change_amount: int = 0, register_spread: int = 36, seed: int = 0, ticks_per_beat: int = 480, base_bpm: int = 120) -> str:
+    """
+    生成可控的合成钢琴midi，用于指法搜索的基准测试
+
+    Args:
+        file_path: 输出的midi文件路径
+        chord_amount: 和弦（包括单音）的数量，决定曲子长度
+        polyphony: 每个和弦最多的音符数量，实际数量在1到polyphony之间随机
+        tempo_change_amount: 全曲速度变化的次数
+        register_spread: 左右手中心位置随机游走的音域宽度（半音数）
+        seed: 随机种子，相同参数和种子总是生成相同的文件
+        ticks_per_beat: 每拍tick数
+        base_bpm: 初始速度
+
+    Returns:
+        str: 生成的midi文件路径
+    """
+    rng = random.Random(seed)
+    midi_file = MidiFile(ticks_per_beat=ticks_per_beat)
+
+    # 0轨只放速度信息，1轨放音符
+    tempo_track = MidiTrack()
+    note_track = MidiTrack()
+    midi_file.tracks.append(tempo_track)
+    midi_file.tracks.append(note_track)
+
+    durations = [ticks_per_beat // 4, ticks_per_beat // 2, ticks_per_beat]
+    chord_durations = [rng.choice(durations) for _ in range(chord_amount)]
+    total_ticks = sum(chord_durations)
+
+    # 速度变化均匀分布在全曲中
+    tempo_track.append(MetaMessage(
+        'set_tempo', tempo=bpm2tempo(base_bpm), time=0))
+    if tempo_change_amount > 0:
+        interval = total_ticks // (tempo_change_amount + 1)
+        for _ in range(tempo_change_amount):
+            bpm = rng.randint(int(base_bpm * 0.6), int(base_bpm * 1.6))
+            tempo_track.append(MetaMessage(
+                'set_tempo', tempo=bpm2tempo(bpm), time=interval))
+
+    # 左右手中心位置分别在C3和C5附近随机游走，游走范围由register_spread决定
+    half_spread = register_spread // 2
+    left_center = 48
+    right_center = 72
+
+    for duration in chord_durations:
+        left_center = _walk(rng, left_center, 48 - half_spread, 48 + half_spread)
+        right_center = _walk(rng, right_center, 72 - half_spread, 72 + half_spread)
+
+        note_amount = rng.randint(1, max(1, polyphony))
+        # 把音符分给左右手，每只手最多5个音
+        right_amount = min(5, rng.randint(
+            (note_amount + 1) // 2, note_amount))
+        left_amount = min(5, note_amount - right_amount)
+
+        notes = set()
+        notes.update(_pick_notes(rng, left_center, left_amount))
+        notes.update(_pick_notes(rng, right_center, right_amount))
+        chord_notes = sorted(notes)
+
+        for note in chord_notes:
+            note_track.append(Message(
+                'note_on', note=note, velocity=rng.randint(60, 100), time=0))
+        for i, note in enumerate(chord_notes):
+            note_track.append(Message(
+                'note_off', note=note, velocity=0, time=duration if i == 0 else 0))
+
+    midi_file.save(file_path)
+    return file_path
+
+
+def _walk(rng: random.Random, center: int, low: int, high: int) -> int:
+    """
+    手的中心位置小步随机游走，偶尔大跳
+    """
+    step = rng.choice([-2, -1, 0, 0, 1, 2]) if rng.random() > 0.1 else \
+        rng.choice([-12, -7, 7, 12])
+    return min(high, max(low, center + step))
+
+
+def _pick_notes(rng: random.Random, center: int, amount: int) -> list[int]:
+    """
+    在中心位置附近一个八度内挑选amount个音符，并限制在钢琴音域内
+    """
+    if amount <= 0:
+        return []
+    candidates = [note for note in range(center - 6, center + 7)
+                  if 21 <= note <= 108]
+    return rng.sample(candidates, min(amount, len(candidates)))
@@ -11,6 +11,7 @@ class Hand:
         self.max_distance: int = max_distance
         self.finger_number: int = finger_number
         self.hand_note: float = 0.0
+        self._signature: tuple = ()
         if len(fingers) < self.finger_number:
             self._generate_empty_fingers()
         self._calculate_hand_note()
@@ -132,6 +133,15 @@ class Hand:
 
         return expected_distance
 
+    def get_signature(self) -> tuple:
+        """
+        手型的紧凑签名，只包含calculate_hand_diff会用到的信息：左右手，以及按顺序排列的每个手指的音符和是否按下
+        """
+        if not self._signature:
+            self._signature = (self.is_left,) + tuple(
+                finger.key_note.note * 2 + finger.pressed for finger in self.fingers)
+        return self._signature
+
     def calculate_hand_diff(self, next_hand: 'Hand') -> float:
         total_diff = 0
 
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from src.hand.hand import Hand
+
+
+class HandDiffCache:
+    """
+    Hand.calculate_hand_diff的LRU缓存。
+
+    相邻两步的记录池里经常有大量相同的前一手型和相同的候选手型，重复的音型（固定低音、阿尔贝蒂低音等）更是如此。
+    calculate_hand_diff的结果只取决于两只手每个手指的音符和是否按下，所以用这些信息组成的签名做键，
+    命中时只需要一次字典查询。
+    """
+
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self._cache: OrderedDict[tuple, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_hand_diff(self, current_hand: Hand, next_hand: Hand) -> float:
+        key = (current_hand.get_signature(), next_hand.get_signature())
+        cache = self._cache
+
+        hand_diff = cache.get(key)
+        if hand_diff is not None:
+            self.hits += 1
+            cache.move_to_end(key)
+            return hand_diff
+
+        self.misses += 1
+        hand_diff = current_hand.calculate_hand_diff(next_hand)
+        cache[key] = hand_diff
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+            self.evictions += 1
+
+        return hand_diff
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def export_stats(self) -> dict:
+        return {
+            'size': len(self._cache),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate
+        }
+
+    def print_stats(self):
+        print(f'手型差异缓存：命中{self.hits}次，未命中{self.misses}次，'
+              f'命中率{self.hit_rate:.2%}，当前缓存{len(self._cache)}/{self.max_size}条')
@@ -0,0 +1,155 @@
+from typing import Optional
+from src.midi.midiToNotes import NotesMap
+
+
+def _reachable_prefix_length(notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int]) -> int:
+    """
+    一只手从最低音开始往上，最多能按住前几个音符。
+
+    每个音符都贪心地用能用的最小手指：手指坐标是递增的，前一个音符用的手指越靠前，后面可选的手指只会越多，
+    所以贪心的结果就是最优的，整个过程是O(和弦音符数量 × 手指数量)。
+    """
+    finger_number = len(finger_distribution)
+    if not notes:
+        return 0
+
+    prev_finger = 0
+    for position in range(1, len(notes)):
+        if notes[position] - notes[0] > hand_range:
+            return position
+        note_diff = notes[position] - notes[position - 1]
+        finger_index = prev_finger + 1
+        while finger_index < finger_number and \
+                note_diff > finger_range * abs(finger_distribution[finger_index] - finger_distribution[prev_finger]):
+            finger_index += 1
+        if finger_index >= finger_number:
+            return position
+        prev_finger = finger_index
+    return len(notes)
+
+
+def _reachable_suffix_start(notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int]) -> int:
+    """
+    一只手从最高音开始往下，最多能按住的后缀从哪个下标开始，和_reachable_prefix_length对称
+    """
+    mirrored_notes = [-note for note in reversed(notes)]
+    mirrored_distribution = [-position for position in reversed(finger_distribution)]
+    return len(notes) - _reachable_prefix_length(mirrored_notes, hand_range, finger_range, mirrored_distribution)
+
+
+def find_unreachable_range(notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int]) -> Optional[tuple[int, int]]:
+    """
+    检查和弦能不能用两只手按下：左手按音符的前缀，右手按后缀，和搜索时的手指组合规则相同
+    （Recorder.finger_combinations_generator）。
+
+    左手能按住的前缀越短越容易，右手的后缀也一样，所以只要左手最长的前缀和右手最长的后缀能覆盖所有音符，
+    和弦就能按下，否则中间没被覆盖的音符就是问题所在。
+
+    Args:
+        notes: 从低到高排列、不重复的音符
+
+    Returns:
+        Optional[tuple[int, int]]: 能按下时返回None，否则返回两只手都按不到的音符下标范围[start, end)
+    """
+    left_end = _reachable_prefix_length(
+        notes, hand_range, finger_range, finger_distribution)
+    right_start = _reachable_suffix_start(
+        notes, hand_range, finger_range, finger_distribution)
+    if right_start <= left_end:
+        return None
+    return left_end, right_start
+
+
+def is_chord_reachable(notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int]) -> bool:
+    return find_unreachable_range(notes, hand_range, finger_range, finger_distribution) is None
+
+
+def repair_chord(notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int]) -> list[int]:
+    """
+    去掉尽量少的音符，让和弦能被两只手按下，规则和MidiProcessor.simplifyNotes一致：
+    1. 最低音和最高音始终保留；
+    2. 优先去掉两只手都按不到的音符中，和其它音符有八度关系的音符（音名在和弦中还有别的音，去掉后和声不变）；
+    3. 没有这样的音符时，去掉按不到的音符中最靠中间的那个。
+
+    只剩最低音和最高音时一定能按下（一只手一个），所以一定会结束。
+    """
+    notes = list(notes)
+    while True:
+        unreachable_range = find_unreachable_range(
+            notes, hand_range, finger_range, finger_distribution)
+        if unreachable_range is None:
+            return notes
+
+        # 最低音和最高音各自总能被一只手按住，所以按不到的音符一定在中间
+        start, end = unreachable_range
+        start = max(start, 1)
+        end = min(end, len(notes) - 1)
+        candidates = list(range(start, end))
+        octave_candidates = [index for index in candidates
+                             if any((notes[index] - note) % 12 == 0 for note in notes if note != notes[index])]
+        if octave_candidates:
+            candidates = octave_candidates
+        notes.pop(candidates[len(candidates) // 2])
+
+
+class ReachabilityReport:
+    """
+    预处理的结果：哪些和弦原本按不下，去掉了哪些音符
+    """
+
+    def __init__(self):
+        self.total_chords = 0
+        # (和弦下标, frame, 原来的音符, 去掉的音符)
+        self.repaired: list[tuple[int, float, list[int], list[int]]] = []
+
+    @property
+    def removed_notes(self) -> int:
+        return sum(len(removed) for _, _, _, removed in self.repaired)
+
+    def export_report(self) -> dict:
+        return {
+            'total_chords': self.total_chords,
+            'repaired_chords': len(self.repaired),
+            'removed_notes': self.removed_notes,
+            'chords': [{'index': index, 'frame': frame, 'notes': notes, 'removed': removed}
+                       for index, frame, notes, removed in self.repaired]
+        }
+
+    def print_report(self, max_lines: int = 20):
+        print(f'可达性检查：{self.total_chords}个和弦中有{len(self.repaired)}个两只手按不下，'
+              f'一共去掉{self.removed_notes}个音符')
+        for index, frame, notes, removed in self.repaired[:max_lines]:
+            print(f'  第{index}个和弦，frame={frame:.1f}，音符{notes}，去掉{removed}')
+        if len(self.repaired) > max_lines:
+            print(f'  ……还有{len(self.repaired) - max_lines}个')
+
+
+def repair_unreachable_chords(notes_maps: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int]) -> tuple[list[NotesMap], ReachabilityReport]:
+    """
+    在搜索之前检查每个和弦，两只手按不下的和弦按repair_chord的规则精简，
+    这样搜索时就不会在这些和弦上白白展开所有组合，再退回到repeat_self。
+
+    Returns:
+        tuple: (新的notes_maps，没改动的和弦还是原来的对象；检查报告)
+    """
+    report = ReachabilityReport()
+    report.total_chords = len(notes_maps)
+    repaired_notes_maps: list[NotesMap] = []
+    for index, notes_map in enumerate(notes_maps):
+        notes = notes_map['notes']
+        if is_chord_reachable(notes, hand_range, finger_range, finger_distribution):
+            repaired_notes_maps.append(notes_map)
+            continue
+
+        repaired_notes = repair_chord(
+            notes, hand_range, finger_range, finger_distribution)
+        removed = [note for note in notes if note not in repaired_notes]
+        report.repaired.append(
+            (index, notes_map['frame'], list(notes), removed))
+        repaired_notes_maps.append({
+            'notes': repaired_notes,
+            'real_tick': notes_map['real_tick'],
+            'frame': notes_map['frame']
+        })
+
+    return repaired_notes_maps, report
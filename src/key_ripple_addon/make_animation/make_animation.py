@@ -1,5 +1,7 @@
 import bpy  # type: ignore
 import json
+import os
+import numpy as np
 
 
 def collect_collection_objects(col, exclude_names, object_names):
@@ -158,14 +160,98 @@ def clear_all_keyframe(collection_name=None, exclude_names=None):
     bpy.ops.object.select_all(action='DESELECT')
 
 
+def iter_animation_entries(animation_file_path: str):
+    """
+    逐行读取.animation文件（JSON Lines，每行一个关键帧），兼容旧版的json数组格式
+    """
+    with open(animation_file_path, 'r', encoding='utf-8') as f:
+        first_char = ''
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                first_char = char
+                break
+
+        f.seek(0)
+        if first_char == '[':
+            # 旧版格式，整个文件是一个json数组
+            yield from json.load(f)
+            return
+
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def make_animation_from_npz(animation_file_path: str):
+    """
+    导入按通道存储的.animation.npz（由Animator.generate_animation_info(columnar=True)生成）
+
+    文件里已经是每个通道（物体名 + data_path）整理好的关键帧：帧号取整、同一帧只保留最后一个、四元数已经处理过正负号，
+    空的fcurve只需要一次keyframe_points.add和一次foreach_set，不需要逐帧调用keyframe_insert；
+    已经有关键帧的fcurve逐帧insert，和keyframe_insert一样只替换同一帧上的关键帧，其它帧上原有的关键帧保留。
+
+    注意：这个导入路径还没有在Blender里实际运行过，只核对过文件内容和逐帧导入时应得的关键帧一致，
+    所以make_animation不会自动调用它，需要手动调用。正式使用前请先在Blender里和.animation文件的导入结果对比一下。
+    """
+    with np.load(animation_file_path) as data:
+        for channel_index, (obj_name, data_path) in enumerate(zip(data['object_names'], data['data_paths'])):
+            obj_name = str(obj_name)
+            data_path = str(data_path)
+            # 检查物体是否存在
+            if obj_name not in bpy.data.objects:
+                if not obj_name.startswith("Tar_H"):
+                    print(f"警告: 物体 {obj_name} 不存在于场景中")
+                continue
+
+            obj = bpy.data.objects[obj_name]
+            if data_path == "rotation_quaternion":
+                obj.rotation_mode = 'QUATERNION'
+
+            frames = data[f'frames_{channel_index}']
+            values = data[f'values_{channel_index}']
+
+            if obj.animation_data is None:
+                obj.animation_data_create()
+            if obj.animation_data.action is None:
+                obj.animation_data.action = bpy.data.actions.new(
+                    name=f"{obj.name}Action")
+            action = obj.animation_data.action
+
+            # 每个分量一条fcurve，co是[帧, 值, 帧, 值, ...]
+            coordinates = np.empty(2 * len(frames), dtype=np.float32)
+            coordinates[0::2] = frames
+            for array_index in range(values.shape[1]):
+                fcurve = action.fcurves.find(data_path, index=array_index)
+                if fcurve is None:
+                    fcurve = action.fcurves.new(
+                        data_path, index=array_index, action_group="Object Transforms")
+                elif len(fcurve.keyframe_points) > 0:
+                    # 不能清空用户已有的关键帧，只能逐帧替换
+                    for frame, value in zip(frames, values[:, array_index]):
+                        fcurve.keyframe_points.insert(float(frame), float(value))
+                    fcurve.update()
+                    continue
+
+                coordinates[1::2] = values[:, array_index]
+                fcurve.keyframe_points.add(len(frames))
+                fcurve.keyframe_points.foreach_set('co', coordinates)
+                # 重新计算贝塞尔手柄
+                fcurve.update()
+
+
 def make_animation(animation_file_path: str):
-    # 读取动画文件
-    try:
-        with open(animation_file_path, 'r') as f:
-            animation_data = json.load(f)
-    except Exception as e:
-        print(f"无法读取动画文件: {e}")
+    # 读取动画文件，逐行处理，不需要一次性读入整个文件
+    if not os.path.isfile(animation_file_path):
+        print(f"无法读取动画文件: {animation_file_path} 不存在")
+        return
+
+    if animation_file_path.endswith('.npz'):
+        # make_animation_from_npz还没有在Blender里验证过，暂时不自动导入
+        print(f"暂不支持导入.animation.npz文件: {animation_file_path}，请导出为.animation")
         return
+    animation_data = iter_animation_entries(animation_file_path)
 
     # 用于存储每个物体的上一帧四元数
     previous_quaternions = {}
@@ -303,7 +389,7 @@ def generate_piano_key_animation(piano_key_animation_path: str):
 
     obj_name = 'keyboard'
 
-    # 处理每个键的动画数据
+    # 处理每个键的动画数据，新版数据每个键只有一个条目，物体和形态键只需要查找一次
     for key_data in piano_key_animation_data:
         key_name = key_data["key_name"]
         use_key = key_name in bpy.data.objects
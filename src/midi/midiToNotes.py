@@ -39,8 +39,9 @@ class PitchWheelItem(TypedDict):
 
 
 class MidiProcessor:
-    def __init__(self, midi_name: str, track_numbers: List[int] = [], channel_number: int = -1, FPS: int = 30):
-        self.midi_file_path = f'asset/midi/{midi_name}.mid'
+    def __init__(self, midi_name: str, track_numbers: List[int] = [], channel_number: int = -1, FPS: int = 30, midi_file_path: str = ""):
+        # 默认从asset/midi/下读取，也可以直接指定midi文件路径
+        self.midi_file_path = midi_file_path if midi_file_path else f'asset/midi/{midi_name}.mid'
         self.track_numbers = track_numbers
         self.channel_number = channel_number
         self.FPS = FPS
@@ -254,6 +255,19 @@ class MidiProcessor:
 
         return simplified_chord_notes
 
+    def calculate_notes_maps(self, higher_octave: bool = False) -> list[NotesMap]:
+        """
+        只计算带frame的notes_map，不保存中间文件，也不输出统计信息，主要给基准测试等批量任务使用
+        """
+        tempo_changes, ticks_per_beat = self.get_tempo_changes()
+        notes_maps, _, _ = self.midiToPianoNotes(higher_octave)
+
+        for notes_map in notes_maps:
+            notes_map['frame'] = self.calculate_frame(
+                tempo_changes, ticks_per_beat, notes_map['real_tick'])
+
+        return notes_maps
+
     def generate_notes_map_and_messages(self, higher_octave: bool = False) -> list[NotesMap]:
         """
         :return: notes_map, pitch_wheel_map, messages. 音符映射，音高映射，消息
@@ -0,0 +1,104 @@
+import time
+from typing import Optional
+from src.recorder.recorder import Recorder
+from src.recorder.recorderPool import RecorderPool
+from src.midi.midiToNotes import NotesMap
+from src.hand.handDiffCache import HandDiffCache
+
+
+class AnytimeSolver:
+    """
+    带时间预算的指法搜索，适合预览：
+
+    1. 先用很小的pool_size完整跑一遍，尽快得到一个完整的指法；
+    2. 只要还有时间，就把pool_size放大重新搜索，超时的那一遍直接放弃；
+    3. 始终保留熵值最低的完整结果，随时可以通过export_pool_info导出。
+
+    所有轮次共用同一个HandDiffCache，后面的轮次可以直接用到前面算过的手型差异。
+    """
+
+    def __init__(self, initial_recorder: Recorder, notes_maps: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int], time_budget: float, initial_pool_size: int = 1, max_pool_size: int = 1000, growth_factor: int = 4, hand_diff_cache: Optional[HandDiffCache] = None):
+        self.initial_recorder = initial_recorder
+        self.notes_maps = notes_maps
+        self.hand_range = hand_range
+        self.finger_range = finger_range
+        self.finger_distribution = finger_distribution
+        # 时间预算，单位为秒
+        self.time_budget = time_budget
+        self.initial_pool_size = max(1, initial_pool_size)
+        self.max_pool_size = max(self.initial_pool_size, max_pool_size)
+        self.growth_factor = max(2, growth_factor)
+        self.hand_diff_cache = hand_diff_cache if hand_diff_cache is not None else HandDiffCache()
+
+        self.best_pool: Optional[RecorderPool] = None
+        self.best_entropy = float('inf')
+        self.best_pool_size = 0
+        # 每一轮的记录：pool_size、耗时、是否完成、最终熵值
+        self.passes: list[dict] = []
+
+    def solve(self) -> Optional[RecorderPool]:
+        start_time = time.perf_counter()
+        deadline = start_time + self.time_budget
+        pool_size = self.initial_pool_size
+        last_seconds = 0.0
+        last_pool_size = pool_size
+
+        while True:
+            # 根据上一轮的耗时估计这一轮的耗时，明显来不及的话就不必开始了
+            remaining = deadline - time.perf_counter()
+            if self.best_pool is not None:
+                estimated_seconds = last_seconds * pool_size / last_pool_size
+                if estimated_seconds > remaining:
+                    break
+
+            pass_start = time.perf_counter()
+            # 第一轮必须跑完，保证至少有一个完整的结果
+            pool = self._run_pass(
+                pool_size, deadline if self.best_pool is not None else None)
+            last_seconds = time.perf_counter() - pass_start
+            last_pool_size = pool_size
+
+            completed = pool is not None
+            entropy = min(recorder.current_entropy for recorder in pool.recorder_list) \
+                if pool is not None else None
+            self.passes.append({
+                'pool_size': pool_size,
+                'seconds': last_seconds,
+                'completed': completed,
+                'best_entropy': entropy
+            })
+
+            if pool is None or entropy is None:
+                print(f'pool_size={pool_size}的搜索超出时间预算，已放弃')
+                break
+
+            print(f'pool_size={pool_size}的搜索完成，耗时{last_seconds:.2f}秒，熵值为{entropy}')
+            if entropy < self.best_entropy:
+                self.best_pool = pool
+                self.best_entropy = entropy
+                self.best_pool_size = pool_size
+
+            if pool_size >= self.max_pool_size or time.perf_counter() >= deadline:
+                break
+            pool_size = min(self.max_pool_size, pool_size * self.growth_factor)
+
+        print(f'时间预算内的最优结果来自pool_size={self.best_pool_size}，熵值为{self.best_entropy}，'
+              f'总耗时{time.perf_counter() - start_time:.2f}秒')
+        return self.best_pool
+
+    def _run_pass(self, pool_size: int, deadline: Optional[float]) -> Optional[RecorderPool]:
+        """
+        用指定的pool_size完整搜索一遍，超过deadline时返回None
+        """
+        recorder_pool = RecorderPool(
+            [self.initial_recorder], pool_size, 0, hand_diff_cache=self.hand_diff_cache)
+
+        completed = recorder_pool.process_notes_maps(
+            self.notes_maps, self.hand_range, self.finger_range, self.finger_distribution, deadline)
+
+        return recorder_pool if completed else None
+
+    def export_pool_info(self, file_path: str):
+        if self.best_pool is None:
+            raise Exception('还没有完整的指法结果，请先调用solve')
+        self.best_pool.export_pool_info(file_path)
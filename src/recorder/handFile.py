@@ -0,0 +1,308 @@
+"""
+.hand文件的读写。
+
+.hand文件使用JSON Lines格式：每行是一个不带缩进的手型状态，形如{"left_hand": {...}, "frame": 12.0}或{"right_hand": {...}, "frame": 12.0}。
+写入时边生成边写，读取时逐行解析，都不需要把整首曲子的数据一次性放进内存。
+读取时也兼容旧版本导出的、整个文件是一个json数组的.hand文件。
+
+另外还支持列式的二进制格式（.npy和.npz），见HandTimeline。
+搜索过程中已经确定的手型状态可以先写进HandStateSpool，导出时再和剩下的部分拼起来。
+"""
+
+import json
+import os
+import numpy as np
+from typing import Iterable, Iterator
+
+
+def write_hand_states(file_path: str, hand_states: Iterable[dict]) -> int:
+    """
+    把手型状态逐行写入.hand文件
+
+    Args:
+        file_path: 输出文件路径
+        hand_states: 手型状态的可迭代对象，可以是生成器
+
+    Returns:
+        int: 写入的状态数量
+    """
+    amount = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for hand_state in hand_states:
+            f.write(json.dumps(hand_state, ensure_ascii=False,
+                    separators=(',', ':')))
+            f.write('\n')
+            amount += 1
+    return amount
+
+
+def iter_hand_states(file_path: str) -> Iterator[dict]:
+    """
+    逐个读取.hand文件中的手型状态，兼容旧版的json数组格式
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        first_char = ''
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                first_char = char
+                break
+
+        f.seek(0)
+        if first_char == '[':
+            # 旧版格式，整个文件是一个json数组
+            yield from json.load(f)
+            return
+
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class HandStateSpool:
+    """
+    搜索过程中已经确定（不会再改变）的手型状态的暂存文件。
+
+    左右手分别写入{prefix}.left.hand和{prefix}.right.hand，格式和.hand文件相同，写入后就不再占用内存，
+    生成动画时可以直接读取已经确定的部分。左右手冲突检测要用到整首曲子的frame和拇指音符，
+    所以这两样仍然留在内存里，它们只是数字，比Hand对象小得多。
+
+    用完后要调用close()（或者用with语句），delete_on_close为True时会同时删掉两个暂存文件。
+    """
+
+    def __init__(self, prefix: str, delete_on_close: bool = False):
+        self.prefix = prefix
+        self.delete_on_close = delete_on_close
+        self.left_file_path = f'{prefix}.left.hand'
+        self.right_file_path = f'{prefix}.right.hand'
+        self._left_file = open(self.left_file_path, 'w', encoding='utf-8')
+        self._right_file = open(self.right_file_path, 'w', encoding='utf-8')
+        self.left_frames: list[float] = []
+        self.left_thumb_notes: list[int] = []
+        self.right_frames: list[float] = []
+        self.right_thumb_notes: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.left_frames) + len(self.right_frames)
+
+    def write(self, is_left: bool, hand_info: dict, frame: float, thumb_note: int) -> dict:
+        """
+        写入一个手型状态，返回写入的状态（格式和.hand文件中的状态相同）
+        """
+        hand_state = {'left_hand' if is_left else 'right_hand': hand_info,
+                      'frame': frame}
+        f = self._left_file if is_left else self._right_file
+        f.write(json.dumps(hand_state, ensure_ascii=False,
+                separators=(',', ':')))
+        f.write('\n')
+        if is_left:
+            self.left_frames.append(frame)
+            self.left_thumb_notes.append(thumb_note)
+        else:
+            self.right_frames.append(frame)
+            self.right_thumb_notes.append(thumb_note)
+        return hand_state
+
+    def flush(self):
+        self._left_file.flush()
+        self._right_file.flush()
+
+    def iter_hand_states(self, is_left: bool) -> Iterator[dict]:
+        """
+        按写入顺序读回某只手已经确定的状态
+        """
+        self.flush()
+        yield from iter_hand_states(self.left_file_path if is_left else self.right_file_path)
+
+    def close(self):
+        """
+        关闭暂存文件，可以重复调用
+        """
+        self._left_file.close()
+        self._right_file.close()
+        if self.delete_on_close:
+            for file_path in (self.left_file_path, self.right_file_path):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def __enter__(self) -> 'HandStateSpool':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HandTimeline:
+    """
+    列式存储的手型时间线，每个手型状态占一行：
+
+    - frame: (N,) float64
+    - is_left: (N,) bool
+    - hand_note: (N,) float64
+    - hand_span: (N,) int16
+    - note / pressed / keep_pressed: (N, finger_number)，第j列是该手的第j个手指（左手finger_index为j，右手为j+finger_number）
+
+    状态的顺序和.hand文件里的顺序一致。可以保存为二进制格式，读取时不需要为每个手指构建字典：
+    - .npy：所有列放在一个结构化数组里，读取时用内存映射，各列只在用到时才从磁盘读取；
+    - .npz：每列一个数组，读取时一次性读入所有列。
+    """
+
+    def __init__(self, frame: np.ndarray, is_left: np.ndarray, hand_note: np.ndarray, hand_span: np.ndarray, note: np.ndarray, pressed: np.ndarray, keep_pressed: np.ndarray):
+        self.frame = frame
+        self.is_left = is_left
+        self.hand_note = hand_note
+        self.hand_span = hand_span
+        self.note = note
+        self.pressed = pressed
+        self.keep_pressed = keep_pressed
+        self.finger_number: int = note.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @classmethod
+    def from_hand_states(cls, hand_states: Iterable[dict], finger_number: int = 5) -> 'HandTimeline':
+        """
+        从.hand格式的手型状态（字典）构建时间线，hand_states可以是生成器
+        """
+        frames: list[float] = []
+        is_lefts: list[bool] = []
+        hand_notes: list[float] = []
+        hand_spans: list[int] = []
+        notes: list[list[int]] = []
+        presseds: list[list[bool]] = []
+        keep_presseds: list[list[bool]] = []
+
+        for hand_state in hand_states:
+            is_left = 'left_hand' in hand_state
+            hand_item = hand_state['left_hand'] if is_left else hand_state['right_hand']
+            finger_offset = 0 if is_left else finger_number
+
+            note_row = [0] * finger_number
+            pressed_row = [False] * finger_number
+            keep_pressed_row = [False] * finger_number
+            for finger in hand_item['fingers']:
+                slot = finger['finger_index'] - finger_offset
+                note_row[slot] = finger['key_note']['note']
+                pressed_row[slot] = finger['pressed']
+                keep_pressed_row[slot] = finger['is_keep_pressed']
+
+            frames.append(hand_state['frame'])
+            is_lefts.append(is_left)
+            hand_notes.append(hand_item['hand_note'])
+            hand_spans.append(hand_item['hand_span'])
+            notes.append(note_row)
+            presseds.append(pressed_row)
+            keep_presseds.append(keep_pressed_row)
+
+        return cls(
+            np.array(frames, dtype=np.float64),
+            np.array(is_lefts, dtype=bool),
+            np.array(hand_notes, dtype=np.float64),
+            np.array(hand_spans, dtype=np.int16),
+            np.array(notes, dtype=np.int16).reshape(-1, finger_number),
+            np.array(presseds, dtype=bool).reshape(-1, finger_number),
+            np.array(keep_presseds, dtype=bool).reshape(-1, finger_number)
+        )
+
+    @classmethod
+    def load(cls, file_path: str) -> 'HandTimeline':
+        """
+        读取.hand文件：.npy使用内存映射，.npz直接读取各列，其它情况按JSON Lines（或旧版json数组）逐行解析
+        """
+        if file_path.endswith('.npy'):
+            # 每一列都是内存映射数组上的视图，只有真正访问到的部分才会从磁盘读取
+            data = np.load(file_path, mmap_mode='r')
+            return cls(
+                data['frame'],
+                data['is_left'],
+                data['hand_note'],
+                data['hand_span'],
+                data['note'],
+                data['pressed'],
+                data['keep_pressed']
+            )
+
+        if not file_path.endswith('.npz'):
+            return cls.from_hand_states(iter_hand_states(file_path))
+
+        # npz是zip压缩包，不能内存映射，各列会在这里一次性读入
+        with np.load(file_path) as data:
+            return cls(
+                data['frame'],
+                data['is_left'],
+                data['hand_note'],
+                data['hand_span'],
+                data['note'],
+                data['pressed'],
+                data['keep_pressed']
+            )
+
+    def save_npy(self, file_path: str):
+        """
+        保存为结构化数组的.npy文件，每个手型状态是一条记录，可以用内存映射读取
+        """
+        finger_number = self.finger_number
+        data = np.empty(len(self), dtype=[
+            ('frame', np.float64),
+            ('is_left', bool),
+            ('hand_note', np.float64),
+            ('hand_span', np.int16),
+            ('note', np.int16, (finger_number,)),
+            ('pressed', bool, (finger_number,)),
+            ('keep_pressed', bool, (finger_number,))
+        ])
+        data['frame'] = self.frame
+        data['is_left'] = self.is_left
+        data['hand_note'] = self.hand_note
+        data['hand_span'] = self.hand_span
+        data['note'] = self.note
+        data['pressed'] = self.pressed
+        data['keep_pressed'] = self.keep_pressed
+        np.save(file_path, data)
+
+    def save_npz(self, file_path: str):
+        np.savez(file_path,
+                 frame=self.frame,
+                 is_left=self.is_left,
+                 hand_note=self.hand_note,
+                 hand_span=self.hand_span,
+                 note=self.note,
+                 pressed=self.pressed,
+                 keep_pressed=self.keep_pressed)
+
+    def select(self, mask: np.ndarray) -> 'HandTimeline':
+        """
+        按布尔掩码或下标取出部分状态，保持原有顺序
+        """
+        return HandTimeline(
+            self.frame[mask],
+            self.is_left[mask],
+            self.hand_note[mask],
+            self.hand_span[mask],
+            self.note[mask],
+            self.pressed[mask],
+            self.keep_pressed[mask]
+        )
+
+    def is_black(self, black_keys: set[int] = {1, 3, 6, 8, 10}) -> np.ndarray:
+        """
+        每个手指所按的键是否为黑键，形状为(N, finger_number)
+        """
+        return np.isin(self.note % 12, list(black_keys))
+
+    def state_signature(self, index: int) -> tuple:
+        """
+        第index个手型状态的签名：动画数据只取决于这些值，签名相同的两个状态（哪怕相隔很远）动画数据也相同
+        """
+        return (bool(self.is_left[index]),
+                float(self.hand_note[index]),
+                int(self.hand_span[index]),
+                self.note[index].tobytes(),
+                self.pressed[index].tobytes(),
+                self.keep_pressed[index].tobytes())
+
+    def thumb_slot(self, is_left: bool) -> int:
+        # 左手拇指是最后一个手指，右手拇指是第一个手指
+        return self.finger_number - 1 if is_left else 0
@@ -0,0 +1,195 @@
+import time
+import numpy as np
+from typing import Callable, Optional
+from src.midi.midiToNotes import NotesMap
+from src.recorder.recorder import Recorder
+from src.recorder.recorderPool import RecorderPool
+from src.hand.handDiffCache import HandDiffCache
+from src.hand.reachability import is_chord_reachable, repair_chord
+
+
+class OnlineFingering:
+    """
+    实时指法：和弦一个一个地送进来，每只手的手型在这只手又动了lookahead次之后确定下来，用于实时预览。
+
+    建立在固定延迟提交的RecorderPool上（commit_lag=lookahead）：每次push处理一个和弦，
+    记录池提交的历史（最优记录器每只手最后lookahead个手型之前的部分）在所有留下的记录器中已经一致，
+    这些手型和最后导出的.hand文件中的完全相同，就直接交给预览使用。
+    每个和弦最多让一只手动一次，所以一个手型至少要等lookahead个和弦才能交出去；一只手长时间不动时，它最后几个手型要等到它再动或者finish时才交出去。
+
+    延迟主要取决于参与展开的记录器数量和和弦的音符数量（音符越多，手指组合越多）。
+    这里按音符数量分别记录展开一个记录器的平均耗时，每个和弦处理之前先估算预算内能展开多少个记录器，
+    只保留熵值最小的这些记录器（RecorderPool.shrink），所以大和弦到来时宽度会立刻收窄，而不是超时之后才调整。
+
+    预算只是估算的目标，并不保证：World is Mine的前800个和弦、lookahead=2、预算5ms时，p99延迟为6.7ms，最大14ms，
+    有39个和弦超出预算；整首曲子（3584个和弦）p99为9.5ms，298个和弦超出预算（最小宽度下的展开本身就可能超过预算）。实际情况以print_stats的输出为准。
+    """
+
+    def __init__(self, initial_recorder: Recorder, hand_range: int, finger_range: float, finger_distribution: list[int], lookahead: int = 2, latency_budget: float = 0.005, min_pool_size: int = 1, max_pool_size: int = 50, spool_path: Optional[str] = None, hand_diff_cache: Optional[HandDiffCache] = None):
+        self.hand_range = hand_range
+        self.finger_range = finger_range
+        self.finger_distribution = finger_distribution
+        self.lookahead = max(1, lookahead)
+        # 每个和弦的延迟预算，单位为秒
+        self.latency_budget = latency_budget
+        self.min_pool_size = max(1, min_pool_size)
+        self.max_pool_size = max(self.min_pool_size, max_pool_size)
+        self.recorder_pool = RecorderPool(
+            [initial_recorder], self.min_pool_size, 0,
+            hand_diff_cache=hand_diff_cache if hand_diff_cache is not None else HandDiffCache(),
+            commit_lag=self.lookahead, spool_path=spool_path, collect_committed_states=True)
+        # 音符数量 -> 展开一个记录器的平均耗时（秒）
+        self._recorder_costs: dict[int, float] = {}
+        # 两只手按不下、被精简过的和弦数量
+        self.repaired_chords = 0
+        self.latencies: list[float] = []
+        self.pool_sizes: list[int] = []
+
+    def push(self, notes_map: NotesMap) -> list[dict]:
+        """
+        送入一个和弦
+
+        Returns:
+            list[dict]: 这次新确定下来的手型状态，格式和.hand文件中的状态相同
+        """
+        start_time = time.perf_counter()
+        if not is_chord_reachable(notes_map['notes'], self.hand_range, self.finger_range, self.finger_distribution):
+            # 实时输入没法预处理，按不下的和弦在这里精简，避免白白展开一遍再退回到repeat_self
+            notes_map = {
+                'notes': repair_chord(notes_map['notes'], self.hand_range, self.finger_range, self.finger_distribution),
+                'real_tick': notes_map['real_tick'],
+                'frame': notes_map['frame']
+            }
+            self.repaired_chords += 1
+        chord_size = len(notes_map['notes'])
+        recorder_pool = self.recorder_pool
+        recorder_pool.shrink(self._choose_pool_size(chord_size))
+        parent_count = len(recorder_pool.recorder_list)
+        recorder_pool.process_notes_maps(
+            [notes_map], self.hand_range, self.finger_range, self.finger_distribution)
+        expand_time = time.perf_counter() - start_time
+
+        committed_states = recorder_pool.pop_committed_states()
+        committed_states.sort(key=lambda hand_state: hand_state['frame'])
+
+        latency = time.perf_counter() - start_time
+        self.latencies.append(latency)
+        self.pool_sizes.append(recorder_pool.pool_size)
+        self._update_recorder_cost(
+            chord_size, expand_time / max(parent_count, 1))
+        return committed_states
+
+    def finish(self, file_path: Optional[str] = None) -> list[dict]:
+        """
+        输入结束，确定剩下的所有手型，然后关闭记录池（暂存文件在这之后不可用）
+
+        Args:
+            file_path: 可选，关闭之前把完整指法导出为.hand文件
+        """
+        recorder_pool = self.recorder_pool
+        committed_states = recorder_pool.pop_committed_states()
+        if recorder_pool.recorder_list:
+            # 剩下的部分以最优记录器为准，和导出时一样
+            best_recorder = min(recorder_pool.recorder_list,
+                                key=lambda r: r.current_entropy)
+            for hand_key, hands, frames in (('left_hand', best_recorder.left_hands, best_recorder.left_frames),
+                                            ('right_hand', best_recorder.right_hands, best_recorder.right_frames)):
+                for hand, frame in zip(hands, frames):
+                    committed_states.append({
+                        hand_key: hand.export_hand_info(),
+                        'frame': frame
+                    })
+        committed_states.sort(key=lambda hand_state: hand_state['frame'])
+        if file_path:
+            recorder_pool.export_pool_info(file_path, close=False)
+        recorder_pool.close()
+        return committed_states
+
+    def _choose_pool_size(self, chord_size: int) -> int:
+        """
+        按这个音符数量下展开一个记录器的平均耗时，估算预算内能展开的记录器数量。
+        没见过的音符数量先用最小宽度，测出耗时之后再放宽。
+        """
+        recorder_cost = self._recorder_costs.get(chord_size)
+        if recorder_cost is None:
+            return self.min_pool_size
+        # 留出两成余量给提交历史和偶尔的抖动
+        pool_size = int(self.latency_budget * 0.8 / max(recorder_cost, 1e-9))
+        return min(self.max_pool_size, max(self.min_pool_size, pool_size))
+
+    def _update_recorder_cost(self, chord_size: int, recorder_cost: float):
+        previous_cost = self._recorder_costs.get(chord_size)
+        if previous_cost is None:
+            self._recorder_costs[chord_size] = recorder_cost
+        elif recorder_cost > previous_cost:
+            # 变慢时立刻跟上，变快时慢慢放宽，宁可窄一点也不要超时
+            self._recorder_costs[chord_size] = recorder_cost
+        else:
+            self._recorder_costs[chord_size] = previous_cost * \
+                0.9 + recorder_cost * 0.1
+
+    def latency_percentiles(self, percentiles: tuple[float, ...] = (50, 90, 99)) -> dict[str, float]:
+        """
+        每个和弦处理延迟的百分位数，单位为毫秒
+        """
+        if not self.latencies:
+            return {}
+        values = np.percentile(np.array(self.latencies) * 1000, percentiles)
+        return {f'p{percentile:g}': float(value) for percentile, value in zip(percentiles, values)}
+
+    def export_stats(self) -> dict:
+        return {
+            'chords': len(self.latencies),
+            'latency_budget_ms': self.latency_budget * 1000,
+            'over_budget': sum(1 for latency in self.latencies if latency > self.latency_budget),
+            'latency_percentiles_ms': self.latency_percentiles(),
+            'max_latency_ms': max(self.latencies) * 1000 if self.latencies else 0.0,
+            'repaired_chords': self.repaired_chords,
+            'final_pool_size': self.recorder_pool.pool_size,
+            'mean_pool_size': float(np.mean(self.pool_sizes)) if self.pool_sizes else 0.0
+        }
+
+    def print_stats(self):
+        stats = self.export_stats()
+        percentiles = '，'.join(f'{name}={value:.2f}ms' for name,
+                               value in stats['latency_percentiles_ms'].items())
+        print(f"实时指法：{stats['chords']}个和弦，延迟{percentiles}，最大{stats['max_latency_ms']:.2f}ms，"
+              f"超出预算{stats['over_budget']}次，平均pool_size为{stats['mean_pool_size']:.1f}")
+
+    def export_pool_info(self, file_path: str):
+        """
+        导出当前的完整指法并关闭记录池，只能在finish之前调用；输入结束时可以直接用finish(file_path)
+        """
+        self.recorder_pool.export_pool_info(file_path)
+
+
+def replay_notes_maps(online_fingering: OnlineFingering, notes_maps: list[NotesMap], FPS: int = 60, speed: float = 1.0, realtime: bool = True, callback: Optional[Callable[[NotesMap, list[dict]], None]] = None, file_path: Optional[str] = None) -> list[dict]:
+    """
+    按原速度回放和弦序列，模拟实时的midi输入
+
+    Args:
+        FPS: notes_maps中frame使用的帧率，用来把frame换算成秒
+        speed: 回放速度的倍数
+        realtime: 为False时不等待，尽快送入所有和弦
+        callback: 每个和弦处理完之后调用，参数为和弦和这次确定下来的手型状态
+        file_path: 可选，结束时把完整指法导出为.hand文件
+
+    Returns:
+        list[dict]: 按确定顺序排列的所有手型状态
+    """
+    committed_states: list[dict] = []
+    start_time = time.perf_counter()
+    for notes_map in notes_maps:
+        if realtime:
+            wait_time = notes_map['frame'] / FPS / speed - \
+                (time.perf_counter() - start_time)
+            if wait_time > 0:
+                time.sleep(wait_time)
+
+        new_states = online_fingering.push(notes_map)
+        committed_states.extend(new_states)
+        if callback is not None:
+            callback(notes_map, new_states)
+
+    committed_states.extend(online_fingering.finish(file_path))
+    return committed_states
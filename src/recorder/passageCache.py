@@ -0,0 +1,89 @@
+from typing import Optional
+from src.hand.hand import Hand
+from src.midi.midiToNotes import NotesMap
+
+
+class CachedPassage:
+    """
+    一段已经解出来的片段：从某个起始手型出发，最优路径在这段里新增的左右手手型，以及这段的熵值增量。
+
+    手型的位置用片段内和弦的下标（0到passage_length-1）表示，复用时换成新位置上和弦的frame。
+    """
+
+    def __init__(self, left_steps: list[tuple[int, Hand]], right_steps: list[tuple[int, Hand]], entropy_delta: float):
+        self.left_steps = left_steps
+        self.right_steps = right_steps
+        self.entropy_delta = entropy_delta
+
+
+class PassageCache:
+    """
+    重复片段的缓存。
+
+    流行和古典音乐里经常原样重复整段（主歌、副歌、模进），每次重复都从头搜索很浪费。
+    这里把连续passage_length个和弦的音符和相对时间做成键，再加上片段开始时最优记录器的左右手签名：
+    如果之前从同样的手型出发解过同样的片段，就直接把当时的最优子路径和熵值增量接到当前最优记录器上，
+    跳过这一段的搜索。
+
+    记录池里其它手型签名相同的记录器也同样复用，签名不同的记录器在这一段上照常搜索，所以记录池的宽度不会因此收窄。
+    缓存的子路径只是当时从这个手型出发搜到的最优路径，复用它仍然可能比重新搜索差一点。
+    缓存的结果和hand_range、finger_range有关，它们也是键的一部分。
+    """
+
+    def __init__(self, passage_length: int = 8, max_size: int = 4096):
+        self.passage_length = max(1, passage_length)
+        self.max_size = max_size
+        self._cache: dict[tuple, CachedPassage] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.stored = 0
+        self.chords_skipped = 0
+
+    def make_key(self, notes_maps: list[NotesMap], hand_range: int, finger_range: float) -> tuple:
+        """
+        片段的键：每个和弦的音符，以及相对于片段第一个和弦的frame（取整）
+        """
+        first_frame = notes_maps[0]['frame']
+        return (hand_range, finger_range) + tuple(
+            (tuple(notes_map['notes']), round(notes_map['frame'] - first_frame))
+            for notes_map in notes_maps)
+
+    def lookup(self, key: tuple, start_signature: tuple) -> Optional[CachedPassage]:
+        self.lookups += 1
+        cached_passage = self._cache.get((key, start_signature))
+        if cached_passage is not None:
+            self.hits += 1
+            self.chords_skipped += self.passage_length
+        return cached_passage
+
+    def store(self, key: tuple, start_signature: tuple, cached_passage: CachedPassage):
+        if len(self._cache) >= self.max_size or (key, start_signature) in self._cache:
+            return
+        self._cache[(key, start_signature)] = cached_passage
+        self.stored += 1
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups > 0 else 0.0
+
+    def clear(self):
+        self._cache.clear()
+        self.lookups = 0
+        self.hits = 0
+        self.stored = 0
+        self.chords_skipped = 0
+
+    def export_stats(self) -> dict:
+        return {
+            'passage_length': self.passage_length,
+            'size': len(self._cache),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'stored': self.stored,
+            'chords_skipped': self.chords_skipped,
+            'hit_rate': self.hit_rate
+        }
+
+    def print_stats(self):
+        print(f'重复片段缓存：保存{self.stored}段，命中{self.hits}次，'
+              f'跳过{self.chords_skipped}个和弦，查询{self.lookups}次')
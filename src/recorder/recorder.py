@@ -1,14 +1,17 @@
 from src.hand.hand import Hand
 from src.hand.finger import Finger
+from src.hand.handDiffCache import HandDiffCache
 from src.midi.midiToNotes import NotesMap
 from src.piano.piano import Piano
+from src.recorder.searchProfiler import SearchProfiler
+from src.recorder.handFile import write_hand_states, HandTimeline, HandStateSpool
 from typing import Iterator, Optional
+import heapq
 import itertools
-import json
 
 
 class Recorder:
-    def __init__(self, piano: Piano, left_hands: list[Hand] = [], right_hands: list[Hand] = [], current_entropy: float = 0.0, frame: float = 0.0, left_frames: list[float] = [], right_frames: list[float] = []):
+    def __init__(self, piano: Piano, left_hands: list[Hand] = [], right_hands: list[Hand] = [], current_entropy: float = 0.0, frame: float = 0.0, left_frames: list[float] = [], right_frames: list[float] = [], hand_diff_cache: Optional[HandDiffCache] = None):
         self.piano: Piano = piano
         self.left_hands: list[Hand] = left_hands
         self.left_frames: list[float] = left_frames
@@ -16,26 +19,88 @@ class Recorder:
         self.right_frames: list[float] = right_frames
         self.current_entropy: float = current_entropy
         self.frame = frame
+        # 可选的手型差异缓存，会传递给所有后代记录器
+        self.hand_diff_cache: Optional[HandDiffCache] = hand_diff_cache
 
-    def next_generation_recorders_generator(self, notes_map: NotesMap, hand_range: int, finger_range: float, finger_distribution: list[int]) -> Iterator['Recorder']:
+    def next_generation_recorders_generator(self, notes_map: NotesMap, hand_range: int, finger_range: float, finger_distribution: list[int], profiler: Optional[SearchProfiler] = None) -> Iterator['Recorder']:
         notes = notes_map['notes']
         frame = notes_map['frame']
-        note_amount = len(notes)
-        finger_indices = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
 
-        # 生成所有可能的组合
-        # 从10个手指中选择len(notes)个手指来按这些音符，且手指按顺序排列
-        for finger_combination in itertools.combinations(finger_indices, note_amount):
+        # 从10个手指中选择len(notes)个手指来按这些音符，且手指按顺序排列，不合法的前缀在生成时就已经剪掉
+        for finger_combination in self.finger_combinations_generator(notes, hand_range, finger_range, finger_distribution, profiler):
             # 直接将有序的音符与有序的手指组合配对
             note_finger_mapping = dict(zip(notes, finger_combination))
+            if profiler is not None:
+                profiler.current.combinations += 1  # type: ignore
 
             # 根据映射创建新的Recorder实例
             new_recorder = self._create_new_recorder(
-                note_finger_mapping, hand_range, finger_range, finger_distribution, frame)
+                note_finger_mapping, hand_range, finger_range, finger_distribution, frame, profiler)
             if new_recorder is not None:
                 yield new_recorder
 
-    def _create_new_recorder(self, note_finger_mapping: dict[int, int], hand_range: int, finger_range: float, finger_distribution: list[int], frame: float) -> Optional['Recorder']:
+    @staticmethod
+    def finger_combinations_generator(notes: list[int], hand_range: int, finger_range: float, finger_distribution: list[int], profiler: Optional[SearchProfiler] = None) -> Iterator[tuple[int, ...]]:
+        """
+        按顺序给每个音符分配手指，生成和itertools.combinations(range(10), len(notes))中
+        能通过_create_new_recorder检查的组合完全相同的结果，顺序也相同。
+
+        音符从低到高排列，手指编号递增，所以左手按的是音符的前缀，右手按的是后缀。
+        一个前缀一旦违反了音域跨度（hand_range）或相邻手指跨度（finger_distribution × finger_range），
+        后面再怎么分配都不可能合法，整棵子树直接跳过：
+        - 同一只手的音域跨度只会越来越大，所以左手超出时直接换到右手，右手超出时结束这一层；
+        - 相邻手指跨度只取决于这一对音符和手指，所以只跳过当前手指。
+
+        Args:
+            notes: 从低到高排列、不重复的音符
+        """
+        note_amount = len(notes)
+        finger_number = len(finger_distribution)
+        total_finger_number = 2 * finger_number
+        if note_amount == 0 or note_amount > total_finger_number:
+            return
+
+        combination = [0] * note_amount
+
+        def assign(note_position: int, first_finger: int, hand_lowest_note: int, prev_note: int, prev_finger: int) -> Iterator[tuple[int, ...]]:
+            note = notes[note_position]
+            # 给后面的音符留够手指
+            last_finger = total_finger_number - (note_amount - note_position)
+            finger_index = first_finger
+            while finger_index <= last_finger:
+                is_left = finger_index < finger_number
+                same_hand = prev_finger >= 0 and (
+                    prev_finger < finger_number) == is_left
+
+                if same_hand:
+                    if note - hand_lowest_note > hand_range:
+                        if profiler is not None:
+                            profiler.current.rejected_by_span += 1  # type: ignore
+                        if is_left:
+                            finger_index = finger_number
+                            continue
+                        return
+
+                    offset = 0 if is_left else finger_number
+                    finger_diff = finger_distribution[finger_index - offset] - \
+                        finger_distribution[prev_finger - offset]
+                    if note - prev_note > finger_range * abs(finger_diff):
+                        if profiler is not None:
+                            profiler.current.rejected_by_finger_distance += 1  # type: ignore
+                        finger_index += 1
+                        continue
+
+                combination[note_position] = finger_index
+                if note_position == note_amount - 1:
+                    yield tuple(combination)
+                else:
+                    yield from assign(note_position + 1, finger_index + 1,
+                                      hand_lowest_note if same_hand else note, note, finger_index)
+                finger_index += 1
+
+        yield from assign(0, 0, notes[0], notes[0], -1)
+
+    def _create_new_recorder(self, note_finger_mapping: dict[int, int], hand_range: int, finger_range: float, finger_distribution: list[int], frame: float, profiler: Optional[SearchProfiler] = None) -> Optional['Recorder']:
         # 存储左手的音符 [(note, finger_index), ...]
         left_hand_notes: list[tuple[int, int]] = []
         # 存储右手的音符 [(note, finger_index), ...]
@@ -66,6 +131,8 @@ class Recorder:
 
                 # 检查音域跨度
                 if left_highest_note - left_lowest_note > hand_range:
+                    if profiler is not None:
+                        profiler.current.rejected_by_span += 1  # type: ignore
                     return None
 
             else:
@@ -83,6 +150,8 @@ class Recorder:
 
                 # 检查音域跨度
                 if right_highest_note - right_lowest_note > hand_range:
+                    if profiler is not None:
+                        profiler.current.rejected_by_span += 1  # type: ignore
                     return None
 
         # 检查手指跨度限制（仅在有多个音符时检查）
@@ -94,6 +163,8 @@ class Recorder:
                 finger_diff = abs(
                     finger_distribution[finger_index] - finger_distribution[prev_finger_index])
                 if note_diff > finger_range * finger_diff:
+                    if profiler is not None:
+                        profiler.current.rejected_by_finger_distance += 1  # type: ignore
                     return None
 
         if len(right_hand_notes) > 1:
@@ -104,6 +175,8 @@ class Recorder:
                 finger_diff = abs(
                     finger_distribution[finger_index-5] - finger_distribution[prev_finger_index-5])
                 if note_diff > finger_range * finger_diff:
+                    if profiler is not None:
+                        profiler.current.rejected_by_finger_distance += 1  # type: ignore
                     return None
 
         # 到这一步时，不适合的指法已经被淘汰，需要用当前指法生成新的左右手并且计算它们的熵
@@ -119,8 +192,8 @@ class Recorder:
         if left_fingers:
             new_left_hand = lasted_left_hand.generate_next_hand(
                 left_fingers, finger_range, finger_distribution)
-            left_hand_diff = lasted_left_hand.calculate_hand_diff(
-                new_left_hand)
+            left_hand_diff = self._calculate_hand_diff(
+                lasted_left_hand, new_left_hand)
             # 生成新的左手序列
 
             new_left_hands.append(new_left_hand)
@@ -139,8 +212,8 @@ class Recorder:
         if right_fingers:
             new_right_hand = lasted_right_hand.generate_next_hand(
                 right_fingers, finger_range, finger_distribution)
-            right_hand_diff = lasted_right_hand.calculate_hand_diff(
-                new_right_hand)
+            right_hand_diff = self._calculate_hand_diff(
+                lasted_right_hand, new_right_hand)
             # 生成新的右手序列
             new_right_hands.append(new_right_hand)
             new_right_frames.append(frame)
@@ -149,159 +222,181 @@ class Recorder:
             left_hand_diff + right_hand_diff
 
         new_recorder = Recorder(
-            self.piano, new_left_hands, new_right_hands, new_entropy, frame, new_left_frames, new_right_frames)
+            self.piano, new_left_hands, new_right_hands, new_entropy, frame, new_left_frames, new_right_frames, self.hand_diff_cache)
 
         return new_recorder
 
-    def export_recorders(self, file_path: str):
+    def _calculate_hand_diff(self, current_hand: Hand, next_hand: Hand) -> float:
+        if self.hand_diff_cache is None:
+            return current_hand.calculate_hand_diff(next_hand)
+        return self.hand_diff_cache.get_hand_diff(current_hand, next_hand)
+
+    def export_recorders(self, file_path: str, spool: Optional[HandStateSpool] = None):
         if len(self.left_hands) != len(self.left_frames) or len(self.right_hands) != len(self.right_frames):
             print(
                 f'Error: 左手一共{len(self.left_hands)}个，左手frames一共{len(self.left_frames)}个，右手一共{len(self.right_hands)}个，右手frames一共{len(self.right_frames)}个')
             raise Exception('数量不一致')
 
-        result = []
-        left_hands_info = [hand.export_hand_info()
-                           for hand in self.left_hands]  # type: ignore
-        right_hands_info = [hand.export_hand_info()
-                            for hand in self.right_hands]
-
-        left_hand_data = []
-        right_hand_data = []
-
-        for i in range(len(self.left_hands)):
-            left_hand_data.append({
-                'left_hand': left_hands_info[i],
-                'frame': self.left_frames[i]
-            })
-
-        for j in range(len(self.right_hands)):
-            right_hand_data.append({
-                'right_hand': right_hands_info[j],
-                'frame': self.right_frames[j]
-            })
-
-        left_hand_data, right_hand_data = self.detect_and_resolve_hand_conflicts(
-            left_hand_data, right_hand_data)
-
-        result = left_hand_data + right_hand_data
+        if file_path.endswith('.npy') or file_path.endswith('.npz'):
+            # 列式二进制格式
+            hand_timeline = HandTimeline.from_hand_states(
+                self.iter_hand_states(spool), self.left_hands[0].finger_number)
+            if file_path.endswith('.npy'):
+                hand_timeline.save_npy(file_path)
+            else:
+                hand_timeline.save_npz(file_path)
+            amount = len(hand_timeline)
+        else:
+            amount = write_hand_states(
+                file_path, self.iter_hand_states(spool))
+        print(f'一共导出{amount}个手型状态')
+
+    def iter_hand_states(self, spool: Optional[HandStateSpool] = None) -> Iterator[dict]:
+        """
+        沿着当前记录器的路径逐个生成要写入.hand文件的手型状态，左右手冲突已经处理好，先输出全部左手状态，再输出全部右手状态。
 
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=4)
+        冲突检测只需要frame和拇指音符，所以先从Hand对象里取出这两样算出冲突状态，
+        再把原路径和冲突状态按frame归并，每个手型在输出前才导出成字典，不需要在内存里保留整首曲子的字典。
 
-    def detect_and_resolve_hand_conflicts(self, left_hand_data, right_hand_data):
+        Args:
+            spool: 搜索过程中已经提交的状态，位于当前记录器路径之前
         """
-        检测并解决左右手之间的按键冲突，这种冲突是由于某个手正在保持按键，而另一只手移动过来按当前手的区间的音符所导致的冲突。
+        left_frames = self.left_frames
+        right_frames = self.right_frames
+        left_thumb_notes = [hand.fingers[4].key_note.note
+                            for hand in self.left_hands]
+        right_thumb_notes = [hand.fingers[0].key_note.note
+                             for hand in self.right_hands]
+        if spool is not None:
+            left_frames = spool.left_frames + left_frames
+            right_frames = spool.right_frames + right_frames
+            left_thumb_notes = spool.left_thumb_notes + left_thumb_notes
+            right_thumb_notes = spool.right_thumb_notes + right_thumb_notes
+
+        left_conflicts = self._find_hand_conflicts(
+            left_frames, left_thumb_notes, right_frames, right_thumb_notes, True)
+        right_conflicts = self._find_hand_conflicts(
+            right_frames, right_thumb_notes, left_frames, left_thumb_notes, False)
+
+        conflicts_amount = len(left_conflicts) + len(right_conflicts)
+        print({
+            "left_hand_frames": len(left_frames),
+            "right_hand_frames": len(right_frames),
+            "conflicts_found": conflicts_amount,
+            "conflicts_resolved": conflicts_amount
+        })
+
+        exported_hands: dict[tuple[bool, int], dict] = {}
+        left_conflict_states = self._generate_conflict_states(
+            left_conflicts, True, exported_hands)
+        right_conflict_states = self._generate_conflict_states(
+            right_conflicts, False, exported_hands)
+
+        # heapq.merge是稳定的，frame相同时原路径的状态排在冲突状态前面，和之前sorted的结果一致
+        left_path_states = self._iter_path_states(True)
+        right_path_states = self._iter_path_states(False)
+        if spool is not None:
+            left_path_states = itertools.chain(
+                spool.iter_hand_states(True), left_path_states)
+            right_path_states = itertools.chain(
+                spool.iter_hand_states(False), right_path_states)
+
+        yield from heapq.merge(left_path_states, left_conflict_states,
+                               key=lambda x: x["frame"])
+        yield from heapq.merge(right_path_states, right_conflict_states,
+                               key=lambda x: x["frame"])
+
+    def _iter_path_states(self, is_left: bool) -> Iterator[dict]:
+        hands = self.left_hands if is_left else self.right_hands
+        frames = self.left_frames if is_left else self.right_frames
+        hand_key = 'left_hand' if is_left else 'right_hand'
+        for hand, frame in zip(hands, frames):
+            yield {
+                hand_key: hand.export_hand_info(),
+                'frame': frame
+            }
+
+    def _find_hand_conflicts(self, frames: list[float], thumb_notes: list[int], other_frames: list[float], other_thumb_notes: list[int], is_left: bool) -> list[tuple[int, list[float]]]:
+        """
+        对当前手的每个时间区间[frames[i], frames[i+1]]，找出另一只手在该区间内越过当前手拇指的状态。
+
+        两个frame序列都是非递减的，所以区间在另一只手序列中的起止下标也是单调的，用两个指针一路向后推进即可。
 
         Args:
-            left_hand_data: 左手数据
-            right_hand_data：右手数据
+            frames: 当前手每个状态的frame
+            thumb_notes: 当前手每个状态的拇指音符
+            other_frames: 另一只手每个状态的frame
+            other_thumb_notes: 另一只手每个状态的拇指音符
+            is_left: 当前手是否为左手
 
         Returns:
-            返回处理后的左右手数据
+            list: 每个发生冲突的区间对应的(新的拇指音符, 冲突frame列表)
         """
-
-        # 处理报告
-        report = {
-            "left_hand_frames": len(left_hand_data),
-            "right_hand_frames": len(right_hand_data),
-            "conflicts_found": 0,
-            "conflicts_resolved": 0
-        }
-
-        # 遍历左手数据，检测冲突
-        new_left_state_for_conflicts = []
-        for i in range(len(left_hand_data) - 1):
-            left_current = left_hand_data[i]
-            left_next = left_hand_data[i + 1]
-
-            # 获取当前左手拇指的note值
-            left_thumb_note = left_current["left_hand"]["fingers"][4]["key_note"]["note"]
-
-            # 确定时间区间
-            frame_start = left_current["frame"]
-            frame_end = left_next["frame"]
-
-            new_left_thumb_note = 108
-            has_conflict = False
+        conflicts = []
+        other_amount = len(other_frames)
+        start_index = 0
+        end_index = 0
+
+        for i in range(len(frames) - 1):
+            frame_start = frames[i]
+            frame_end = frames[i + 1]
+            thumb_note = thumb_notes[i]
+
+            # 区间内另一只手的状态下标范围是[start_index, end_index)
+            while start_index < other_amount and other_frames[start_index] < frame_start:
+                start_index += 1
+            if end_index < start_index:
+                end_index = start_index
+            while end_index < other_amount and other_frames[end_index] <= frame_end:
+                end_index += 1
+
+            new_thumb_note = 108 if is_left else 21
             conflict_frames = []
 
-            # 在该时间区间内检查右手数据
-            for right_item in right_hand_data:
-                if frame_start <= right_item["frame"] <= frame_end:
-                    # 检查右手拇指的note值
-                    right_thumb_note = right_item.get("right_hand").get(
-                        "fingers")[0]["key_note"]["note"]
-
-                    # 检查是否有冲突（右手拇指note小于左手拇指note）
-                    if right_thumb_note < left_thumb_note:
-                        if new_left_thumb_note > right_thumb_note:
-                            new_left_thumb_note = right_thumb_note-1
-                            has_conflict = True
-                            conflict_frames.append(right_item["frame"])
-
-            if has_conflict:
-                report["conflicts_found"] += 1
-                new_left_thumb = Finger(4, self.piano.note_to_key(
-                    new_left_thumb_note), True, False, False)
-                new_hand = Hand([new_left_thumb], self.piano, True)
-                for conflict_frame in conflict_frames:
-                    new_left_state = {
-                        "left_hand": new_hand.export_hand_info(),
-                        "frame": conflict_frame
-                    }
-                    new_left_state_for_conflicts.append(new_left_state)
-                report["conflicts_resolved"] += 1
-
-        # 遍历右手数据，检测冲突
-        new_right_state_for_conflicts = []
-        for i in range(len(right_hand_data) - 1):
-            right_current = right_hand_data[i]
-            right_next = right_hand_data[i + 1]
-
-            # 获取当前右手拇指的note值
-            right_thumb_note = right_current.get("right_hand", {}).get(
-                "fingers", [{}]*5)[0]["key_note"]["note"]
-
-            # 确定时间区间
-            frame_start = right_current["frame"]
-            frame_end = right_next["frame"]
-
-            new_right_thumb_note = 21
-            has_conflict = False
-            conflict_frames = []
+            for j in range(start_index, end_index):
+                other_thumb_note = other_thumb_notes[j]
+                if is_left:
+                    # 右手拇指note小于左手拇指note就是冲突，左手拇指要让到右手拇指的左边
+                    if other_thumb_note < thumb_note and new_thumb_note > other_thumb_note:
+                        new_thumb_note = other_thumb_note - 1
+                        conflict_frames.append(other_frames[j])
+                else:
+                    # 左手拇指note大于右手拇指note就是冲突，右手拇指要让到左手拇指的右边
+                    if thumb_note < other_thumb_note and new_thumb_note < other_thumb_note:
+                        new_thumb_note = other_thumb_note + 1
+                        conflict_frames.append(other_frames[j])
+
+            if conflict_frames:
+                conflicts.append((new_thumb_note, conflict_frames))
 
-            # 在该时间区间内检查左手数据
-            for left_item in left_hand_data:
-                if frame_start <= left_item["frame"] <= frame_end:
-                    # 检查左手拇指的note值
-                    left_thumb_note = left_item.get(
-                        "left_hand").get(
-                        "fingers")[4]["key_note"]["note"]
-
-                    # 检查是否有冲突（右手拇指note小于左手拇指note）
-                    if right_thumb_note < left_thumb_note:
-                        if new_right_thumb_note < left_thumb_note:
-                            new_right_thumb_note = left_thumb_note+1
-                            has_conflict = True
-                            conflict_frames.append(left_item["frame"])
-
-            if has_conflict:
-                report["conflicts_found"] += 1
-                new_right_thumb = Finger(5, self.piano.note_to_key(
-                    new_right_thumb_note), False, False, False)
-                new_hand = Hand([new_right_thumb], self.piano, False)
-                for conflict_frame in conflict_frames:
-                    new_right_state = {
-                        "right_hand": new_hand.export_hand_info(),
-                        "frame": conflict_frame
-                    }
-                    new_right_state_for_conflicts.append(new_right_state)
-                report["conflicts_resolved"] += 1
-
-        left_hand_data = sorted(
-            left_hand_data + new_left_state_for_conflicts, key=lambda x: x["frame"])
-        right_hand_data = sorted(
-            right_hand_data+new_right_state_for_conflicts, key=lambda x: x["frame"])
-        print(report)
-
-        return left_hand_data, right_hand_data
+        return conflicts
+
+    def _generate_conflict_states(self, conflicts: list[tuple[int, list[float]]], is_left: bool, exported_hands: dict[tuple[bool, int], dict]) -> list[dict]:
+        """
+        把_find_hand_conflicts的结果转换成按frame排序的手型状态
+        """
+        hand_key = 'left_hand' if is_left else 'right_hand'
+        conflict_states = []
+        for thumb_note, conflict_frames in conflicts:
+            hand_info = self._export_conflict_hand(
+                thumb_note, is_left, exported_hands)
+            for conflict_frame in conflict_frames:
+                conflict_states.append({
+                    hand_key: hand_info,
+                    "frame": conflict_frame
+                })
+        conflict_states.sort(key=lambda x: x["frame"])
+        return conflict_states
+
+    def _export_conflict_hand(self, thumb_note: int, is_left: bool, exported_hands: dict[tuple[bool, int], dict]) -> dict:
+        """
+        生成只有拇指位置确定、所有手指都不按键的手型，用于让出另一只手正在使用的区域
+        """
+        key = (is_left, thumb_note)
+        if key not in exported_hands:
+            thumb_index = 4 if is_left else 5
+            thumb = Finger(thumb_index, self.piano.note_to_key(
+                thumb_note), is_left, False, False)
+            exported_hands[key] = Hand(
+                [thumb], self.piano, is_left).export_hand_info()
+        return exported_hands[key]
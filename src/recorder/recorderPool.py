@@ -1,16 +1,72 @@
 import heapq
+import itertools
+import os
+import tempfile
+import time
+from typing import Iterable, Optional
 from src.recorder.recorder import Recorder
+from src.recorder.searchProfiler import SearchProfiler
 from src.midi.midiToNotes import NotesMap
 from src.hand.hand import Hand
+from src.hand.finger import Finger
+from src.hand.handDiffCache import HandDiffCache
+from src.recorder.passageCache import PassageCache, CachedPassage
+from src.recorder.warmStart import WarmStart
+from src.recorder.handFile import HandStateSpool
 
 # 定义堆中元素的类型
 HeapElement = tuple[float, int, Recorder]
 
 
+class _MonophonicState:
+    """
+    单音快速路径中的轻量状态：只记录两只手的当前手型、本步新增的手型和指向上一步的指针，
+    不复制整条手型历史，到一段单音结束时再还原成Recorder。
+    """
+    __slots__ = ('entropy', 'left_hand', 'right_hand',
+                 'parent', 'recorder', 'moved_is_left', 'frame')
+
+    def __init__(self, entropy: float, left_hand: Hand, right_hand: Hand, parent: Optional['_MonophonicState'] = None, recorder: Optional[Recorder] = None, moved_is_left: bool = True, frame: float = 0.0):
+        self.entropy = entropy
+        self.left_hand = left_hand
+        self.right_hand = right_hand
+        # 上一步的状态，只有起点状态为None
+        self.parent = parent
+        # 起点状态对应的记录器
+        self.recorder = recorder
+        self.moved_is_left = moved_is_left
+        self.frame = frame
+
+
 class RecorderPool():
-    def __init__(self, recorders: list[Recorder], pool_size: int, max_entropy: int):
+    def __init__(self, recorders: list[Recorder], pool_size: int, max_entropy: int, profiler: Optional[SearchProfiler] = None, hand_diff_cache: Optional[HandDiffCache] = None, passage_cache: Optional[PassageCache] = None, warm_start: Optional[WarmStart] = None, commit_lag: Optional[int] = None, spool_path: Optional[str] = None, collect_committed_states: bool = False):
         self.pool_size = pool_size
         self.max_entropy = max_entropy
+        # 可选的搜索统计工具，为None时不做任何统计
+        self.profiler = profiler
+        self.hand_diff_cache = hand_diff_cache
+        # 可选的重复片段缓存，只在process_notes_maps中使用
+        self.passage_cache = passage_cache
+        # 可选的热启动，提供始终留在池中的引导记录器和熵值上界
+        self.warm_start = warm_start
+        # 固定延迟提交：每处理完一个和弦，最优记录器每只手最后commit_lag个手型之前的历史就确定下来，写入暂存文件并从内存中释放
+        self.commit_lag = commit_lag
+        if commit_lag is not None and passage_cache is not None:
+            # 提交会截掉记录器的历史，正在记录的片段没法再和开始时的记录器对上，重复片段缓存永远存不进也命中不了
+            raise ValueError('commit_lag和passage_cache不能同时使用')
+        self.spool: Optional[HandStateSpool] = None
+        self.closed = False
+        if commit_lag is not None:
+            # 没有指定路径时使用临时文件，close时删掉
+            delete_on_close = not spool_path
+            if not spool_path:
+                spool_path = os.path.join(
+                    tempfile.gettempdir(), f'recorder_pool_{os.getpid()}_{id(self)}')
+            self.spool = HandStateSpool(spool_path, delete_on_close)
+        self.commit_count = 0
+        self.pruned_by_commit = 0
+        # collect_committed_states为True时，提交的手型状态除了写入暂存文件，也留一份在这里，由pop_committed_states取走
+        self.committed_states: Optional[list[dict]] = [] if collect_committed_states else None
         # 堆用于快速查找最大熵值记录器
         self.recorder_heap: list[HeapElement] = []
         # 列表维护插入顺序
@@ -18,6 +74,9 @@ class RecorderPool():
 
         # 初始化
         for recorder in recorders:
+            # 传入的手型差异缓存会通过记录器一代代传下去
+            if hand_diff_cache is not None:
+                recorder.hand_diff_cache = hand_diff_cache
             self._add_recorder(recorder)
 
     def _add_recorder(self, recorder: Recorder):
@@ -37,11 +96,23 @@ class RecorderPool():
         new_recorder_heap = []
         current_notes = notes_map['notes']
         current_frame: float = notes_map['frame']
+        profiler = self.profiler
+        profile = profiler.begin_chord(
+            notes_map) if profiler is not None else None
+        warm_start = self.warm_start
+        entropy_limit = warm_start.entropy_limit(
+            current_frame) if warm_start is not None else float('inf')
 
         for recorder in self.recorder_list:
-            for next_generation_recorder in recorder.next_generation_recorders_generator(notes_map, hand_range, finger_range, finger_distribution):
+            for next_generation_recorder in recorder.next_generation_recorders_generator(notes_map, hand_range, finger_range, finger_distribution, profiler):
+                # 累计熵值加上剩余部分的下界已经超过热启动的上界，不可能比引导路径更好
+                if next_generation_recorder.current_entropy > entropy_limit:
+                    warm_start.pruned_by_bound += 1  # type: ignore
+                    continue
                 # 检查是否应该添加新记录器
                 if len(new_recorder_heap) < self.pool_size:
+                    if profile is not None:
+                        profile.pushed_to_heap += 1
                     # 如果池未满，直接添加
                     new_recorder_list.append(next_generation_recorder)
                     heapq.heappush(new_recorder_heap,
@@ -49,6 +120,8 @@ class RecorderPool():
                                     id(next_generation_recorder),
                                     next_generation_recorder))
                 elif next_generation_recorder.current_entropy < -new_recorder_heap[0][0]:
+                    if profile is not None:
+                        profile.heap_replacements += 1
                     # 如果池已满且新记录器熵值小于当前最大熵，则替换
                     heapq.heapreplace(new_recorder_heap,
                                       (-next_generation_recorder.current_entropy,
@@ -57,12 +130,23 @@ class RecorderPool():
                     # 注意：这里需要同步更新列表，但因为列表无序，直接清空重建更简单
                     new_recorder_list = []  # 重建列表
 
+        guide_recorder = self._advance_warm_start(
+            notes_map, hand_range, finger_range, finger_distribution)
+        if guide_recorder is not None:
+            self._push_guide_recorder(new_recorder_heap, guide_recorder)
+            new_recorder_list = []
+
         # 如果没有生成任何新的记录器，则保持原状态并输出信息
         if not new_recorder_heap:
             print(
                 f"警告：没能生成新的记录器，当前frame为：{current_frame},当前音符为：{current_notes}")
             print("只保留原最佳记录，并且更新frame")
             self.repeat_self(current_frame)
+            if profiler is not None and profile is not None:
+                profile.repeated = True
+                profiler.end_chord(
+                    [recorder.current_entropy for recorder in self.recorder_list])
+            self._commit_fixed_lag()
             return
 
         # 重建列表以匹配堆中的元素
@@ -77,6 +161,432 @@ class RecorderPool():
         if new_recorder_heap:
             self.max_entropy = -new_recorder_heap[0][0]
 
+        if profiler is not None:
+            profiler.end_chord(
+                [recorder.current_entropy for recorder in new_recorder_list])
+
+        self._commit_fixed_lag()
+
+    def process_notes_maps(self, notes_maps: Iterable[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int], deadline: Optional[float] = None) -> bool:
+        """
+        依次处理所有和弦。连续的单音和弦会攒成一段，交给_update_monophonic_run一次性处理，其它和弦仍然走update_recorder_pool。
+        设置了passage_cache时，遇到之前解过的重复片段会直接复用结果。
+
+        Args:
+            notes_maps: 和弦序列，可以是生成器或tqdm包装后的迭代器
+            deadline: 可选的截止时间（time.perf_counter()的值），超过后停止处理
+
+        Returns:
+            bool: 是否处理完了全部和弦
+        """
+        if self.passage_cache is not None:
+            return self._process_notes_maps_with_passage_cache(
+                list(notes_maps), hand_range, finger_range, finger_distribution, deadline)
+
+        monophonic_run: list[NotesMap] = []
+
+        for notes_map in notes_maps:
+            if len(notes_map['notes']) == 1:
+                monophonic_run.append(notes_map)
+                continue
+
+            if monophonic_run:
+                if not self._update_monophonic_run(
+                        monophonic_run, hand_range, finger_range, finger_distribution, deadline):
+                    return False
+                monophonic_run = []
+            self.update_recorder_pool(
+                notes_map, hand_range, finger_range, finger_distribution)
+
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+
+        if monophonic_run and not self._update_monophonic_run(
+                monophonic_run, hand_range, finger_range, finger_distribution, deadline):
+            return False
+
+        return deadline is None or time.perf_counter() <= deadline
+
+    def _process_notes_maps_with_passage_cache(self, notes_maps: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int], deadline: Optional[float] = None) -> bool:
+        """
+        逐个和弦处理，每个位置都先查一下从这里开始的片段是否解过：
+        - 命中时把缓存的子路径接到当前最优记录器上，跳过整个片段；
+        - 没命中时正常搜索，同时记下片段开始时的最优记录器，片段结束时如果最优记录器是从它发展来的，就把这段子路径存进缓存。
+        """
+        passage_cache: PassageCache = self.passage_cache  # type: ignore
+        passage_length = passage_cache.passage_length
+        # 正在记录的片段：(开始位置, 键, 开始时的最优记录器, 开始时的手型签名)
+        pending: Optional[tuple[int, tuple, Recorder, tuple]] = None
+        index = 0
+
+        while index < len(notes_maps):
+            if pending is not None and index == pending[0] + passage_length:
+                self._store_passage(
+                    pending, notes_maps[pending[0]:index])
+                pending = None
+
+            if index + passage_length <= len(notes_maps) and self.recorder_list:
+                window = notes_maps[index:index + passage_length]
+                key = passage_cache.make_key(
+                    window, hand_range, finger_range)
+                start_recorder = min(self.recorder_list,
+                                     key=lambda r: r.current_entropy)
+                start_signature = (start_recorder.left_hands[-1].get_signature(),
+                                   start_recorder.right_hands[-1].get_signature())
+
+                cached_passage = passage_cache.lookup(key, start_signature)
+                if cached_passage is not None:
+                    self._apply_cached_passage(
+                        start_signature, cached_passage, window, hand_range, finger_range, finger_distribution)
+                    pending = None
+                    index += passage_length
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return False
+                    continue
+
+                if pending is None:
+                    pending = (index, key, start_recorder, start_signature)
+
+            notes_map = notes_maps[index]
+            if len(notes_map['notes']) == 1:
+                self._update_monophonic_run(
+                    [notes_map], hand_range, finger_range, finger_distribution)
+            else:
+                self.update_recorder_pool(
+                    notes_map, hand_range, finger_range, finger_distribution)
+            index += 1
+
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+
+        if pending is not None and len(notes_maps) == pending[0] + passage_length:
+            self._store_passage(pending, notes_maps[pending[0]:])
+
+        return True
+
+    def _store_passage(self, pending: tuple[int, tuple, Recorder, tuple], window: list[NotesMap]):
+        """
+        片段结束时，如果当前最优记录器是从片段开始时的最优记录器发展来的，就把这段新增的手型存进缓存
+        """
+        if not self.recorder_list:
+            return
+        _, key, start_recorder, start_signature = pending
+        end_recorder = min(self.recorder_list,
+                           key=lambda r: r.current_entropy)
+        left_start = len(start_recorder.left_hands)
+        right_start = len(start_recorder.right_hands)
+
+        # 手型列表是逐代复制的，同一个位置上是同一个Hand对象就说明是同一条路径
+        if len(end_recorder.left_hands) < left_start or len(end_recorder.right_hands) < right_start:
+            return
+        if end_recorder.left_hands[left_start - 1] is not start_recorder.left_hands[-1] or \
+                end_recorder.right_hands[right_start - 1] is not start_recorder.right_hands[-1]:
+            return
+
+        left_steps = self._locate_passage_steps(
+            end_recorder.left_hands[left_start:], end_recorder.left_frames[left_start:], window)
+        right_steps = self._locate_passage_steps(
+            end_recorder.right_hands[right_start:], end_recorder.right_frames[right_start:], window)
+        if left_steps is None or right_steps is None:
+            return
+
+        self.passage_cache.store(key, start_signature, CachedPassage(  # type: ignore
+            left_steps, right_steps, end_recorder.current_entropy - start_recorder.current_entropy))
+
+    def _locate_passage_steps(self, hands: list[Hand], frames: list[float], window: list[NotesMap]) -> Optional[list[tuple[int, Hand]]]:
+        """
+        把新增手型的frame换成片段内和弦的下标，找不到对应和弦时返回None
+        """
+        steps: list[tuple[int, Hand]] = []
+        position = 0
+        for hand, frame in zip(hands, frames):
+            while position < len(window) and window[position]['frame'] != frame:
+                position += 1
+            if position == len(window):
+                return None
+            steps.append((position, hand))
+            position += 1
+        return steps
+
+    def _apply_cached_passage(self, start_signature: tuple, cached_passage: CachedPassage, window: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int]):
+        """
+        复用缓存的片段：
+        - 最后的左右手签名和start_signature相同的记录器，直接接上缓存的子路径和熵值增量；
+        - 其它记录器从不同的手型出发，缓存对它们不适用，在这个片段上正常搜索。
+
+        最后两部分合在一起，保留熵值最小的pool_size个记录器，热启动的引导记录器始终保留。
+        """
+        matched_recorders: list[Recorder] = []
+        other_recorders: list[Recorder] = []
+        for recorder in self.recorder_list:
+            signature = (recorder.left_hands[-1].get_signature(),
+                         recorder.right_hands[-1].get_signature())
+            if signature == start_signature:
+                matched_recorders.append(
+                    self._extend_with_cached_passage(recorder, cached_passage, window))
+            else:
+                other_recorders.append(recorder)
+
+        if other_recorders:
+            self.recorder_list = other_recorders
+            self.recorder_heap = [(-recorder.current_entropy, id(recorder), recorder)
+                                  for recorder in other_recorders]
+            heapq.heapify(self.recorder_heap)
+            self._search_window(
+                window, hand_range, finger_range, finger_distribution)
+            candidates = matched_recorders + self.recorder_list
+        else:
+            candidates = matched_recorders
+            for notes_map in window:
+                self._advance_warm_start(
+                    notes_map, hand_range, finger_range, finger_distribution)
+
+        guide_recorder = self.warm_start.guide_recorder if self.warm_start is not None else None
+        self.recorder_heap = [(-recorder.current_entropy, id(recorder), recorder)
+                              for recorder in heapq.nsmallest(self.pool_size, candidates, key=lambda r: r.current_entropy)
+                              if recorder is not guide_recorder]
+        heapq.heapify(self.recorder_heap)
+        if guide_recorder is not None:
+            self._push_guide_recorder(self.recorder_heap, guide_recorder)
+        self._sync_recorder_list()
+
+    def _search_window(self, window: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int]):
+        """
+        在一个片段上正常搜索
+        """
+        for notes_map in window:
+            if len(notes_map['notes']) == 1:
+                self._update_monophonic_run(
+                    [notes_map], hand_range, finger_range, finger_distribution)
+            else:
+                self.update_recorder_pool(
+                    notes_map, hand_range, finger_range, finger_distribution)
+
+    def _extend_with_cached_passage(self, start_recorder: Recorder, cached_passage: CachedPassage, window: list[NotesMap]) -> Recorder:
+        """
+        把缓存的子路径接到start_recorder后面，frame换成当前片段的frame
+        """
+        return Recorder(
+            start_recorder.piano,
+            start_recorder.left_hands +
+            [hand for _, hand in cached_passage.left_steps],
+            start_recorder.right_hands +
+            [hand for _, hand in cached_passage.right_steps],
+            start_recorder.current_entropy + cached_passage.entropy_delta,
+            window[-1]['frame'],
+            start_recorder.left_frames +
+            [window[position]['frame']
+                for position, _ in cached_passage.left_steps],
+            start_recorder.right_frames +
+            [window[position]['frame']
+                for position, _ in cached_passage.right_steps],
+            start_recorder.hand_diff_cache
+        )
+
+    def _advance_warm_start(self, notes_map: NotesMap, hand_range: int, finger_range: float, finger_distribution: list[int]) -> Optional[Recorder]:
+        if self.warm_start is None:
+            return None
+        return self.warm_start.advance(notes_map, hand_range, finger_range, finger_distribution)
+
+    def _push_guide_recorder(self, recorder_heap: list[HeapElement], guide_recorder: Recorder):
+        """
+        把热启动的引导记录器放进堆里，池满时替换掉熵值最大的记录器
+        """
+        element = (-guide_recorder.current_entropy,
+                   id(guide_recorder), guide_recorder)
+        if len(recorder_heap) < self.pool_size:
+            heapq.heappush(recorder_heap, element)
+        else:
+            heapq.heapreplace(recorder_heap, element)
+
+    def shrink(self, pool_size: int):
+        """
+        修改pool_size，并且只保留熵值最小的pool_size个记录器，下一个和弦只从它们展开
+        """
+        self.pool_size = pool_size
+        if len(self.recorder_list) <= pool_size:
+            return
+        self.recorder_heap = [(-recorder.current_entropy, id(recorder), recorder)
+                              for recorder in heapq.nsmallest(pool_size, self.recorder_list, key=lambda r: r.current_entropy)]
+        heapq.heapify(self.recorder_heap)
+        self._sync_recorder_list()
+
+    def _sync_recorder_list(self):
+        self.recorder_list = [recorder for _, _, recorder in self.recorder_heap]
+        if self.recorder_heap:
+            self.max_entropy = -self.recorder_heap[0][0]
+
+    def _update_monophonic_run(self, notes_maps: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int], deadline: Optional[float] = None) -> bool:
+        """
+        处理一段连续的单音和弦，结果和逐个调用update_recorder_pool一样（同熵值时的取舍顺序除外）。
+
+        单音不会触发音域跨度和手指跨度的检查，也总能生成新的记录器，每个记录器只有10个候选（每个手指一个），区别只在于实现：
+        - 候选状态是_MonophonicState，不复制手型历史，也不创建Recorder，整段结束后才把留下来的状态还原成Recorder；
+        - 手型差异都不小于0，所以池满以后，熵值已经不低于堆顶的父状态可以整个跳过；
+        - 同一步里共享同一个手型的状态（兄弟状态中没有动过的那只手）只生成一次候选手型。
+
+        每处理完一个和弦都检查一次deadline，超过后把已经处理的部分还原成记录池，剩下的和弦不再处理。
+
+        Returns:
+            bool: 是否在deadline之前处理完了整段
+        """
+        if not self.recorder_list:
+            return deadline is None or time.perf_counter() <= deadline
+        warm_start = self.warm_start
+        if warm_start is not None and len(notes_maps) > 1:
+            # 引导记录器需要逐个和弦插入记录池
+            for notes_map in notes_maps:
+                if not self._update_monophonic_run(
+                        [notes_map], hand_range, finger_range, finger_distribution, deadline):
+                    return False
+            return True
+        entropy_limit = warm_start.entropy_limit(
+            notes_maps[0]['frame']) if warm_start is not None else float('inf')
+
+        states = [_MonophonicState(recorder.current_entropy, recorder.left_hands[-1], recorder.right_hands[-1], recorder=recorder)
+                  for recorder in self.recorder_list]
+        profiler = self.profiler
+        hand_diff_cache = self.recorder_list[0].hand_diff_cache
+        pool_size = self.pool_size
+        finger_number = len(finger_distribution)
+        piano = self.recorder_list[0].piano
+        counter = itertools.count()
+        processed = 0
+
+        for notes_map in notes_maps:
+            note = notes_map['notes'][0]
+            frame = notes_map['frame']
+            key_note = piano.note_to_key(note)
+            profile = profiler.begin_chord(
+                notes_map) if profiler is not None else None
+            # (id(上一个手型), finger_index) -> (新手型, 手型差异)
+            candidate_hands: dict[tuple[int, int], tuple[Hand, float]] = {}
+            heap: list[tuple[float, int, _MonophonicState]] = []
+
+            # 先展开熵值低的状态，池满以后可以更早地跳过剩下的状态
+            states.sort(key=lambda state: state.entropy)
+            for state in states:
+                if len(heap) >= pool_size and state.entropy >= -heap[0][0]:
+                    break
+                if state.entropy > entropy_limit:
+                    break
+
+                for finger_index in range(2 * finger_number):
+                    is_left = finger_index < finger_number
+                    current_hand = state.left_hand if is_left else state.right_hand
+                    candidate_key = (id(current_hand), finger_index)
+                    candidate = candidate_hands.get(candidate_key)
+                    if candidate is None:
+                        next_hand = current_hand.generate_next_hand(
+                            [Finger(finger_index, key_note, is_left, True)], finger_range, finger_distribution)
+                        if hand_diff_cache is None:
+                            hand_diff = current_hand.calculate_hand_diff(
+                                next_hand)
+                        else:
+                            hand_diff = hand_diff_cache.get_hand_diff(
+                                current_hand, next_hand)
+                        candidate = (next_hand, hand_diff)
+                        candidate_hands[candidate_key] = candidate
+                    if profile is not None:
+                        profile.combinations += 1
+
+                    entropy = state.entropy + candidate[1]
+                    if entropy > entropy_limit:
+                        warm_start.pruned_by_bound += 1  # type: ignore
+                        continue
+                    if len(heap) >= pool_size and entropy >= -heap[0][0]:
+                        continue
+
+                    next_state = _MonophonicState(
+                        entropy,
+                        candidate[0] if is_left else state.left_hand,
+                        state.right_hand if is_left else candidate[0],
+                        state, None, is_left, frame)
+                    if len(heap) < pool_size:
+                        if profile is not None:
+                            profile.pushed_to_heap += 1
+                        heapq.heappush(
+                            heap, (-entropy, next(counter), next_state))
+                    else:
+                        if profile is not None:
+                            profile.heap_replacements += 1
+                        heapq.heapreplace(
+                            heap, (-entropy, next(counter), next_state))
+
+            states = [state for _, _, state in heap]
+            if profiler is not None:
+                profiler.end_chord([state.entropy for state in states])
+
+            processed += 1
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+        self._materialize_monophonic_states(states)
+
+        if warm_start is not None:
+            guide_recorder = self._advance_warm_start(
+                notes_maps[0], hand_range, finger_range, finger_distribution)
+            if guide_recorder is not None:
+                self._push_guide_recorder(self.recorder_heap, guide_recorder)
+                self._sync_recorder_list()
+
+        if processed > 0:
+            self._commit_fixed_lag()
+        return processed == len(notes_maps) and (deadline is None or time.perf_counter() <= deadline)
+
+    def _materialize_monophonic_states(self, states: list[_MonophonicState]):
+        """
+        把单音快速路径留下来的状态还原成Recorder，替换当前的记录池
+        """
+        recorder_list: list[Recorder] = []
+        recorder_heap: list[HeapElement] = []
+
+        for state in states:
+            # 沿着指针回到起点，收集这一段里新增的手型
+            left_hands: list[Hand] = []
+            left_frames: list[float] = []
+            right_hands: list[Hand] = []
+            right_frames: list[float] = []
+            frame = state.frame
+            node = state
+            while node.parent is not None:
+                if node.moved_is_left:
+                    left_hands.append(node.left_hand)
+                    left_frames.append(node.frame)
+                else:
+                    right_hands.append(node.right_hand)
+                    right_frames.append(node.frame)
+                node = node.parent
+
+            root_recorder: Recorder = node.recorder  # type: ignore
+            if node is state:
+                # 没有走过任何一步，直接沿用原记录器
+                recorder = root_recorder
+            else:
+                left_hands.reverse()
+                left_frames.reverse()
+                right_hands.reverse()
+                right_frames.reverse()
+                recorder = Recorder(
+                    root_recorder.piano,
+                    root_recorder.left_hands + left_hands,
+                    root_recorder.right_hands + right_hands,
+                    state.entropy,
+                    frame,
+                    root_recorder.left_frames + left_frames,
+                    root_recorder.right_frames + right_frames,
+                    root_recorder.hand_diff_cache
+                )
+
+            recorder_list.append(recorder)
+            heapq.heappush(recorder_heap,
+                           (-recorder.current_entropy, id(recorder), recorder))
+
+        self.recorder_list = recorder_list
+        self.recorder_heap = recorder_heap
+        if recorder_heap:
+            self.max_entropy = -recorder_heap[0][0]
+
     def repeat_self(self, current_frame: float):
         """
         当无法生成新的记录器时，复制最佳记录器,添加一个和最后手型相似但所有手指pressed都相反的手型，并更新frame值
@@ -100,9 +610,10 @@ class RecorderPool():
 
         new_left_hands = best_recorder.left_hands[:]
         latest_left_hand = best_recorder.left_hands[-1]
-        new_left_fingers = latest_left_hand.fingers[:]
-        for left_finger in new_left_fingers:
-            left_finger.pressed = not left_finger.pressed
+        # 新建手指对象，避免修改上一个手型（以及共享它的其它记录器）中的手指
+        new_left_fingers = [Finger(left_finger.finger_index, left_finger.key_note, left_finger.is_left,
+                                    not left_finger.pressed, left_finger.is_keep_pressed)
+                             for left_finger in latest_left_hand.fingers]
         new_left_hand = Hand(new_left_fingers,
                              latest_left_hand.piano,
                              True,
@@ -112,9 +623,10 @@ class RecorderPool():
 
         new_right_hands = best_recorder.right_hands[:]
         latest_right_hand = best_recorder.right_hands[-1]
-        new_right_fingers = latest_right_hand.fingers[:]
-        for right_finger in new_right_fingers:
-            right_finger.pressed = not right_finger.pressed
+        # 新建手指对象，避免修改上一个手型（以及共享它的其它记录器）中的手指
+        new_right_fingers = [Finger(right_finger.finger_index, right_finger.key_note, right_finger.is_left,
+                                    not right_finger.pressed, right_finger.is_keep_pressed)
+                             for right_finger in latest_right_hand.fingers]
         new_right_hand = Hand(new_right_fingers,
                               latest_right_hand.piano,
                               False,
@@ -129,7 +641,8 @@ class RecorderPool():
             current_entropy=best_recorder.current_entropy,
             frame=new_frame,
             left_frames=new_left_frames,
-            right_frames=new_right_frames
+            right_frames=new_right_frames,
+            hand_diff_cache=best_recorder.hand_diff_cache
         )
 
         # 清空现有记录器列表和堆
@@ -140,11 +653,134 @@ class RecorderPool():
         heapq.heappush(self.recorder_heap,
                        (-repeated_recorder.current_entropy, id(repeated_recorder), repeated_recorder))
 
-    def export_pool_info(self, file_path: str):
+    def _commit_fixed_lag(self):
+        """
+        以最优记录器为准，每只手只保留最后commit_lag个手型（以及它们之前的一个手型作为计算的起点），更早的历史确定下来：
+
+        - 只保留和最优记录器在这之前历史相同的记录器（手型列表是逐代复制的，同一位置上是同一个Hand对象就说明之前的历史完全相同）；
+        - 确定的手型写入暂存文件，并从所有记录器中截掉。
+
+        每个和弦最多给每只手增加一个手型，所以确定下来的历史至少在commit_lag个和弦之前，
+        同一个frame上有多个和弦（多轨道midi）时也一样。
+        """
+        if self.commit_lag is None or not self.recorder_list or self.spool is None:
+            return
+
+        best_recorder = min(self.recorder_list,
+                            key=lambda r: r.current_entropy)
+        left_anchor = max(len(best_recorder.left_hands) -
+                          1 - self.commit_lag, 0)
+        right_anchor = max(len(best_recorder.right_hands) -
+                           1 - self.commit_lag, 0)
+        if left_anchor == 0 and right_anchor == 0:
+            return
+
+        left_anchor_hand = best_recorder.left_hands[left_anchor]
+        right_anchor_hand = best_recorder.right_hands[right_anchor]
+        survivors = [recorder for recorder in self.recorder_list
+                     if len(recorder.left_hands) > left_anchor and recorder.left_hands[left_anchor] is left_anchor_hand
+                     and len(recorder.right_hands) > right_anchor and recorder.right_hands[right_anchor] is right_anchor_hand]
+        self.pruned_by_commit += len(self.recorder_list) - len(survivors)
+
+        spool = self.spool
+        committed_states = self.committed_states
+        for hand, frame in zip(best_recorder.left_hands[:left_anchor], best_recorder.left_frames[:left_anchor]):
+            hand_state = spool.write(True, hand.export_hand_info(),
+                                     frame, hand.fingers[4].key_note.note)
+            if committed_states is not None:
+                committed_states.append(hand_state)
+        for hand, frame in zip(best_recorder.right_hands[:right_anchor], best_recorder.right_frames[:right_anchor]):
+            hand_state = spool.write(False, hand.export_hand_info(),
+                                     frame, hand.fingers[0].key_note.note)
+            if committed_states is not None:
+                committed_states.append(hand_state)
+
+        warm_start = self.warm_start
+        guide_recorder = warm_start.guide_recorder if warm_start is not None else None
+        if guide_recorder is not None and guide_recorder not in survivors:
+            # 引导路径是单独生成的，Hand对象和池中的不同，只能按内容比较
+            if self._has_same_prefix(guide_recorder, best_recorder, left_anchor, right_anchor):
+                self._trim_recorder(
+                    guide_recorder, left_anchor, right_anchor)
+            else:
+                print('提交的历史和热启动的引导路径不同，不再使用热启动')
+                warm_start.guide_recorder = None  # type: ignore
+                warm_start.upper_bound = float('inf')  # type: ignore
+
+        trimmed: set[int] = set()
+        for recorder in survivors:
+            if id(recorder) not in trimmed:
+                trimmed.add(id(recorder))
+                self._trim_recorder(recorder, left_anchor, right_anchor)
+
+        self.recorder_list = survivors
+        self.recorder_heap = [(-recorder.current_entropy, id(recorder), recorder)
+                              for recorder in survivors]
+        heapq.heapify(self.recorder_heap)
+        self.max_entropy = -self.recorder_heap[0][0]
+        self.commit_count += 1
+
+    def pop_committed_states(self) -> list[dict]:
+        """
+        取走上次调用之后提交的手型状态（需要collect_committed_states=True），先左手后右手，每只手按frame排序
+        """
+        if self.committed_states is None:
+            raise ValueError('创建记录池时没有设置collect_committed_states=True')
+        committed_states = self.committed_states
+        self.committed_states = []
+        return committed_states
+
+    def _has_same_prefix(self, recorder: Recorder, best_recorder: Recorder, left_anchor: int, right_anchor: int) -> bool:
+        if len(recorder.left_hands) <= left_anchor or len(recorder.right_hands) <= right_anchor:
+            return False
+        for hands, frames, best_hands, best_frames, anchor in (
+                (recorder.left_hands, recorder.left_frames,
+                 best_recorder.left_hands, best_recorder.left_frames, left_anchor),
+                (recorder.right_hands, recorder.right_frames, best_recorder.right_hands, best_recorder.right_frames, right_anchor)):
+            for i in range(anchor + 1):
+                if frames[i] != best_frames[i] or hands[i].get_signature() != best_hands[i].get_signature():
+                    return False
+        return True
+
+    def _trim_recorder(self, recorder: Recorder, left_anchor: int, right_anchor: int):
+        recorder.left_hands = recorder.left_hands[left_anchor:]
+        recorder.left_frames = recorder.left_frames[left_anchor:]
+        recorder.right_hands = recorder.right_hands[right_anchor:]
+        recorder.right_frames = recorder.right_frames[right_anchor:]
+
+    def close(self):
+        """
+        搜索结束，关闭固定延迟提交的暂存文件（临时文件会被删掉），可以重复调用。
+        关闭后已经提交的历史不能再读取，export_pool_info也不能再调用
+        """
+        if self.spool is not None:
+            self.spool.close()
+        self.closed = True
+
+    def __enter__(self) -> 'RecorderPool':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def export_pool_info(self, file_path: str, close: bool = True):
+        """
+        导出最优记录器的完整指法
+
+        Args:
+            close: 导出后是否调用close()，默认为True
+        """
+        if self.closed and self.spool is not None:
+            raise ValueError('记录池已经关闭，搜索过程中提交的手型状态已不可用')
         best_recorder: Recorder = min(self.recorder_list,
                                       key=lambda r: r.current_entropy)
 
         print(f'最优记录的熵值为：{best_recorder.current_entropy}')
+        if self.spool is not None:
+            print(f'搜索过程中已提交{len(self.spool)}个手型状态，'
+                  f'因历史和最优记录不同淘汰了{self.pruned_by_commit}个记录器')
 
-        best_recorder.export_recorders(file_path)
+        best_recorder.export_recorders(file_path, self.spool)
         print(f'已保存至{file_path}')
+        if close:
+            self.close()
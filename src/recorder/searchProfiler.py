@@ -0,0 +1,139 @@
+import csv
+import json
+import time
+from typing import Optional
+from src.midi.midiToNotes import NotesMap
+
+
+class ChordProfile:
+    """
+    单个和弦在指法搜索中的统计信息
+    """
+
+    def __init__(self, step: int, frame: float, notes: list[int]):
+        self.step = step
+        self.frame = frame
+        self.notes = notes
+        self.chord_size = len(notes)
+        # 枚举过的手指组合数量
+        self.combinations = 0
+        # 因为单手音域跨度超过hand_range而被淘汰的次数：生成手指组合时按前缀剪枝，一次淘汰的是整个分支，而不是一个完整的组合
+        self.rejected_by_span = 0
+        # 因为相邻手指跨度超过finger_range而被淘汰的次数，同样按前缀分支计数
+        self.rejected_by_finger_distance = 0
+        # 进入堆的记录器数量，以及在池满时替换掉堆顶的次数
+        self.pushed_to_heap = 0
+        self.heap_replacements = 0
+        self.time_spent = 0.0
+        # 本步结束后池中熵值的最小值和最大值
+        self.entropy_min = 0.0
+        self.entropy_max = 0.0
+        self.pool_size = 0
+        # 是否因为没有生成新的记录器而退回到repeat_self
+        self.repeated = False
+
+    def export_profile_info(self) -> dict:
+        return {
+            'step': self.step,
+            'frame': self.frame,
+            'notes': self.notes,
+            'chord_size': self.chord_size,
+            'combinations': self.combinations,
+            'rejected_by_span': self.rejected_by_span,
+            'rejected_by_finger_distance': self.rejected_by_finger_distance,
+            'pushed_to_heap': self.pushed_to_heap,
+            'heap_replacements': self.heap_replacements,
+            'time_spent': self.time_spent,
+            'entropy_min': self.entropy_min,
+            'entropy_max': self.entropy_max,
+            'pool_size': self.pool_size,
+            'repeated': self.repeated
+        }
+
+
+class SearchProfiler:
+    """
+    指法搜索的逐步统计工具。把它传给RecorderPool后，每次update_recorder_pool都会记录一条ChordProfile；
+    不传的时候搜索代码只多出几次None判断，几乎没有额外开销。
+    """
+
+    def __init__(self):
+        self.profiles: list[ChordProfile] = []
+        self.current: Optional[ChordProfile] = None
+        self._start_time = 0.0
+
+    def begin_chord(self, notes_map: NotesMap) -> ChordProfile:
+        self.current = ChordProfile(
+            len(self.profiles), notes_map['frame'], list(notes_map['notes']))
+        self._start_time = time.perf_counter()
+        return self.current
+
+    def end_chord(self, entropies: list[float]):
+        """
+        结束当前和弦的统计
+
+        Args:
+            entropies: 本步结束后池中所有记录器的熵值
+        """
+        profile = self.current
+        if profile is None:
+            return
+
+        profile.time_spent = time.perf_counter() - self._start_time
+        profile.pool_size = len(entropies)
+        if entropies:
+            profile.entropy_min = min(entropies)
+            profile.entropy_max = max(entropies)
+        self.profiles.append(profile)
+        self.current = None
+
+    def summary(self, top_n: int = 10) -> dict:
+        """
+        汇总所有和弦的统计结果，并按耗时列出最慢的top_n个和弦
+        """
+        total_time = sum(profile.time_spent for profile in self.profiles)
+        worst_profiles = sorted(
+            self.profiles, key=lambda p: p.time_spent, reverse=True)[:top_n]
+
+        return {
+            'total_chords': len(self.profiles),
+            'total_time': total_time,
+            'total_combinations': sum(p.combinations for p in self.profiles),
+            'total_rejected_by_span': sum(p.rejected_by_span for p in self.profiles),
+            'total_rejected_by_finger_distance': sum(p.rejected_by_finger_distance for p in self.profiles),
+            'total_pushed_to_heap': sum(p.pushed_to_heap for p in self.profiles),
+            'total_heap_replacements': sum(p.heap_replacements for p in self.profiles),
+            'repeated_chords': sum(1 for p in self.profiles if p.repeated),
+            'worst_chords': [profile.export_profile_info() for profile in worst_profiles]
+        }
+
+    def export_csv(self, file_path: str):
+        fieldnames = list(ChordProfile(0, 0.0, []).export_profile_info().keys())
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            for profile in self.profiles:
+                writer.writerow(profile.export_profile_info())
+        print(f'搜索统计已保存至{file_path}')
+
+    def export_json(self, file_path: str, top_n: int = 10):
+        result = {
+            'summary': self.summary(top_n),
+            'chords': [profile.export_profile_info() for profile in self.profiles]
+        }
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        print(f'搜索统计已保存至{file_path}')
+
+    def print_summary(self, top_n: int = 10):
+        summary = self.summary(top_n)
+        print(f'一共{summary["total_chords"]}个和弦，总耗时{summary["total_time"]:.3f}秒，'
+              f'枚举组合{summary["total_combinations"]}个，'
+              f'因跨度淘汰{summary["total_rejected_by_span"]}个分支，'
+              f'因手指距离淘汰{summary["total_rejected_by_finger_distance"]}个分支')
+        print(f'耗时最多的{len(summary["worst_chords"])}个和弦：')
+        for info in summary['worst_chords']:
+            print(f'  step={info["step"]}, frame={info["frame"]:.1f}, notes={info["notes"]}, '
+                  f'耗时{info["time_spent"]*1000:.2f}ms, 组合{info["combinations"]}个, '
+                  f'入堆{info["pushed_to_heap"]}次, 替换{info["heap_replacements"]}次, '
+                  f'熵值范围[{info["entropy_min"]}, {info["entropy_max"]}]')
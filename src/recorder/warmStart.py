@@ -0,0 +1,293 @@
+from typing import Optional
+from src.midi.midiToNotes import NotesMap
+from src.piano.piano import Piano
+from src.recorder.recorder import Recorder
+from src.recorder.handFile import HandTimeline
+from src.hand.reachability import find_unreachable_range
+
+
+class WarmStart:
+    """
+    用上一次的指法结果热启动新的搜索。
+
+    调整hand_range或pool_size后重新搜索时，上一次的.hand文件里已经有一条完整的指法。
+    这里先从中还原出每个和弦的音符到手指的映射，在新参数下重新计算这条路径（引导路径）的熵值，作为总熵值的上界：
+
+    - 搜索时引导路径会一步步跟着前进，并且始终放在记录池里，所以最终结果不会比它差；
+    - 任何候选的累计熵值加上剩余部分的下界超过上界时直接淘汰。
+
+    剩余部分的下界是后面每个和弦手型差异下界之和（从最后一个和弦往前累加，预先算好）。
+    一个和弦的手型差异取决于前一个手型，无法预先知道，但其中跨区的惩罚只取决于新的手型，见_chord_lower_bound。
+    音域中间的和弦（左右手都要跨区才能按到）下界大于0，所以离曲子结尾还远时也能淘汰候选。
+
+    上一次的映射在新参数下不合法，或者找不到对应的和弦时，引导路径在这一步退回到贪心选择（熵值最小的候选）。
+    """
+
+    def __init__(self, initial_recorder: Recorder, mappings: list[tuple[float, dict[int, int]]], upper_bound: float, remaining_lower_bounds: Optional[list[float]] = None):
+        self.initial_recorder = initial_recorder
+        # 按和弦顺序排列的(frame, 引导路径在这个和弦上使用的音符到手指的映射)
+        self.mappings = mappings
+        self.upper_bound = upper_bound
+        # remaining_lower_bounds[i]是第i个和弦及之后所有和弦手型差异下界之和，长度为len(mappings) + 1
+        self.remaining_lower_bounds = remaining_lower_bounds if remaining_lower_bounds is not None else [
+            0.0] * (len(mappings) + 1)
+        self._position = 0
+        # 搜索过程中的引导记录器
+        self.guide_recorder: Optional[Recorder] = initial_recorder
+        # 统计信息：预先计算时沿用上一次指法/贪心补全的和弦数量，搜索时引导路径前进的步数，因超过上界被淘汰的候选数量
+        self.reused_chords = 0
+        self.fallback_chords = 0
+        self.guided_chords = 0
+        self.pruned_by_bound = 0
+
+    @classmethod
+    def from_hand_file(cls, file_path: str, initial_recorder: Recorder, notes_maps: list[NotesMap], hand_range: int, finger_range: float, finger_distribution: list[int]) -> 'WarmStart':
+        """
+        读取上一次导出的.hand（或.npy、.npz）文件，在新参数下重新计算引导路径和上界
+        """
+        previous_mappings = match_previous_mappings(
+            load_struck_states(file_path), notes_maps)
+
+        mappings: list[tuple[float, dict[int, int]]] = []
+        reused_chords = 0
+        fallback_chords = 0
+        guide_recorder = initial_recorder
+        for notes_map, mapping in zip(notes_maps, previous_mappings):
+            frame = notes_map['frame']
+            next_recorder = None
+            if mapping is not None:
+                next_recorder = guide_recorder._create_new_recorder(
+                    mapping, hand_range, finger_range, finger_distribution, frame)
+
+            if next_recorder is not None:
+                reused_chords += 1
+            else:
+                fallback_chords += 1
+                mapping, next_recorder = _choose_greedy_mapping(
+                    guide_recorder, notes_map, hand_range, finger_range, finger_distribution)
+                if next_recorder is None:
+                    # 这个和弦怎么都生成不了新的记录器，引导路径没法继续，不做热启动
+                    print(f'警告：引导路径在frame为{frame}时中断，不使用热启动')
+                    warm_start = cls(initial_recorder, [], float('inf'))
+                    warm_start.guide_recorder = None
+                    return warm_start
+
+            mappings.append((frame, mapping))  # type: ignore
+            guide_recorder = next_recorder
+
+        latest_hand = initial_recorder.left_hands[-1]
+        remaining_lower_bounds = [0.0] * (len(notes_maps) + 1)
+        for index in range(len(notes_maps) - 1, -1, -1):
+            remaining_lower_bounds[index] = remaining_lower_bounds[index + 1] + _chord_lower_bound(
+                notes_maps[index]['notes'], initial_recorder.piano, latest_hand.max_distance, hand_range, finger_range, finger_distribution)
+
+        warm_start = cls(initial_recorder, mappings,
+                         guide_recorder.current_entropy, remaining_lower_bounds)
+        warm_start.reused_chords = reused_chords
+        warm_start.fallback_chords = fallback_chords
+        print(f'热启动：沿用上一次指法{reused_chords}个和弦，贪心补全{fallback_chords}个和弦，'
+              f'熵值上界为{warm_start.upper_bound}，剩余部分的下界为{remaining_lower_bounds[0]}')
+        return warm_start
+
+    def entropy_limit(self, frame: float) -> float:
+        """
+        处理frame上的这个和弦时，候选的累计熵值不能超过的值：上界减去后面所有和弦的下界
+        """
+        position = self._position
+        if position < len(self.mappings) and self.mappings[position][0] == frame:
+            return self.upper_bound - self.remaining_lower_bounds[position + 1]
+        return self.upper_bound
+
+    def advance(self, notes_map: NotesMap, hand_range: int, finger_range: float, finger_distribution: list[int]) -> Optional[Recorder]:
+        """
+        让引导记录器前进一个和弦，返回新的引导记录器
+        """
+        if self.guide_recorder is None:
+            return None
+
+        frame = notes_map['frame']
+        next_recorder = None
+        if self._position < len(self.mappings) and self.mappings[self._position][0] == frame:
+            mapping = self.mappings[self._position][1]
+            self._position += 1
+            next_recorder = self.guide_recorder._create_new_recorder(
+                mapping, hand_range, finger_range, finger_distribution, frame)
+        if next_recorder is None:
+            # 和预先计算时的和弦对不上（例如传入了不同的notes_maps），引导路径到此为止
+            print(f'警告：引导路径在frame为{frame}时中断')
+            self.upper_bound = float('inf')
+
+        self.guide_recorder = next_recorder
+        if next_recorder is not None:
+            self.guided_chords += 1
+        return next_recorder
+
+    def export_stats(self) -> dict:
+        return {
+            'upper_bound': self.upper_bound,
+            'lower_bound': self.remaining_lower_bounds[0],
+            'reused_chords': self.reused_chords,
+            'fallback_chords': self.fallback_chords,
+            'guided_chords': self.guided_chords,
+            'pruned_by_bound': self.pruned_by_bound
+        }
+
+    def print_stats(self):
+        print(f'热启动：熵值上界{self.upper_bound}，下界{self.remaining_lower_bounds[0]}，引导路径前进{self.guided_chords}步，'
+              f'因超过上界淘汰{self.pruned_by_bound}个候选')
+
+
+def load_struck_states(file_path: str) -> dict[float, tuple[list[dict[int, int]], list[dict[int, int]]]]:
+    """
+    从.hand文件中读取每个手型状态新按下的键：只看按下且不是保持按下的手指，
+    处理左右手冲突时插入的手型不按任何键，会被自然跳过。
+
+    Returns:
+        dict: frame -> (左手状态列表, 右手状态列表)，每个状态是音符到手指的映射，按文件中的顺序排列
+    """
+    hand_timeline = HandTimeline.load(file_path)
+    finger_number = hand_timeline.finger_number
+    struck = hand_timeline.pressed & ~hand_timeline.keep_pressed
+
+    struck_states: dict[float, tuple[list[dict[int, int]], list[dict[int, int]]]] = {}
+    for index in range(len(hand_timeline)):
+        slots = struck[index].nonzero()[0]
+        if len(slots) == 0:
+            continue
+        is_left = bool(hand_timeline.is_left[index])
+        offset = 0 if is_left else finger_number
+        mapping = {int(hand_timeline.note[index, slot]): int(slot) + offset
+                   for slot in slots}
+        left_states, right_states = struck_states.setdefault(
+            float(hand_timeline.frame[index]), ([], []))
+        (left_states if is_left else right_states).append(mapping)
+
+    return struck_states
+
+
+def match_previous_mappings(struck_states: dict[float, tuple[list[dict[int, int]], list[dict[int, int]]]], notes_maps: list[NotesMap]) -> list[Optional[dict[int, int]]]:
+    """
+    给每个和弦找出上一次使用的音符到手指的映射，找不到时为None。
+
+    不同轨道的和弦可能落在同一个frame上（甚至完全相同），所以同一个frame上的和弦要整体对齐：
+    每只手的状态在文件中是按和弦顺序排列的，每个和弦按顺序使用下一个左手状态和/或下一个右手状态，
+    它们按下的音符必须恰好是这个和弦的音符，并且所有状态都要用完。
+    """
+    mappings: list[Optional[dict[int, int]]] = []
+    index = 0
+    while index < len(notes_maps):
+        frame = notes_maps[index]['frame']
+        end = index
+        while end < len(notes_maps) and notes_maps[end]['frame'] == frame:
+            end += 1
+
+        chord_notes = [notes_map['notes']
+                       for notes_map in notes_maps[index:end]]
+        left_states, right_states = struck_states.get(frame, ([], []))
+        aligned = _align_frame_mappings(
+            chord_notes, left_states, right_states)
+        mappings.extend(aligned if aligned is not None else [
+                        None] * len(chord_notes))
+        index = end
+
+    return mappings
+
+
+def _align_frame_mappings(chord_notes: list[list[int]], left_states: list[dict[int, int]], right_states: list[dict[int, int]]) -> Optional[list[dict[int, int]]]:
+    memo: dict[tuple[int, int, int], Optional[list[dict[int, int]]]] = {}
+
+    def solve(chord_index: int, left_index: int, right_index: int) -> Optional[list[dict[int, int]]]:
+        if chord_index == len(chord_notes):
+            if left_index == len(left_states) and right_index == len(right_states):
+                return []
+            return None
+
+        key = (chord_index, left_index, right_index)
+        if key in memo:
+            return memo[key]
+
+        result = None
+        for take_left, take_right in ((True, True), (True, False), (False, True)):
+            if (take_left and left_index >= len(left_states)) or (take_right and right_index >= len(right_states)):
+                continue
+            mapping = _merge_hand_mappings(
+                chord_notes[chord_index],
+                left_states[left_index] if take_left else None,
+                right_states[right_index] if take_right else None)
+            if mapping is None:
+                continue
+            rest = solve(chord_index + 1, left_index +
+                         take_left, right_index + take_right)
+            if rest is not None:
+                result = [mapping] + rest
+                break
+
+        memo[key] = result
+        return result
+
+    return solve(0, 0, 0)
+
+
+def _merge_hand_mappings(notes: list[int], left_mapping: Optional[dict[int, int]], right_mapping: Optional[dict[int, int]]) -> Optional[dict[int, int]]:
+    """
+    左右手按下的音符恰好是这个和弦的音符，并且手指随音高递增时，返回合并后的映射
+    """
+    merged: dict[int, int] = {}
+    if left_mapping is not None:
+        merged.update(left_mapping)
+    if right_mapping is not None:
+        if set(merged) & set(right_mapping):
+            return None
+        merged.update(right_mapping)
+    if len(merged) != len(notes) or any(note not in merged for note in notes):
+        return None
+
+    fingers = [merged[note] for note in notes]
+    if any(fingers[i] >= fingers[i + 1] for i in range(len(fingers) - 1)):
+        return None
+    return {note: merged[note] for note in notes}
+
+
+def _chord_lower_bound(notes: list[int], piano: Piano, max_distance: int, hand_range: int, finger_range: float, finger_distribution: list[int]) -> float:
+    """
+    不管前一个手型是什么、用哪种指法，按下这个和弦的手型差异至少是多少。
+
+    Hand.calculate_hand_diff中手指移动的部分取决于前一个手型，可能为0，但跨区的惩罚只取决于新的手型：
+    手指跨度不超过max_distance，所以左手的hand_note不低于它按下的最高音减去max_distance / 2，
+    右手的hand_note不高于它按下的最低音加上max_distance / 2。左手按音符的前缀，右手按后缀，取所有分法中惩罚之和的最小值。
+
+    两只手都按不下的和弦不会让记录器的熵值增加（只保留原最佳记录），下界为0。
+    """
+    if not notes or find_unreachable_range(notes, hand_range, finger_range, finger_distribution) is not None:
+        return 0.0
+
+    finger_number = len(finger_distribution)
+    half_distance = max_distance / 2
+    lower_bound = float('inf')
+    for split in range(len(notes) + 1):
+        if split > finger_number or len(notes) - split > finger_number:
+            continue
+        penalty = 0.0
+        if split > 0:
+            # 和calculate_hand_diff一样，每跨过一个音乘5
+            penalty += 5 * max(0.0, notes[split - 1] -
+                               half_distance - piano.middle_left)
+        if split < len(notes):
+            penalty += 5 * max(0.0, piano.middle_right -
+                               notes[split] - half_distance)
+        lower_bound = min(lower_bound, penalty)
+    return lower_bound if lower_bound != float('inf') else 0.0
+
+
+def _choose_greedy_mapping(recorder: Recorder, notes_map: NotesMap, hand_range: int, finger_range: float, finger_distribution: list[int]) -> tuple[Optional[dict[int, int]], Optional[Recorder]]:
+    best_mapping = None
+    best_recorder = None
+    notes = notes_map['notes']
+    for finger_combination in Recorder.finger_combinations_generator(notes, hand_range, finger_range, finger_distribution):
+        mapping = dict(zip(notes, finger_combination))
+        next_recorder = recorder._create_new_recorder(
+            mapping, hand_range, finger_range, finger_distribution, notes_map['frame'])
+        if next_recorder is not None and (best_recorder is None or next_recorder.current_entropy < best_recorder.current_entropy):
+            best_mapping = mapping
+            best_recorder = next_recorder
+    return best_mapping, best_recorder
@@ -287,6 +287,80 @@ def lerp(a: np.ndarray, b: np.ndarray, t: float) -> np.ndarray:
         return slerp(a, b, t)
 
 
+def tan_weight_transform_batch(q0: np.ndarray, q1: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    tan_weight_transform的数组版本
+
+    参数:
+    q0, q1: 形状为(N, 4)的旋转值
+    t: 形状为(N,)的原始权重值
+
+    返回:
+    形状为(N,)的变换后的权重值
+
+    两个旋转值相同时点积可能因为舍入略大于1，标量版本会因此得到nan，这里先把点积截断到[-1, 1]
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        angle = np.arccos(np.clip(np.einsum('ij,ij->i', q0, q1), -1.0, 1.0))
+        angle_interpolated = np.arctan(np.tan(angle) * t)
+        # 夹角为0时返回原始权重值
+        return np.where(angle == 0, t, angle_interpolated / angle)
+
+
+def slerp_batch(q1: np.ndarray, q2: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    slerp的数组版本，一次插值N对四元数
+
+    参数:
+    q1, q2: 形状为(N, 4)的四元数，格式为 [w, x, y, z]
+    t: 形状为(N,)的插值参数，范围 [0, 1]
+
+    返回:
+    形状为(N, 4)的插值后的四元数
+    """
+    # 标准化四元数
+    q1 = q1 / np.linalg.norm(q1, axis=1, keepdims=True)
+    q2 = q2 / np.linalg.norm(q2, axis=1, keepdims=True)
+
+    # 计算点积，点积为负时取反一个四元数以选择较短的路径
+    dot = np.einsum('ij,ij->i', q1, q2)
+    is_negative = dot < 0.0
+    q2 = np.where(is_negative[:, None], -q2, q2)
+    dot = np.where(is_negative, -dot, dot)
+
+    t = t[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 四元数非常接近时使用线性插值，避免数值问题
+        linear = q1 + t * (q2 - q1)
+        linear = linear / np.linalg.norm(linear, axis=1, keepdims=True)
+
+        theta = np.arccos(np.clip(dot, -1.0, 1.0))[:, None] * t
+        q3 = q2 - q1 * dot[:, None]
+        q3 = q3 / np.linalg.norm(q3, axis=1, keepdims=True)
+        spherical = q1 * np.cos(theta) + q3 * np.sin(theta)
+
+    return np.where((dot > 0.9995)[:, None], linear, spherical)
+
+
+def lerp_batch(a: np.ndarray, b: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    lerp的数组版本：权重不大于0时取a，不小于1时取b，其余情况位置做线性插值，四元数做tan权重变换后的球面插值
+
+    参数:
+    a, b: 形状为(N, 3)的位置或者(N, 4)的四元数
+    t: 形状为(N,)的权重
+    """
+    if a.shape != b.shape:
+        raise ValueError("Arrays must have the same length")
+
+    if a.shape[1] != 4:
+        interpolated = a + t[:, None] * (b - a)
+    else:
+        interpolated = slerp_batch(a, b, tan_weight_transform_batch(a, b, t))
+
+    return np.where((t <= 0)[:, None], a, np.where((t >= 1)[:, None], b, interpolated))
+
+
 def lerp_with_key_type_and_position(white_key_value: int, position: int, high_position: int, middle_position: int, low_position: int, high_white: np.ndarray, high_black: np.ndarray, middle_white: np.ndarray, middle_black: np.ndarray, low_white: np.ndarray, low_black: np.ndarray) -> np.ndarray:
     middle_value = middle_white if white_key_value == 1 else middle_black
     high_value = high_white if white_key_value == 1 else high_black